@@ -2,6 +2,7 @@
 on the command line when the program is run, or you can alter the default values
 here
 """
+import sys
 import argparse
 
 """ function needed to convert str representation of bool values
@@ -31,8 +32,11 @@ def parse_show_text(txt):
 #  to abiguity if the program is started automatically on boot.
 parse = argparse.ArgumentParser("start running a picture frame")
 parse.add_argument("-a", "--blur_amount",   default=12, type=float, help="larger values than 12 will increase processing load quite a bit")
+parse.add_argument(      "--blur_width",    default=64, type=int, help="width in pixels the blurred backdrop is made at - the GPU scales it up to fill the screen")
 parse.add_argument("-b", "--blur_edges",    default=True, type=str_to_bool, help="use blurred version of image to fill edges - will override FIT = False")
+parse.add_argument(      "--cache_dir",     default="/home/pi/.cache/photowall", help="where to keep blurred backdrops and other work that can be reused next time a photo comes round")
 parse.add_argument("-c", "--check_dir_tm",  default=60.0, type=float, help="time in seconds between checking if the image directory has changed")
+parse.add_argument(      "--control_socket",default="/tmp/photowall.sock", help="unix socket for live changes with control.py, empty to switch it off")
 parse.add_argument("-d", "--verbose",       default=False, type=str_to_bool, help="show try/exception messages (True for debugging)")
 parse.add_argument("-e", "--edge_alpha",    default=0.5, type=float, help="background colour at edge. 1.0 would show reflection of image")
 parse.add_argument("-f", "--fps",           default=20.0, type=float)
@@ -41,22 +45,45 @@ parse.add_argument(      "--portrait_pairs",default=False, type=str_to_bool, hel
 parse.add_argument("-i", "--no_files_img",  default="/home/pi/pi3d_demos/PictureFrame2020img.jpg", help="image to show if none selected")
 parse.add_argument("-j", "--blend_type",    default="blend", choices=["blend", "burn", "bump"], help="type of blend the shader can do")
 parse.add_argument("-k", "--keyboard",      default=False, type=str_to_bool, help="set to False when running headless to avoid curses error (True for debugging)")
+parse.add_argument(      "--mem_debug",     default=False, type=str_to_bool, help="use tracemalloc to report what each stage of loading a photo allocates")
+parse.add_argument(      "--mirror",        default=False, type=str_to_bool, help="copy photos about to be shown from a network or USB pic_dir to the SD card first, see mirror.py")
+parse.add_argument(      "--mirror_mb",     default=4000, type=int, help="MB the mirror is kept under")
 parse.add_argument("-m", "--use_mqtt",      default=True)
 parse.add_argument(      "--mqtt_server",   default="localhost")
 parse.add_argument(      "--mqtt_port",     default=1883, type=int)
 parse.add_argument(      "--mqtt_login",    default="")
 parse.add_argument(      "--mqtt_password", default="")
 parse.add_argument(      "--mqtt_id",       default="frame", help="prepended onto all the message strings with a / separator added")
-parse.add_argument("-n", "--recent_n",      default=0, type=int, help="when shuffling keep n most recent ones to play before the rest")
+parse.add_argument(      "--node_index",    default=0, type=int, help="which screen of a multi Pi wall this is counting from the left, 0 for the leftmost")
+parse.add_argument("-n", "--recent_n",      default=0, type=int, help="when shuffling play the n most recent ones mostly before the rest, see play_sampler.py")
 parse.add_argument("-o", "--font_file",     default="/home/pi/pi3d_demos/fonts/NotoSans-Regular.ttf")
 parse.add_argument("-p", "--pic_dir",       default="/home/pi/Pictures")
 parse.add_argument("-q", "--shader",        default="/home/pi/pi3d_demos/shaders/blend_new")
+parse.add_argument(      "--raw_cache",     default=False, type=str_to_bool, help="also keep renders as raw pixels that are mapped straight into textures, see raw_cache.py")
+parse.add_argument(      "--raw_cache_mb",  default=2000, type=int, help="MB the raw cache is trimmed to")
+parse.add_argument(      "--render_cache_mb",default=2000, type=int, help="MB the renders and backdrops in the render cache are trimmed to, see render_cache.py")
+parse.add_argument(      "--render_delay",  default=0.0, type=float, help="seconds render_server.py waits before answering, to try out the frame's fallback")
+parse.add_argument(      "--render_port",   default=5871, type=int, help="port render_server.py listens on")
+parse.add_argument(      "--render_processes",default=0, type=int, help="mat photos in this many worker processes sharing the mat resources, 0 to do it in the loader threads. see shared_assets.py")
+parse.add_argument(      "--render_server", default="", help="URL of a render_server.py to do the matting i.e. http://homeserver:5871, empty to render here")
+parse.add_argument(      "--render_timeout",default=10.0, type=float, help="seconds to wait for the render server before rendering here instead")
+parse.add_argument(      "--render_workers",default=0, type=int, help="processes used by warm_cache.py to render the library, 0 for one per core")
+parse.add_argument(      "--rss_ceiling",   default=600, type=float, help="MB of resident memory the loaders keep under when starting another photo")
 parse.add_argument("-r", "--reshuffle_num", default=1, type=int, help="times through before reshuffling")
 parse.add_argument("-s", "--show_text_tm",  default=6.0, type=float, help="time to show text over the image")
 parse.add_argument(      "--show_text_fm",  default="%b %d, %Y", help="format to show date over the image")
 parse.add_argument(      "--show_text_sz",  default=40, type=int, help="text character size")
 parse.add_argument(      "--show_text",     default="date folder location", help="show text, include combination of words: name, date, location")
 parse.add_argument(      "--text_width",    default=90, type=int, help="number of character before breaking into new line")
+parse.add_argument(      "--tile_size",     default=0, type=int, help="show photos bigger than one texture as tiles this many pixels square i.e. 1024 for a 4K wall, 0 to shrink them to fit. see tiled_sprite.py")
+parse.add_argument(      "--upload_ms",     default=4.0, type=float, help="milliseconds a frame spent putting new photos onto the GPU, see upload_scheduler.py")
+parse.add_argument(      "--thermal_target",default=75.0, type=float, help="degrees C to keep the SoC under by slowing the frame rate, loaders and matting, 0 for off. see thermal.py")
+parse.add_argument(      "--thermal_temp_path",default="/sys/class/thermal/thermal_zone0/temp", help="file with the SoC temperature in millidegrees, vcgencmd measure_temp is tried if it can't be read")
+parse.add_argument(      "--vcgencmd",      default="vcgencmd", help="vcgencmd to ask for the temperature and throttle state, can be a script that fakes it")
+parse.add_argument(      "--sync_host",     default="localhost", help="address of the coordinator for a follower to connect to")
+parse.add_argument(      "--sync_nodes",    default=1, type=int, help="number of screens side by side in the wall, set on the coordinator")
+parse.add_argument(      "--sync_port",     default=5870, type=int, help="TCP port the coordinator listens on")
+parse.add_argument(      "--sync_role",     default="none", choices=["none", "coordinator", "follower"], help="part played in a wall across several Pis, see wall_sync.py")
 parse.add_argument("-t", "--fit",           default=False, type=str_to_bool, help="shrink to fit screen i.e. don't crop")
 parse.add_argument(      "--fit_portrait",  default=True, type=str_to_bool, help="shrink to fit screen of portrait images i.e. don't crop")
 parse.add_argument("-u", "--kenburns",      default=False, type=str_to_bool, help="will set FIT->False and BLUR_EDGES->False")
@@ -68,14 +95,38 @@ parse.add_argument("-z", "--blur_zoom",     default=1.0, type=float, help="must
 parse.add_argument(      "--auto_resize",   default=True, type=str_to_bool, help="set this to false if you want to use 4K resolution on Raspberry Pi 4. You should ensure your images are the correct size for the display")
 parse.add_argument(      "--delay_exif",    default=True, type=str_to_bool, help="set this to false if there are problems with date filtering - it will take a long time for initial loading if there are many images.")
 parse.add_argument(      "--locale",        default="en_US.utf8", help="set the locale")
-parse.add_argument(      "--load_geoloc",   default=True, type=str_to_bool, help="load geolocation code")
-parse.add_argument(      "--geo_key",       default="picture_frame_hello", help="set the Nominatim key - change to something unique to you")
-parse.add_argument(      "--geo_path",      default="/home/pi/PictureFrame2020gpsdata.txt", help="set the local file to store data from geopy - ignored if --load_geoloc is not true")
+parse.add_argument(      "--load_geoloc",   default=True, type=str_to_bool, help="name the place each photo was taken from its GPS exif, see offline_geo.py")
+parse.add_argument(      "--geo_key",       default="picture_frame_hello", help="not used now locations come from --geo_places")
+parse.add_argument(      "--geo_path",      default="/home/pi/PictureFrame2020gpsdata.txt", help="not used now locations come from --geo_places")
+parse.add_argument(      "--geo_places",    default="/home/pi/cities1000.txt", help="places for the offline geocoder - a GeoNames dump or a csv like geo_places_sample.csv, see offline_geo.py")
 parse.add_argument(      "--geo_zoom",      default=10, type=int, help="Level of address detail(3=country...18=building): 3,5,8,10,14,16,17,18")
 parse.add_argument(      "--display_x",     default=0, type=int, help="offset from left of screen (can be negative)")
 parse.add_argument(      "--display_y",     default=0, type=int, help="offset from top of screen (can be negative)")
 parse.add_argument(      "--display_w",     default=None, type=int, help="width of display surface (None will use max returned by hardware)")
 parse.add_argument(      "--display_h",     default=None, type=int, help="height of display surface")
+""" the scripts with commands, i.e. raw_cache.py evict --cache_dir /mnt/cache or
+offline_geo.py lookup -33.9 18.4, have them before the options. They're taken
+off here so parse_args only sees the options, see command()
+"""
+def is_number(x):
+    try:
+        float(x)
+        return True
+    except ValueError:
+        return False
+
+COMMAND_WORDS = []
+while len(sys.argv) > 1 and (not sys.argv[1].startswith('-') or is_number(sys.argv[1])):
+    COMMAND_WORDS.append(sys.argv.pop(1))
+
+def command(default=None):
+    """ the command the script was run with, default if there wasn't one """
+    return COMMAND_WORDS[0] if len(COMMAND_WORDS) > 0 else default
+
+def command_args():
+    """ anything after the command and before the options, i.e. lat lon """
+    return COMMAND_WORDS[1:]
+
 args = parse.parse_args()
 
 BLEND_OPTIONS = {"blend":0.0, "burn":1.0, "bump":2.0} # that work with the blend_new fragment shader
@@ -83,7 +134,10 @@ BLEND_OPTIONS = {"blend":0.0, "burn":1.0, "bump":2.0} # that work with the blend
 ## set uppercase CONST style variables that can be accessed from PictureFrame
 BLUR_AMOUNT = args.blur_amount
 BLUR_EDGES = args.blur_edges
+BLUR_WIDTH = args.blur_width
+CACHE_DIR = args.cache_dir
 CHECK_DIR_TM = args.check_dir_tm
+CONTROL_SOCKET = args.control_socket
 VERBOSE = args.verbose
 EDGE_ALPHA = args.edge_alpha
 FPS = args.fps
@@ -92,6 +146,9 @@ PORTRAIT_PAIRS = args.portrait_pairs
 NO_FILES_IMG = args.no_files_img
 BLEND_TYPE = BLEND_OPTIONS[args.blend_type]
 KEYBOARD = args.keyboard
+MEM_DEBUG = args.mem_debug
+MIRROR = args.mirror
+MIRROR_MB = args.mirror_mb
 USE_MQTT = args.use_mqtt
 MQTT_SERVER = args.mqtt_server
 MQTT_PORT = args.mqtt_port
@@ -102,7 +159,17 @@ RECENT_N = args.recent_n
 FONT_FILE = args.font_file
 PIC_DIR = args.pic_dir
 SHADER = args.shader
+RAW_CACHE = args.raw_cache
+RAW_CACHE_MB = args.raw_cache_mb
+RENDER_CACHE_MB = args.render_cache_mb
+RENDER_DELAY = args.render_delay
+RENDER_PORT = args.render_port
+RENDER_PROCESSES = args.render_processes
+RENDER_SERVER = args.render_server
+RENDER_TIMEOUT = args.render_timeout
+RENDER_WORKERS = args.render_workers
 RESHUFFLE_NUM = args.reshuffle_num
+RSS_CEILING = args.rss_ceiling
 SHOW_TEXT_TM = args.show_text_tm
 SHOW_TEXT_FM = args.show_text_fm
 SHOW_TEXT_SZ = args.show_text_sz
@@ -123,10 +190,21 @@ LOAD_GEOLOC = args.load_geoloc
 GEO_KEY = args.geo_key
 GEO_PATH = args.geo_path
 GEO_ZOOM = args.geo_zoom
+GEO_PLACES = args.geo_places
 DISPLAY_X = args.display_x
 DISPLAY_Y = args.display_y
 DISPLAY_W = args.display_w
 DISPLAY_H = args.display_h
+NODE_INDEX = args.node_index
+SYNC_HOST = args.sync_host
+SYNC_NODES = args.sync_nodes
+SYNC_PORT = args.sync_port
+SYNC_ROLE = args.sync_role
+UPLOAD_MS = args.upload_ms
+TILE_SIZE = args.tile_size
+THERMAL_TARGET = args.thermal_target
+THERMAL_TEMP_PATH = args.thermal_temp_path
+VCGENCMD = args.vcgencmd
 
 
 CODEPOINTS = "1234567890AÄÀÆÅÃBCÇDÈÉÊEËFGHIÏÍJKLMNÑOÓÖÔŌØPQRSTUÚÙÜVWXYZaáàãæåäbcçdeéèêëfghiíïjklmnñoóôōøöpqrsßtuúüvwxyz., _-+*()&/`´'•" # limit to 121 ie 11x11 grid_size
\ No newline at end of file
@@ -12,19 +12,33 @@ USING exif info to rotate images
 
     ESC to quit, 's' to reverse, any other key to move on one.
 '''
+import io
 import os
 import time
 import random
+import threading
 import math
-import pi3d
 import locale
 import subprocess
-import numpy as np
 from PIL import Image, ImageOps, ImageDraw
 
 import mat_image
+import mem_budget
+import render_cache
+import raw_cache
+import quarantine
+import catalog
+import mirror
+import offline_geo as geo
+import tiled_sprite
 
-from pi3d.Texture import MAX_SIZE
+try:
+  import pi3d
+  from pi3d.Texture import MAX_SIZE
+  from pi3d.constants import GL_LINEAR
+except ImportError: # render only use i.e. warm_cache.py on a machine without a GPU
+  pi3d = None
+  MAX_SIZE = 1920
 from PIL import Image, ExifTags, ImageFilter # these are needed for getting exif data from images
 import Config as config
 
@@ -37,6 +51,7 @@ class Pic:
     self.fdt = fdt
     self.location = location
     self.aspect = aspect
+    self.size = None # (w, h) from the file header, filled in by image_size()
     self.shown_with = None # set to pic_num of image this was paired with
 
 try:
@@ -70,6 +85,7 @@ if config.BLUR_ZOOM < 1.0:
 delta_alpha = 1.0 / (config.FPS * fade_time) # delta alpha
 last_file_change = 0.0 # holds last change time in directory structure
 next_check_tm = time.time() + config.CHECK_DIR_TM # check if new file or directory every n seconds
+timing = threading.local() # secs the last render_image on each thread spent decoding and matting, 0 if it didn't
 #####################################################
 # some functions to tidy subsequent code
 #####################################################
@@ -112,6 +128,22 @@ def background_texture(display):
   mat_img = ImageOps.colorize(mat_img, black='black', white='white')
   return mat_img
 
+def background_tile(display):
+  """ colourised mat texture for the UV scrolling background, sized to the
+  largest power of two that fits the display in each direction so the GPU can
+  wrap it with GL_MIRRORED_REPEAT (the mirroring is what makes it tile without
+  a seam). Made once per display size and kept in the cache after that.
+  """
+  size = tuple(1 << (max(v, 1).bit_length() - 1) for v in (display.width, display.height))
+  key = render_cache.cache_key('./mat_texture.jpg', 'background', (display.width, display.height), size)
+  mat_img = render_cache.load('background', key, '.jpg')
+  if mat_img is None:
+    mat_img = Image.open('./mat_texture.jpg').convert("L")
+    mat_img = mat_img.resize(size, resample=Image.BICUBIC)
+    mat_img = ImageOps.colorize(mat_img, black='black', white='white')
+    render_cache.save('background', key, mat_img, '.jpg', quality=95)
+  return mat_img
+
 # --- Sanitize the specified string by removing any chars not found in config.CODEPOINTS
 def sanitize_string(string):
     return ''.join([c for c in string if c in config.CODEPOINTS])
@@ -133,56 +165,47 @@ def get_files(dt_from=None, dt_to=None):
   if dt_to is not None:
     dt_to = time.mktime(dt_to + (0, 0, 0, 0, 0, 0))
   global shuffle, EXIF_DATID, last_file_change
-  file_list = []
+  file_list = catalog.CatalogBuilder() # columns rather than a Pic per file, see catalog.py
   extensions = ['.png','.jpg','.jpeg','.heif','.heic'] # can add to these
   picture_dir = os.path.join(config.PIC_DIR, subdirectory)
-  for root, _dirnames, filenames in os.walk(picture_dir):
-      mod_tm = os.stat(root).st_mtime # time of alteration in a directory
-      if mod_tm > last_file_change:
-        last_file_change = mod_tm
+  m = mirror.get()
+  offline = m is not None and not m.share_up()
+  for root, _dirnames, filenames in (m.walk(picture_dir) if offline else os.walk(picture_dir)): # share down so what's mirrored
+      if not offline:
+        mod_tm = os.stat(root).st_mtime # time of alteration in a directory
+        if mod_tm > last_file_change:
+          last_file_change = mod_tm
+      if '.AppleDouble' in root:
+        continue
+      file_list.add_dir(root)
       for filename in filenames:
           ext = os.path.splitext(filename)[1].lower()
-          if ext in extensions and not '.AppleDouble' in root and not filename.startswith('.'):
+          if ext in extensions and not filename.startswith('.'):
               file_path_name = os.path.join(root, filename)
               include_flag = True
               orientation = 1 # this is default - unrotated
               dt = None # if exif data not read - used for checking in tex_load
-              fdt = None
               location = ""
               aspect = 1.5 # assume landscape aspect until we determine otherwise
               if not config.DELAY_EXIF and EXIF_DATID is not None and EXIF_ORIENTATION is not None:
-                (orientation, dt, fdt, location, aspect) = get_exif_info(file_path_name)
+                (orientation, dt, _fdt, location, aspect) = get_exif_info(file_path_name)
                 if (dt_from is not None and dt < dt_from) or (dt_to is not None and dt > dt_to):
                   include_flag = False
               if include_flag:
-                # iFiles now list of lists [file_name, orientation, file_changed_date, exif_date, exif_formatted_date, aspect]
-                file_list.append(Pic(file_path_name,
-                                    orientation,
-                                    os.path.getmtime(file_path_name),
-                                    dt,
-                                    fdt,
-                                    location,
-                                    aspect))
-  if shuffle:
-    file_list.sort(key=lambda x: x.mtime) # will be later files last
-    temp_list_first = file_list[-config.RECENT_N:]
-    temp_list_last = file_list[:-config.RECENT_N]
-    random.seed()
-    random.shuffle(temp_list_first)
-    random.shuffle(temp_list_last)
-    file_list = temp_list_first + temp_list_last
-  else:
-    file_list.sort() # if not suffled; sort by name
+                file_list.add(filename, mirror.stat(file_path_name)[1], orientation, dt, location, aspect)
+  file_list = file_list.build()
+  if not shuffle: # shuffled ones are left as they were found and drawn from with a play_sampler
+    file_list.sort_by_name() # if not suffled; sort by name
   return file_list, len(file_list) # tuple of file list, number of pictures
 
 def get_exif_info(file_path_name, im=None):
-  dt = os.path.getmtime(file_path_name) # so use file last modified date
+  dt = mirror.stat(file_path_name)[1] # so use file last modified date
   orientation = 1
   location = ""
   aspect = 1.5 # assume landscape aspect until we determine otherwise
   try:
     if im is None:
-      im = Image.open(file_path_name) # lazy operation so shouldn't load (better test though)
+      im = Image.open(mirror.local(file_path_name)) # lazy operation so shouldn't load (better test though)
     aspect = im.width / im.height
     exif_data = im._getexif() # TODO check if/when this becomes proper function
     if EXIF_DATID in exif_data:
@@ -200,6 +223,28 @@ def get_exif_info(file_path_name, im=None):
   fdt = time.strftime(config.SHOW_TEXT_FM, time.localtime(dt))
   return (orientation, dt, fdt, location, aspect)
 
+def image_size(pic):
+  """ (w, h) of the picture as tex_load will use it, read from the file header
+  only so nothing is decoded. Remembered on pic after the first call.
+  """
+  if pic.size is None:
+    try:
+      ext = os.path.splitext(pic.fname)[1].lower()
+      if ext in ('.heif','.heic'):
+        import pyheif
+        (w, h) = pyheif.open(mirror.local(pic.fname)).size # undecoded, just the header
+      else:
+        with Image.open(mirror.local(pic.fname)) as im: # lazy operation so only reads the header
+          (w, h) = im.size
+      if AUTO_ORIENT and pic.orientation in (5, 6, 7, 8): # these get rotated 90 or 270
+        (w, h) = (h, w)
+      pic.size = (w, h)
+    except Exception as e:
+      if config.VERBOSE:
+        print('trying to read size of {}'.format(pic.fname), e)
+      pic.size = (round(1000 * pic.aspect), 1000) # best guess, still lets it be laid out
+  return pic.size
+
 def convert_heif(fname):
     try:
         import pyheif
@@ -213,14 +258,129 @@ def convert_heif(fname):
         print("have you installed pyheif?")
 
 def get_matter(display):
+  return make_matter((display.width, display.height))
+
+def make_matter(display_size, resources=None):
   matter = mat_image.MatImage(
-    display_size = (display.width , display.height),
-    outer_mat_border = 0
+    display_size = display_size,
+    outer_mat_border = 0,
+    resources = resources # i.e. from shared_assets, loaded from files by the first mat otherwise
   )
   return matter
 
-def tex_load(matter, pic_num, iFiles, size=None):
-  global date_from, date_to, next_pic_num
+def blurred_backdrop(im, size, sc_b, fname=None):
+  """ small RGBA blurred copy of the middle of im, to be drawn stretched over
+  the whole of size behind the photo. Everything happens at BLUR_WIDTH pixels
+  across and the GPU does the upscale, so the CPU cost is tiny whatever the
+  display size. If fname is given the result is cached against that file.
+  """
+  blr_sz = (config.BLUR_WIDTH, max(1, round(config.BLUR_WIDTH * size[1] / size[0])))
+  key = None
+  if fname is not None:
+    key = render_cache.cache_key(fname, 'backdrop', size, blr_sz, im.size, config.BLUR_AMOUNT,
+                                 config.BLUR_ZOOM, config.EDGE_ALPHA)
+    im_b = render_cache.load('backdrop', key)
+    if im_b is not None:
+      return im_b
+  (w, h) = (round(size[0] / sc_b / config.BLUR_ZOOM), round(size[1] / sc_b / config.BLUR_ZOOM))
+  (x, y) = (round(0.5 * (im.width - w)), round(0.5 * (im.height - h)))
+  im_b = im.resize(blr_sz, resample=Image.BOX, box=(x, y, x + w, y + h)) # straight to tiny, no display sized step
+  # BLUR_AMOUNT was always in pixels at 512 wide so scale to match. Pillow does
+  # GaussianBlur as three box passes so the cost doesn't go up with the radius
+  im_b = im_b.filter(ImageFilter.GaussianBlur(config.BLUR_AMOUNT * blr_sz[0] / 512))
+  if im_b.mode != 'RGB':
+    im_b = im_b.convert('RGB')
+  im_b.putalpha(round(255 * config.EDGE_ALPHA)) # to apply the same EDGE_ALPHA as the no blur method.
+  if key is not None:
+    render_cache.save('backdrop', key, im_b)
+  return im_b
+
+def max_dimension():
+  if config.TILE_SIZE > 0: # big ones are shown in tiles so they needn't fit a texture
+    return tiled_sprite.MAX_DIMENSION
+  max_dimension = MAX_SIZE # TODO changing MAX_SIZE causes serious crash on linux laptop!
+  if not config.AUTO_RESIZE: # turned off for 4K display - will cause issues on RPi before v4
+      max_dimension = 3840 # TODO check if mipmapping should be turned off with this setting.
+  return max_dimension
+
+def render_ext(mat_type):
+  # the float styles have a drop shadow with alpha so can't go in a jpeg
+  return '.png' if mat_type in ('float', 'float_polaroid', 'float_color_wrap') else '.jpg'
+
+def render_key(matter, fname, mat_type, orientation):
+  return render_cache.cache_key(fname, 'render', matter.display_size, mat_type, orientation,
+                                matter.outer_mat_border, matter.inner_mat_border,
+                                matter.outer_mat_color, matter.inner_mat_color,
+                                matter.outer_mat_use_texture, matter.inner_mat_use_texture,
+                                max_dimension())
+
+def render_path(matter, pic, mat_type):
+  """ where render_image would find or put pic in the render cache """
+  orientation = 1
+  if AUTO_ORIENT:
+    if pic.dt is None:
+      pic.orientation = get_exif_info(pic.fname)[0]
+    orientation = pic.orientation
+  key = render_key(matter, pic.fname, mat_type, orientation)
+  return render_cache.cache_path('render', key, render_ext(mat_type))
+
+def rendered_path(matter, pic, mat_type):
+  """ render_path() of a photo render_image has just done, None when it might
+  have been paired as pairs aren't cached. Worked out again when wanted rather
+  than kept for every photo ever shown """
+  if mat_type is None or (config.PORTRAIT_PAIRS and pic.aspect < 1.0):
+    return None
+  return render_path(matter, pic, mat_type)
+
+def is_rendered(matter, pic, mat_type):
+  """ True if render_image would find pic already in the render cache """
+  return os.path.exists(render_path(matter, pic, mat_type))
+
+def scaled_matter(matter, scale):
+  # smaller MatImage for the cheaper quality tiers, made once per matter
+  if not hasattr(matter, 'scaled'):
+    matter.scaled = {}
+  if scale not in matter.scaled:
+    scaled = make_matter((int(matter.display_width * scale), int(matter.display_height * scale)), matter.resources)
+    scaled.inner_mat_border = int(matter.inner_mat_border * scale)
+    matter.scaled[scale] = scaled
+  return matter.scaled[scale]
+
+def save_render(key, im, mat_type):
+  render_cache.save('render', key, im, render_ext(mat_type), quality=90)
+
+def image_bytes(im, path=None):
+  """ the rendered photo as a file to send elsewhere - straight from the render
+  cache when it's there, otherwise encoded now """
+  if path is not None:
+    try:
+      with open(path, 'rb') as f:
+        return f.read()
+    except OSError:
+      pass
+  if hasattr(im, 'to_pil'): # a raw_cache.RawImage or shared_assets.Frame
+    im = im.to_pil()
+  buf = io.BytesIO()
+  if im.mode == 'RGBA':
+    im.save(buf, 'PNG', compress_level=1)
+  else:
+    im.save(buf, 'JPEG', quality=90)
+  return buf.getvalue()
+
+def bytes_texture(data):
+  """ texture from what image_bytes() made, i.e. on a wall_sync follower """
+  return tiled_sprite.texture_or_tiles(Image.open(io.BytesIO(data)))
+
+def render_image(matter, pic_num, iFiles, size=None, mat_type=None, quality=None):
+  """ the PIL half of tex_load, also used by warm_cache.py. Returns None if
+  pic_num is to be skipped, otherwise (im, im_b) with im_b the small blurred
+  backdrop or None (see tex_load). Single images are looked up in, or saved to,
+  the render cache so the decode and matting only happen once per file.
+  quality is a quality_governor.Quality to render more cheaply when short of
+  time, those results aren't cached. Exceptions are left for the caller.
+  """
+  global date_from, date_to
+  timing.secs = 0.0
   if type(pic_num) is int:
     #fname = iFiles[pic_num][0]
     #orientation = iFiles[pic_num][1]
@@ -231,97 +391,191 @@ def tex_load(matter, pic_num, iFiles, size=None):
   else: # allow file name to be passed to this function ie for missing file image
     fname = pic_num
     orientation = 1
-  try:
-    ext = os.path.splitext(fname)[1].lower()
-    if ext in ('.heif','.heic'):
-      im = convert_heif(fname)
-    else:
-      im = Image.open(fname)
-    if config.DELAY_EXIF and type(pic_num) is int: # don't do this if passed a file name
-      if iFiles[pic_num].dt is None or iFiles[pic_num].fdt is None: # dt and fdt set to None before exif read
-        (orientation, dt, fdt, location, aspect) = get_exif_info(fname, im)
-        iFiles[pic_num].orientation = orientation
-        iFiles[pic_num].dt = dt
-        iFiles[pic_num].fdt = fdt
-        iFiles[pic_num].location = location
-        iFiles[pic_num].aspect = aspect
-
-      if date_from is not None:
-        if dt < time.mktime(date_from + (0, 0, 0, 0, 0, 0)):
-          return None
-      if date_to is not None:
-        if dt > time.mktime(date_to + (0, 0, 0, 0, 0, 0)):
-          return None
-
-    # If PORTRAIT_PAIRS active and this is a portrait pic, try to find another one to pair it with
-    if config.PORTRAIT_PAIRS and iFiles[pic_num].aspect < 1.0:
-      im2 = None
-      # Search the whole list for another portrait image, starting with the "next"
-      # assuming previous images in sequence have already been shown
-      # TODO poss very time consuming to call get_exif_info
-      # TODO back and next will bring up different image combinations, or maybe just fail
-      if pic_num < len(iFiles) - 1: # i.e can't do this on the last image in list
-        for f_rec in iFiles[pic_num + 1:]:
-          if f_rec.dt is None or f_rec.fdt is None: # dt and fdt set to None before exif read
-            (f_orientation, f_dt, f_fdt, f_location, f_aspect) = get_exif_info(f_rec.fname)
-            f_rec.orientation = f_orientation
-            f_rec.dt = f_dt
-            f_rec.fdt = f_fdt
-            f_rec.location = f_location
-            f_rec.aspect = f_aspect
-          if f_rec.aspect < 1.0 and f_rec.shown_with is None:
-            im2 = Image.open(f_rec.fname)
-            f_rec.shown_with = pic_num
-            break
-      if im2 is not None:
+  if mat_type is None:
+    mat_type = random.choice(matter.mat_type)
+  degraded = quality is not None and quality.tier > 0
+  resample = Image.BICUBIC if quality is None else quality.resample
+  im_b = None
+  im2 = None
+  ext = os.path.splitext(fname)[1].lower()
+  is_heif = ext in ('.heif','.heic')
+  im = None if is_heif else Image.open(mirror.local(fname)) # lazy so only the header is read until pixels are used
+  if config.DELAY_EXIF and type(pic_num) is int: # don't do this if passed a file name
+    if iFiles[pic_num].dt is None or iFiles[pic_num].fdt is None: # dt and fdt set to None before exif read
+      (orientation, dt, fdt, location, aspect) = get_exif_info(fname, im)
+      iFiles[pic_num].orientation = orientation
+      iFiles[pic_num].dt = dt
+      iFiles[pic_num].fdt = fdt
+      iFiles[pic_num].location = location
+      iFiles[pic_num].aspect = aspect
+      if not AUTO_ORIENT:
+        orientation = 1
+    dt = iFiles[pic_num].dt
+
+    if date_from is not None:
+      if dt < time.mktime(date_from + (0, 0, 0, 0, 0, 0)):
+        return None
+    if date_to is not None:
+      if dt > time.mktime(date_to + (0, 0, 0, 0, 0, 0)):
+        return None
+
+  # If PORTRAIT_PAIRS active and this is a portrait pic, try to find another one to pair it with
+  if config.PORTRAIT_PAIRS and type(pic_num) is int and iFiles[pic_num].aspect < 1.0:
+    # Search the whole list for another portrait image, starting with the "next"
+    # assuming previous images in sequence have already been shown
+    # TODO poss very time consuming to call get_exif_info
+    # TODO back and next will bring up different image combinations, or maybe just fail
+    if pic_num < len(iFiles) - 1: # i.e can't do this on the last image in list
+      for f_rec in iFiles[pic_num + 1:]:
+        if quarantine.is_quarantined(f_rec.fname, f_rec.mtime):
+          continue
+        if f_rec.dt is None or f_rec.fdt is None: # dt and fdt set to None before exif read
+          (f_orientation, f_dt, f_fdt, f_location, f_aspect) = get_exif_info(f_rec.fname)
+          f_rec.orientation = f_orientation
+          f_rec.dt = f_dt
+          f_rec.fdt = f_fdt
+          f_rec.location = f_location
+          f_rec.aspect = f_aspect
+        if f_rec.aspect < 1.0 and f_rec.shown_with is None:
+          im2 = Image.open(mirror.path(f_rec.fname))
+          f_rec.shown_with = pic_num
+          break
+
+  paired = im2 is not None
+  key = None
+  cached = None
+  if not paired: # pairs depend on what else is in the list so aren't cached
+    key = render_key(matter, fname, mat_type, orientation)
+    cached = render_cache.load('render', key, render_ext(mat_type))
+
+  if cached is not None:
+    if im is not None:
+      im.close() # only the header was read
+    im = cached
+  else:
+    # all of it wanted now, copied first if it wasn't read ahead - not counted in timing.secs
+    source = mirror.path(fname) if is_heif or mirror.get() is not None else None
+    work_tm = time.time()
+    with mem_budget.Stage('decode') as st:
+      if is_heif:
+        im = convert_heif(source)
+      elif source is not None:
+        im.close()
+        im = Image.open(source)
+      if not is_heif and not paired and im.format == 'JPEG':
+        # let libjpeg scale down while decoding, never smaller than it will be shown
+        scale = min(matter.display_width / im.width, matter.display_height / im.height, 1.0)
+        im.draft('RGB', (int(im.width * scale), int(im.height * scale)))
+      im.load()
+      st.result(im)
+    if paired:
+      with mem_budget.Stage('pair') as st:
         if orientation > 1:
           im = orientate_image(im, orientation)
         if f_rec.orientation > 1:
           im2 = orientate_image(im2, f_rec.orientation)
-        im = create_image_pair(im, im2)
+        im = st.result(create_image_pair(im, im2))
+        im2 = None
         orientation = 1
 
-    im = matter.mat_image((im,))
-
-    (w, h) = im.size
-    max_dimension = MAX_SIZE # TODO changing MAX_SIZE causes serious crash on linux laptop!
-    if not config.AUTO_RESIZE: # turned off for 4K display - will cause issues on RPi before v4
-        max_dimension = 3840 # TODO check if mipmapping should be turned off with this setting.
-    if w > max_dimension:
-        im = im.resize((max_dimension, int(h * max_dimension / w)), resample=Image.BICUBIC)
-    elif h > max_dimension:
-        im = im.resize((int(w * max_dimension / h), max_dimension), resample=Image.BICUBIC)
-    if orientation > 1:
-        im = orientate_image(im, orientation)
-    if config.BLUR_EDGES and size is not None:
-      wh_rat = (size[0] * im.height) / (size[1] * im.width)
-      if abs(wh_rat - 1.0) > 0.01: # make a blurred background
+    with mem_budget.Stage('mat') as st:
+      mat_matter = matter
+      if degraded:
+        mat_matter = scaled_matter(matter, quality.scale) if quality.scale != 1.0 else matter
+        mat_type = quality.mat_type or mat_type
+      mat_matter.resample = resample
+      mat_matter.reducing_gap = None if quality is None else quality.reducing_gap
+      im = st.result(mat_matter.mat_image((im,), mat_type)) # source goes as soon as this is assigned
+
+    with mem_budget.Stage('clamp') as st:
+      (w, h) = im.size
+      max_dim = max_dimension()
+      if w > max_dim:
+          im = im.resize((max_dim, int(h * max_dim / w)), resample=resample)
+      elif h > max_dim:
+          im = im.resize((int(w * max_dim / h), max_dim), resample=resample)
+      if orientation > 1:
+          im = orientate_image(im, orientation)
+      st.result(im)
+    if key is not None and not degraded:
+      save_render(key, im, mat_type)
+    timing.secs = time.time() - work_tm
+
+  if config.BLUR_EDGES and size is not None and (quality is None or quality.blur):
+    wh_rat = (size[0] * im.height) / (size[1] * im.width)
+    if abs(wh_rat - 1.0) > 0.01: # make a blurred background
+      with mem_budget.Stage('backdrop') as st:
         (sc_b, sc_f) = (size[1] / im.height, size[0] / im.width)
         if wh_rat > 1.0:
           (sc_b, sc_f) = (sc_f, sc_b) # swap round
-        (w, h) = (round(size[0] / sc_b / config.BLUR_ZOOM), round(size[1] / sc_b / config.BLUR_ZOOM))
-        (x, y) = (round(0.5 * (im.width - w)), round(0.5 * (im.height - h)))
-        box = (x, y, x + w, y + h)
-        blr_sz = (int(x * 512 / size[0]) for x in size)
-        im_b = im.resize(size, resample=0, box=box).resize(blr_sz)
-        im_b = im_b.filter(ImageFilter.GaussianBlur(config.BLUR_AMOUNT))
-        im_b = im_b.resize(size, resample=Image.BICUBIC)
-        im_b.putalpha(round(255 * config.EDGE_ALPHA))  # to apply the same EDGE_ALPHA as the no blur method.
-        im = im.resize((int(x * sc_f) for x in im.size), resample=Image.BICUBIC)
+        im_b = blurred_backdrop(im, size, sc_b, None if paired else fname) # pairs aren't cached
+        im = st.result(im.resize((int(x * sc_f) for x in im.size), resample=resample))
         """resize can use Image.LANCZOS (alias for Image.ANTIALIAS) for resampling
         for better rendering of high-contranst diagonal lines. NB downscaled large
-        images are rescaled near the start of this try block if w or h > max_dimension
+        images are rescaled near the start of this function if w or h > max_dimension
         so those lines might need changing too.
         """
-        im_b.paste(im, box=(round(0.5 * (im_b.width - im.width)),
-                            round(0.5 * (im_b.height - im.height))))
-        im = im_b # have to do this as paste applies in place
-    tex = pi3d.Texture(im, blend=True, m_repeat=True, automatic_resize=config.AUTO_RESIZE,
-                        free_after_load=True)
+  return (im, im_b)
+
+def raw_hit(matter, pic, mat_type):
+  """ RawImage for pic if it can be shown straight from the raw cache. Not when
+  it might be paired or when it hasn't been checked against the dates yet, as
+  render_image has to do those """
+  if config.PORTRAIT_PAIRS and pic.aspect < 1.0:
+    return None
+  if pic.dt is None and (date_from is not None or date_to is not None):
+    return None
+  return raw_cache.load(raw_cache.raw_path(render_path(matter, pic, mat_type)))
+
+def tex_load(matter, pic_num, iFiles, size=None, mat_type=None, quality=None, render=None):
+  """ returns None if pic_num is to be skipped, otherwise (tex, im, tex_b)
+  where tex_b is None unless BLUR_EDGES and size are set and the image doesn't
+  fill size. In that case tex_b is a small blurred texture to draw stretched
+  to size behind tex, which has been scaled to fit inside size. mat_type
+  picks the mat style rather than leaving it to matter and quality is passed
+  on to render_image. render is used in place of render_image if given, i.e.
+  shared_assets.RenderPool's which mats in another process.
+  """
+  fname = pic_num if type(pic_num) is not int else iFiles[pic_num].fname
+  im = None
+  tex_b = None
+  rendering = False # only failures reading the file count against it, not i.e. the GPU
+  try:
+    if config.RAW_CACHE and size is None and mat_type is not None and type(pic_num) is int:
+      raw = raw_hit(matter, iFiles[pic_num], mat_type)
+      if raw is not None: # pixels mapped from the file, no decode at all
+        with mem_budget.Stage('texture'):
+          if tiled_sprite.needs_tiles(raw.width, raw.height): # the tiles are cut from the map as they're shown
+            return (tiled_sprite.Tiles(raw.levels[0]), raw, None)
+          return (raw.texture(), raw, None)
+    rendering = True
+    timing.secs = 0.0 # in case render returns without rendering
+    quarantine.check(mirror.local(fname), None if type(pic_num) is not int else iFiles[pic_num].size)
+    rendered = (render or render_image)(matter, pic_num, iFiles, size, mat_type, quality)
+    rendering = False
+    if timing.secs > quarantine.SLOW_SECS: # shown this time but not worth it again soon
+      quarantine.failed(fname, 'took {:.0f}s to render'.format(timing.secs))
+    else:
+      quarantine.loaded(fname)
+    if rendered is None:
+      return None
+    (im, im_b) = rendered
+    path = None if type(pic_num) is not int else rendered_path(matter, iFiles[pic_num], mat_type)
+    if config.RAW_CACHE and path is not None \
+        and (quality is None or quality.tier == 0) and isinstance(im, Image.Image): # workers save their own
+      with mem_budget.Stage('raw save'):
+        raw_cache.save(raw_cache.raw_path(path), im)
+    with mem_budget.Stage('texture'):
+      if im_b is not None:
+        tex_b = pi3d.Texture(im_b, blend=True, mipmap=False, filter=GL_LINEAR,
+                             automatic_resize=False, free_after_load=True)
+      tex = tiled_sprite.texture_or_tiles(im) # Tiles rather than a texture if it's too big for one
     #tex = pi3d.Texture(im, blend=True, m_repeat=True, automatic_resize=config.AUTO_RESIZE,
     #                    mipmap=config.AUTO_RESIZE, free_after_load=True) # poss try this if still some artifacts with full resolution
   except Exception as e:
     if config.VERBOSE:
         print('''Couldn't load file {} giving error: {}'''.format(fname, e))
+    if rendering and mirror.available(fname): # not the file's fault if the share is down
+      quarantine.failed(fname, e)
     tex = None
-  return (tex, im)
+  return (tex, im, tex_b)
@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+""" Captions over the bottom left of each photo (name, date, location and
+folder as picked with --show_text) with no PIL work per photo.
+
+The glyphs of CODEPOINTS are drawn once for the font and size into an atlas,
+white with a dark outline, and kept in CACHE_DIR/glyphs as a png plus a json
+of where each glyph is and how far it moves the pen on, so later starts only
+read them. A caption is then just quads with uv coordinates into the atlas,
+worked out from the catalog's fdt and location when its photo is added.
+
+Each lane has a CaptionBatch, one Shape holding the quads for all its photos,
+so captions are a single draw call a frame however many photos there are and
+the buffer is only written when a photo comes or goes. The atlas texture isn't
+blended - its see-through pixels are discarded instead - so captions drawn
+before a photo that was added after them don't hide it.
+
+  python3 captions.py [Config options]   build the atlas and save a sample caption to /tmp
+"""
+import os
+import json
+import math
+import textwrap
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+import Config as config
+import render_cache
+
+try:
+  import pi3d
+except ImportError: # atlas and layout only
+  pi3d = None
+
+SHOW_NAME, SHOW_DATE, SHOW_LOCATION, SHOW_FOLDER = 1, 2, 4, 8 # bits of config.SHOW_TEXT
+SEPARATOR = ' • '
+STROKE = 2 # outline so captions read over light photos
+LINE_SPACING = 1.1
+MARGIN = 0.5 # line heights between the caption and the photo's edges
+ATLAS_WIDTH = 1024
+MAX_CHARS = 4096 # per lane, 4 vertices each keeps under the 32768 of the short indices
+Z = 10.0 # in front of the photos which are at 20
+
+class GlyphAtlas:
+  def __init__(self, image, metrics):
+    self.image = image
+    self.line_height = metrics['line_height']
+    self.pad = metrics['pad']
+    (w, h) = image.size
+    self.glyphs = {} # char -> (advance, cell width, u0, v0, u1, v1)
+    for (char, (x, y, cell_w, advance)) in metrics['glyphs'].items():
+      self.glyphs[char] = (advance, cell_w, x / w, y / h, (x + cell_w) / w, (y + self.line_height) / h)
+    self.texture = None
+
+  def make_texture(self):
+    self.texture = pi3d.Texture(self.image, blend=False, free_after_load=True) # uploaded when first drawn
+    self.image = None
+
+  def line_width(self, line):
+    return sum(self.glyphs[c][0] for c in line if c in self.glyphs)
+
+  def layout(self, lines, max_width):
+    """ (verts, uvs) for the quads of lines, the first line on top, with (0, 0)
+    the bottom left of the photo. Shrunk to fit if wider than max_width """
+    margin = MARGIN * self.line_height
+    widest = max(self.line_width(line) for line in lines)
+    scale = min(1.0, (max_width - 2 * margin) / widest) if widest > 0 else 1.0
+    (verts, uvs) = ([], [])
+    step = self.line_height * LINE_SPACING
+    for (i, line) in enumerate(reversed(lines)):
+      (pen, bottom) = (0.0, i * step)
+      for c in line:
+        if c not in self.glyphs:
+          continue # not in CODEPOINTS
+        (advance, cell_w, u0, v0, u1, v1) = self.glyphs[c]
+        if c != ' ':
+          (x0, x1, y1) = (pen - self.pad, pen - self.pad + cell_w, bottom + self.line_height)
+          verts += [(x0, y1, 0.0), (x1, y1, 0.0), (x1, bottom, 0.0), (x0, bottom, 0.0)]
+          uvs += [(u0, v0), (u1, v0), (u1, v1), (u0, v1)]
+        pen += advance
+    verts = np.array(verts, dtype=np.float32).reshape(-1, 3) * scale
+    verts[:, :2] += margin * scale
+    return (verts, np.array(uvs, dtype=np.float32).reshape(-1, 2))
+
+def build_atlas(font_file, size, codepoints):
+  font = ImageFont.truetype(font_file, size)
+  (ascent, descent) = font.getmetrics()
+  pad = STROKE + 2 # room for the outline and anything that hangs over the pen position
+  line_height = ascent + descent + 2 * pad
+  glyphs = {}
+  (x, y) = (0, 0)
+  for char in sorted(set(codepoints + ' ')):
+    advance = font.getlength(char)
+    cell_w = int(math.ceil(advance)) + 2 * pad
+    if x + cell_w > ATLAS_WIDTH:
+      (x, y) = (0, y + line_height)
+    glyphs[char] = (x, y, cell_w, advance)
+    x += cell_w
+  im = Image.new('RGBA', (ATLAS_WIDTH, y + line_height), (0, 0, 0, 0))
+  draw = ImageDraw.Draw(im)
+  for (char, (x, y, _cell_w, _advance)) in glyphs.items():
+    draw.text((x + pad, y + pad), char, font=font, fill=(255, 255, 255, 255),
+              stroke_width=STROKE, stroke_fill=(0, 0, 0, 255))
+  return (im, {'line_height': line_height, 'pad': pad, 'glyphs': glyphs})
+
+def load_atlas():
+  """ GlyphAtlas for the configured font, from the cache if it's been made before """
+  key = render_cache.cache_key(config.FONT_FILE, config.SHOW_TEXT_SZ, config.CODEPOINTS, STROKE, ATLAS_WIDTH)
+  json_path = render_cache.cache_path('glyphs', key, '.json')
+  im = render_cache.load('glyphs', key, '.png')
+  if im is not None:
+    try:
+      with open(json_path) as f:
+        return GlyphAtlas(im, json.load(f))
+    except (OSError, ValueError):
+      pass # made again below
+  try:
+    (im, metrics) = build_atlas(config.FONT_FILE, config.SHOW_TEXT_SZ, config.CODEPOINTS)
+  except OSError as e:
+    print('''Couldn't load font {} giving error: {} - no captions'''.format(config.FONT_FILE, e))
+    return None
+  render_cache.save('glyphs', key, im, '.png')
+  try:
+    with open(json_path + '.tmp', 'w') as f:
+      json.dump(metrics, f)
+    os.replace(json_path + '.tmp', json_path)
+  except OSError as e:
+    print('''Couldn't save glyph metrics giving error: {}'''.format(e))
+  return GlyphAtlas(im, metrics)
+
+def caption_lines(pic):
+  """ the caption for pic as lines of at most TEXT_WIDTH characters """
+  parts = []
+  if config.SHOW_TEXT & SHOW_NAME:
+    parts.append(os.path.splitext(os.path.basename(pic.fname))[0])
+  if config.SHOW_TEXT & SHOW_DATE:
+    parts.append(pic.fdt)
+  if config.SHOW_TEXT & SHOW_LOCATION:
+    parts.append(pic.location)
+  if config.SHOW_TEXT & SHOW_FOLDER:
+    parts.append(os.path.basename(os.path.dirname(pic.fname)))
+  return textwrap.wrap(SEPARATOR.join(p for p in parts if p), config.TEXT_WIDTH)
+
+if pi3d is not None:
+  class CaptionShape(pi3d.Shape):
+    """ room for MAX_CHARS quads of which only the first chars are drawn """
+    def __init__(self, camera, texture, shader):
+      pi3d.Shape.__init__(self, camera, None, 'captions', 0.0, 0.0, Z, 0.0, 0.0, 0.0, 1.0, 1.0, 1.0, 0.0, 0.0, 0.0)
+      n = MAX_CHARS * 4
+      corner = np.arange(0, n, 4).reshape(-1, 1)
+      faces = np.hstack((corner + 3, corner, corner + 1, corner + 1, corner + 2, corner + 3)).reshape(-1, 3)
+      self.buf = [pi3d.Buffer(self, np.zeros((n, 3)), np.zeros((n, 2)), faces, np.tile((0.0, 0.0, -1.0), (n, 1)))]
+      self.buf[0].set_draw_details(shader, [texture])
+      self.chars = 0
+
+    def set_quads(self, verts, uvs):
+      if len(verts) > 0:
+        self.buf[0].re_init(pts=verts, texcoords=uvs)
+      self.chars = len(verts) // 4
+      self.buf[0].ntris = 2 * self.chars
+
+    def repaint(self, t):
+      if self.chars > 0:
+        self.draw()
+
+class CaptionBatch:
+  """ the captions of one lane, call rebuild() on the render thread after photos change """
+  def __init__(self, atlas, camera, shader):
+    self.atlas = atlas
+    self.shape = CaptionShape(camera, atlas.texture, shader)
+    self.dirty = False
+
+  def add(self, photo, lines):
+    if len(lines) > 0:
+      photo['caption'] = self.atlas.layout(lines, photo['width'])
+      self.dirty = True
+
+  def remove(self, photo):
+    if 'caption' in photo:
+      self.dirty = True
+
+  def rebuild(self, photos, y):
+    """ photos' left is in world x, y is the middle of the lane """
+    self.dirty = False
+    (verts, uvs, chars) = ([], [], 0)
+    for photo in photos:
+      if 'caption' not in photo:
+        continue
+      (v, uv) = photo['caption']
+      chars += len(v) // 4
+      if chars > MAX_CHARS:
+        break
+      verts.append(v + (photo['left'], y - photo['height'] / 2, 0.0))
+      uvs.append(uv)
+    if len(verts) == 0:
+      return self.shape.set_quads([], [])
+    self.shape.set_quads(np.concatenate(verts), np.concatenate(uvs))
+
+if __name__ == '__main__':
+  import time
+  tm = time.time()
+  atlas = load_atlas()
+  if atlas is not None:
+    print('atlas {}x{} with {} glyphs in {:.2f}s'.format(atlas.image.width, atlas.image.height, len(atlas.glyphs), time.time() - tm))
+    class Sample:
+      fname = os.path.join(config.PIC_DIR, 'Holidays', 'IMG_0042.jpg')
+      fdt = time.strftime(config.SHOW_TEXT_FM)
+      location = 'Kandy, LK'
+    lines = caption_lines(Sample)
+    (verts, uvs) = atlas.layout(lines, 600)
+    # draw the quads back out of the atlas to check them
+    size = (600, int(verts[:, 1].max()) + 20 if len(verts) > 0 else 20)
+    out = Image.new('RGB', size, (90, 120, 160))
+    (aw, ah) = atlas.image.size
+    for q in range(len(verts) // 4):
+      ((x0, y1, _), (x1, _, _), (_, y0, _), _) = verts[4 * q: 4 * q + 4]
+      ((u0, v0), (u1, v1)) = (uvs[4 * q], uvs[4 * q + 2])
+      glyph = atlas.image.crop((round(u0 * aw), round(v0 * ah), round(u1 * aw), round(v1 * ah)))
+      glyph = glyph.resize((max(round(x1 - x0), 1), max(round(y1 - y0), 1)))
+      out.paste(glyph, (round(x0), size[1] - round(y1)), glyph)
+    out.save('/tmp/caption_sample.png')
+    print('{} -> /tmp/caption_sample.png'.format(lines))
@@ -0,0 +1,201 @@
+""" Column store for the photo list so very big libraries stay small in memory
+and quick to draw from. Numbers live in one numpy structured array, file names in
+one bytes blob with offsets plus a table of directory names (so each directory
+is only stored once), and the few photos with a location have those in a dict.
+Where a photo's render is cached isn't kept at all, PhotoUtils.rendered_path()
+works it out again when it's wanted.
+
+The play order is a permutation of row numbers and catalog[n] gives a PicView
+of the nth photo to play - it looks like a PhotoUtils.Pic to the rest of the
+code but is only made when asked for and reads and writes the columns.
+"""
+import os
+import time
+from array import array
+
+import numpy as np
+
+import Config as config
+
+FIELDS = np.dtype([('mtime', 'f8'), ('dt', 'f8'), ('orientation', 'u1'), ('aspect', 'f4'),
+                   ('width', 'u4'), ('height', 'u4'), ('shown_with', 'i4'), ('exif_read', '?')])
+
+class CatalogBuilder:
+  """ collects rows while walking the library then makes the Catalog """
+  def __init__(self):
+    self.dirs = []
+    self.dir_ix = array('i')
+    self.names = bytearray()
+    self.name_ends = array('q')
+    self.mtime = array('d')
+    self.dt = array('d')
+    self.orientation = array('B')
+    self.aspect = array('f')
+    self.exif_read = array('B')
+    self.locations = {}
+
+  def add_dir(self, root):
+    self.dirs.append(root)
+
+  def add(self, filename, mtime, orientation=1, dt=None, location="", aspect=1.5):
+    """ filename is in the directory last passed to add_dir() """
+    row = len(self.mtime)
+    self.dir_ix.append(len(self.dirs) - 1)
+    self.names += filename.encode('utf-8', 'surrogateescape')
+    self.name_ends.append(len(self.names))
+    self.mtime.append(mtime)
+    self.dt.append(np.nan if dt is None else dt)
+    self.orientation.append(orientation)
+    self.aspect.append(aspect)
+    self.exif_read.append(dt is not None)
+    if location:
+      self.locations[row] = location
+
+  def build(self):
+    n = len(self.mtime)
+    rows = np.zeros(n, dtype=FIELDS)
+    rows['mtime'] = np.frombuffer(self.mtime, dtype='f8') if n else []
+    rows['dt'] = np.frombuffer(self.dt, dtype='f8') if n else []
+    rows['orientation'] = np.frombuffer(self.orientation, dtype='u1') if n else []
+    rows['aspect'] = np.frombuffer(self.aspect, dtype='f4') if n else []
+    rows['exif_read'] = np.frombuffer(self.exif_read, dtype='u1') if n else []
+    rows['shown_with'] = -1
+    name_ends = np.frombuffer(self.name_ends, dtype='i8') if n else np.zeros(0, dtype='i8')
+    return Catalog(rows, self.dirs, np.frombuffer(self.dir_ix, dtype='i4') if n else np.zeros(0, dtype='i4'),
+                   bytes(self.names), np.concatenate(([0], name_ends)), self.locations)
+
+class Catalog:
+  def __init__(self, rows, dirs, dir_ix, names, name_offsets, locations=None):
+    self.rows = rows
+    self.dirs = dirs
+    self.dir_ix = dir_ix
+    self.names = names
+    self.name_offsets = name_offsets
+    self.locations = locations or {}
+    self.order = np.arange(len(rows), dtype='i4')
+
+  def __len__(self):
+    return len(self.order)
+
+  def __getitem__(self, pos):
+    if isinstance(pos, slice): # only used for short forward searches so a generator is fine
+      return (PicView(self, row) for row in self.order[pos])
+    return PicView(self, int(self.order[pos]))
+
+  def __iter__(self):
+    return self[:]
+
+  def fname(self, row):
+    name = self.names[self.name_offsets[row]:self.name_offsets[row + 1]].decode('utf-8', 'surrogateescape')
+    return os.path.join(self.dirs[self.dir_ix[row]], name)
+
+  def sort_by_name(self):
+    self.order = np.array(sorted(range(len(self.rows)), key=self.fname), dtype='i4')
+
+  def fnames(self):
+    """ every file name in play order """
+    return [self.fname(int(row)) for row in self.order]
+
+  def follow(self, names):
+    """ play the photos in names (the order from an earlier run) in that order
+    as far as they're still here, anything new after them in the order it's in
+    now. Returns how many of names[:i] are still here for each i, which is
+    where position i in the old order has got to in the new one """
+    position = {name: pos for (pos, name) in enumerate(self.fnames())}
+    found = np.array([position.pop(name, -1) for name in names], dtype='i8') # pop so a repeat is only taken once
+    kept = found[found >= 0]
+    rest = np.ones(len(self.order), dtype=bool)
+    rest[kept] = False
+    self.order = np.concatenate((self.order[kept], self.order[rest]))
+    return np.concatenate(([0], np.cumsum(found >= 0)))
+
+  def memory_bytes(self):
+    return (self.rows.nbytes + self.dir_ix.nbytes + len(self.names) + self.name_offsets.nbytes
+            + self.order.nbytes + sum(len(d) for d in self.dirs))
+
+class PicView:
+  """ stands in for PhotoUtils.Pic, backed by one row of a Catalog """
+  __slots__ = ('cat', 'row')
+
+  def __init__(self, cat, row):
+    self.cat = cat
+    self.row = row
+
+  def __repr__(self):
+    return 'PicView({})'.format(self.fname)
+
+  @property
+  def fname(self):
+    return self.cat.fname(self.row)
+
+  @property
+  def mtime(self):
+    return float(self.cat.rows['mtime'][self.row])
+
+  @property
+  def orientation(self):
+    return int(self.cat.rows['orientation'][self.row])
+
+  @orientation.setter
+  def orientation(self, val):
+    self.cat.rows['orientation'][self.row] = val
+
+  @property
+  def dt(self):
+    if not self.cat.rows['exif_read'][self.row]:
+      return None
+    return float(self.cat.rows['dt'][self.row])
+
+  @dt.setter
+  def dt(self, val):
+    self.cat.rows['dt'][self.row] = np.nan if val is None else val
+    self.cat.rows['exif_read'][self.row] = val is not None
+
+  @property
+  def fdt(self):
+    # formatted when wanted rather than a string kept for every photo
+    dt = self.dt
+    if dt is None:
+      return None
+    return time.strftime(config.SHOW_TEXT_FM, time.localtime(dt))
+
+  @fdt.setter
+  def fdt(self, val):
+    pass # always made from dt
+
+  @property
+  def location(self):
+    return self.cat.locations.get(self.row, "")
+
+  @location.setter
+  def location(self, val):
+    if val:
+      self.cat.locations[self.row] = val
+    else:
+      self.cat.locations.pop(self.row, None)
+
+  @property
+  def aspect(self):
+    return float(self.cat.rows['aspect'][self.row])
+
+  @aspect.setter
+  def aspect(self, val):
+    self.cat.rows['aspect'][self.row] = val
+
+  @property
+  def size(self):
+    (w, h) = (self.cat.rows['width'][self.row], self.cat.rows['height'][self.row])
+    return None if w == 0 else (int(w), int(h))
+
+  @size.setter
+  def size(self, val):
+    (self.cat.rows['width'][self.row], self.cat.rows['height'][self.row]) = (0, 0) if val is None else val
+
+  @property
+  def shown_with(self):
+    val = int(self.cat.rows['shown_with'][self.row])
+    return None if val < 0 else val
+
+  @shown_with.setter
+  def shown_with(self, val):
+    self.cat.rows['shown_with'][self.row] = -1 if val is None else val
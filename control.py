@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+""" Local control socket so a running wall can be looked at and tuned without
+a restart. The wall registers the settings it's happy to have changed, then a
+client sends one JSON object per line over a Unix socket and gets one back:
+
+  {"cmd": "get"}                                    -> {"ok": true, "values": {...}}
+  {"cmd": "set", "values": {"TRANSITION_SPEED": 1}} -> {"ok": true, "values": {...}}
+
+Values are checked as they arrive but only applied by the render loop calling
+apply_pending() between frames, and all the values from one "set" go in
+together. Other commands can be added with add_command().
+
+From a shell:
+
+  python3 control.py get
+  python3 control.py set TRANSITION_SPEED=1.0 IMAGE_GAP=100
+  python3 control.py set date_from=2019-01-01 date_to=none
+"""
+import os
+import sys
+import json
+import socket
+import threading
+
+DEFAULT_SOCKET = '/tmp/photowall.sock'
+APPLY_TIMEOUT = 5.0 # seconds a client waits to hear back from the render loop
+
+settings = {} # name -> (getter, setter, parse)
+commands = {} # name -> function(request) returning a dict for the reply
+pending = [] # (function, threading.Event) waiting for the render loop
+pending_lock = threading.Lock()
+
+def register(name, getter, setter, parse=float):
+  """ parse turns the value sent by the client into what setter expects and
+  should raise ValueError if it can't """
+  settings[name] = (getter, setter, parse)
+
+def add_command(name, function):
+  commands[name] = function
+
+def parse_bool(x):
+  if isinstance(x, bool):
+    return x
+  return not (str(x).lower()[:1] in ('0', 'f', 'n')) # same rule as Config.str_to_bool
+
+def parse_date(x):
+  """ 'YYYY-MM-DD' or 'none' to the (y, m, d) tuple or None used by PhotoUtils """
+  if x is None or str(x).lower() in ('', 'none', 'null'):
+    return None
+  return tuple(int(v) for v in str(x).split('-'))[:3]
+
+def call_soon(function):
+  """ run function on the render loop between frames, returns an Event set once it has """
+  done = threading.Event()
+  with pending_lock:
+    pending.append((function, done))
+  return done
+
+def apply_pending():
+  """ called by the render loop once per frame """
+  global pending
+  if len(pending) == 0: # no lock needed just to look
+    return
+  with pending_lock:
+    (to_apply, pending) = (pending, [])
+  for (function, done) in to_apply:
+    try:
+      function()
+    finally:
+      done.set()
+
+def current_values():
+  values = {}
+  for (name, (getter, _setter, _parse)) in settings.items():
+    value = getter()
+    if isinstance(value, tuple): # i.e. dates
+      value = list(value)
+    values[name] = value if isinstance(value, (int, float, str, bool, list, type(None))) else str(value)
+  return values
+
+def handle(request):
+  cmd = request.get('cmd', 'get')
+  if cmd == 'get':
+    return {'ok': True, 'values': current_values()}
+  if cmd == 'set':
+    batch = []
+    for (name, value) in request.get('values', {}).items():
+      if name not in settings:
+        return {'ok': False, 'error': 'unknown setting {}'.format(name)}
+      try:
+        batch.append((settings[name][1], settings[name][2](value)))
+      except (TypeError, ValueError) as e:
+        return {'ok': False, 'error': 'bad value for {}: {}'.format(name, e)}
+    def apply_batch():
+      for (setter, value) in batch:
+        setter(value)
+    if not call_soon(apply_batch).wait(APPLY_TIMEOUT):
+      return {'ok': False, 'error': 'render loop did not pick the change up (paused?) - it will still be applied'}
+    return {'ok': True, 'values': current_values()}
+  if cmd in commands:
+    return commands[cmd](request)
+  return {'ok': False, 'error': 'unknown command {}'.format(cmd)}
+
+def serve_client(conn):
+  with conn:
+    f = conn.makefile('rw')
+    for line in f:
+      try:
+        reply = handle(json.loads(line))
+      except Exception as e: # keep the wall running whatever gets sent
+        reply = {'ok': False, 'error': str(e)}
+      f.write(json.dumps(reply) + '\n')
+      f.flush()
+
+def serve(path):
+  if os.path.exists(path):
+    os.remove(path) # left over from last time
+  server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  server.bind(path)
+  server.listen(2)
+  while True:
+    (conn, _addr) = server.accept()
+    threading.Thread(target=serve_client, args=(conn,), daemon=True).start()
+
+def start(path=DEFAULT_SOCKET):
+  """ start listening on path in a background thread, does nothing if path is empty """
+  if not path:
+    return None
+  thread = threading.Thread(target=serve, args=(path,), daemon=True)
+  thread.start()
+  return thread
+
+def send(request, path=DEFAULT_SOCKET):
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+    conn.connect(path)
+    f = conn.makefile('rw')
+    f.write(json.dumps(request) + '\n')
+    f.flush()
+    return json.loads(f.readline())
+
+def main(argv):
+  path = os.environ.get('PHOTOWALL_SOCKET', DEFAULT_SOCKET)
+  if len(argv) < 1:
+    print('usage: control.py get | set NAME=VALUE ... | COMMAND [NAME=VALUE ...]')
+    return 1
+  request = {'cmd': argv[0]}
+  values = dict(arg.split('=', 1) for arg in argv[1:])
+  if argv[0] == 'set':
+    request['values'] = values
+  else:
+    request.update(values)
+  reply = send(request, path)
+  print(json.dumps(reply, indent=2, sort_keys=True))
+  return 0 if reply.get('ok') else 1
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
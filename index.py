@@ -6,156 +6,735 @@ they hit the bottom edge.
 
 import random, time, threading, math, datetime
 import subprocess
+import bisect
 
-import pi3d
+import startup # first so its clock starts as early as possible
 
-from six_mod.moves import queue
-from gpiozero import MotionSensor
+import pi3d
+from PIL import Image
 
 import PhotoUtils
+import captions
+import control
+import lane_pipeline
+import mem_budget
+import mirror
+import play_sampler
+import quality_governor
+import quarantine
+import render_server
+import sampling_profiler
+import shared_assets
+import strip_layout
+import thermal
+import tiled_sprite
+import upload_scheduler
+import wall_sync
+import Config as config
+
+startup.mark('imports')
 
 BACKGROUND = (0.0, 0.0, 0.0, 0.0)
-DISPLAY = pi3d.Display.create(background=BACKGROUND, frames_per_second=60)
+FRAMES_PER_SECOND = 60 # the thermal governor lowers DISPLAY.frames_per_second from this when it's hot
+DISPLAY = pi3d.Display.create(x=config.DISPLAY_X, y=config.DISPLAY_Y, w=config.DISPLAY_W, h=config.DISPLAY_H,
+                              background=BACKGROUND, frames_per_second=FRAMES_PER_SECOND)
 CAMERA = pi3d.Camera((0, 0, 0), (0, 0, -1), (1, 1000, 45.0, DISPLAY.width/DISPLAY.height), is_3d=False)
 SHADER = pi3d.Shader('uv_flat')
 # KEYBOARD = pi3d.Keyboard()
 
-pir = MotionSensor(4)
+startup.mark('display')
 
-PRELOAD_IMAGE_COUNT = 4
+pir = None # gpiozero is slow to import so the MotionSensor is made once the wall is moving
+
+PRELOAD_IMAGE_COUNT = 4 # for each lane
+LOADER_THREADS = 2 # as many of these run at once as the memory budget allows
+PLAN_AHEAD = 12 # slots laid out ahead of those being loaded
+STARTUP_COUNT = 4 # photos a lane saved to start with next time
+STARTUP_SAVE_EVERY = 15 # seconds - often enough to be close after a power cut, it's a few kB
 
 IMAGE_GAP = 150
-TRANSITION_SPEED = 0.5
+TRANSITION_SPEED = 0.5 # pixels a frame at FRAMES_PER_SECOND
+
+LANES = 1 # rows of photos one above the other, each with its own layout and speed (see lane_pipeline)
+LANE_SPEEDS = (1.0, 0.75, 1.25) # times TRANSITION_SPEED from the top lane down, round again if more lanes
+TEXTURE_BUDGET_MB = 96 # for the photos' textures, split evenly between the lanes
 
 IMAGE_MAX_HEIGHT = 650
 IMAGE_MAX_WIDTH = 900
 
 RANDOMIZE_SIZES = True
 
+BACKGROUND_MODE = 'uv' # 'uv' scrolls one texture in the shader, 'sprites' leapfrogs two full screen sprites
+
+SCROLL_MODE = 'camera' # 'camera' moves CAMERA over sprites that stay put, 'translate' moves every sprite every frame
+REBASE_DISTANCE = 200000 # in camera mode shift everything back after this far so the floats stay precise
+
 PAUSE_WHEN_UNWATCHED = True
 MIN_DURATION_WITHOUT_MOTION = 15 * 60
 
 displayOn = True
 
-photos = []
+lanes = [] # lane_pipeline.Lane for each row, top first. Each has its photos, layout and scroll_x
+lane_size = (DISPLAY.width, DISPLAY.height) # what photos are matted to fit, set by make_lanes()
+pipeline = None # lane_pipeline.LoadPipeline handing the loaders work from every lane
+extents_lock = threading.Lock()
+extent_seq = 0 # tie breaker so photo dicts never get compared
 backgrounds = []
-
-fileQ = queue.Queue()
-
-nextPhotoIndex = 0
-fileNames, numFiles = PhotoUtils.get_files(None, None)
+background_offset = 0.0
+view_offset = config.NODE_INDEX * DISPLAY.width # this screen's middle is at scroll_x + view_offset
+sync = None # wall_sync Coordinator or Follower when one of several screens
+
+matter = None # only used for sizes when laying out, each loader has its own
+layout_lock = threading.Lock()
+budget = mem_budget.MemoryBudget()
+governor = quality_governor.QualityGovernor()
+remote = None # render_server.RenderClient when --render_server is set
+uploads = upload_scheduler.UploadScheduler(config.UPLOAD_MS) # textures go onto the GPU from the render loop
+render_pool = None # shared_assets.RenderPool when --render_processes is set
+thermo = None # thermal.ThermalGovernor unless --thermal_target is 0
+atlas = None # captions.GlyphAtlas when --show_text asks for captions
+loads_done = 0
+first_load_marked = False
+
+fileNames, numFiles = [], 0 # filled in by boot_background()
+order_id = None # what fileNames' order was saved as, see startup.save_play_order()
+sampler = None # play_sampler.PlaySampler over fileNames when shuffling, swapped with it
+rescan_pending = False # a control set changed what's in the list, rescanned once the whole set is in
+rescan_lock = threading.Lock() # one scan at a time so they land in the order they were asked for
 
 lastMotionAt = datetime.datetime.now().timestamp()
 
-def last_photo():
-  if (len(photos) > 0):
-    return photos[-1]
-
-  return None
-
-def randomize (ratio):
+def randomize (ratio, rng=random):
   if not RANDOMIZE_SIZES:
     return 0.9
 
-  return random.randrange(80, 100, 10) / 100
-
-def revised_sizes (img):
-  w = img.width
-  h = img.height
+  return rng.randrange(80, 100, 10) / 100
 
+def revised_sizes (w, h, rng=random):
   if w > h:
-    wr = randomize(IMAGE_MAX_WIDTH / w)
+    wr = randomize(IMAGE_MAX_WIDTH / w, rng)
     if wr > 1:
       wr = 1
-    return (wr * w, wr * h)
+    return (wr * w, wr * h, wr)
   else:
-    hr = randomize(IMAGE_MAX_HEIGHT / h)
+    hr = randomize(IMAGE_MAX_HEIGHT / h, rng)
     if hr > 1:
       hr = 1
-    return (hr * w, hr * h)
+    return (hr * w, hr * h, hr)
+
+def slot_size(pic_num, rng):
+  # sizer for strip_layout - all from the file header so nothing is decoded
+  pic = fileNames[pic_num]
+  if quarantine.is_quarantined(pic.fname, pic.mtime):
+    return None # failed before, skipped without opening it
+  if not mirror.available(pic.fname):
+    return None # the share is down and this one isn't mirrored
+  if pic.shown_with is not None:
+    return None # already shown as the other half of a portrait pair
+  if pic.dt is not None and ((PhotoUtils.date_from is not None and pic.dt < time.mktime(PhotoUtils.date_from + (0, 0, 0, 0, 0, 0)))
+                             or (PhotoUtils.date_to is not None and pic.dt > time.mktime(PhotoUtils.date_to + (0, 0, 0, 0, 0, 0)))):
+    if sampler is not None: # its date wasn't known when the weights were made
+      sampler.exclude(pic_num)
+    return None
+  mat_type = rng.choice(matter.mat_type)
+  (w, h) = matter.matted_size(PhotoUtils.image_size(pic), mat_type)
+  (width, height, factor) = revised_sizes(w, h, rng)
+  return (width, height, factor, mat_type)
+
+def fit_to_slot(img, slot):
+  # the plan came from the header so normally this is exact, but a portrait pair
+  # or a file that changed underneath us has to be squeezed into the space planned
+  scale = min(slot.width / img.width, slot.height / img.height)
+  return (img.width * scale, img.height * scale)
+
+def texture_bytes(img):
+  # what the texture takes on the GPU, a third more for the mipmaps
+  return img.width * img.height * len(img.mode) * 4 // 3
 
 def tex_load():
-  matter = PhotoUtils.get_matter(DISPLAY)
+  thread_matter = PhotoUtils.make_matter(lane_size) # MatImage keeps per photo state so one each
 
   while True:
-    photoIndex = fileQ.get()
-
-    last = last_photo()
-
-    tex = PhotoUtils.tex_load(matter, photoIndex, fileNames)
-
-    if tex is None:
-      fileQ.task_done()
-      continue
-
-    texture, img = tex
-
-    if texture is None or img is None:
-      fileQ.task_done()
-      continue
-
-    width, height = revised_sizes(img)
-    sprite = pi3d.ImageSprite(texture=texture, shader=SHADER, w=width, h=height, camera=CAMERA)
+    lane = pipeline.take(runway) # the lane that will run out soonest, once a loader may start
+    try:
+      load_photo(lane, thread_matter)
+    finally:
+      pipeline.finished()
+
+def load_photo(lane, thread_matter):
+  global loads_done, first_load_marked
+
+  with layout_lock: # slots handed out in order even if loads finish out of order
+    slot = lane.layout.next_slot()
+    planned = list(lane.layout.plan(PLAN_AHEAD))
+    upcoming = planned[:render_server.AHEAD]
+    files = fileNames # could be swapped by a rescan while this one loads
+    drawn = lane.layout.picker is not None
+
+  if slot is None:
+    return
 
-    if last is not None:
-      sprite.positionX(last['sprite'].x() + last['width']/2 + IMAGE_GAP + width/2)
+  pic = files[slot.pic_num]
+  local_mirror = mirror.get()
+  if local_mirror is not None: # copy the files this lane shows next while this one loads
+    if drawn: # nothing's known past what's planned
+      local_mirror.read_ahead([files[s.pic_num].fname for s in planned], lane.index)
     else:
-      sprite.positionX(DISPLAY.width)
-
-    DISPLAY.add_sprites(sprite)
-
-    photos.append({'sprite': sprite, 'width': width, 'height': height})
-
-    fileQ.task_done()
+      local_mirror.read_ahead([files[(slot.pic_num + k * len(lanes)) % len(files)].fname
+                               for k in range(1, mirror.READ_AHEAD + 1)], lane.index)
+  cached = PhotoUtils.is_rendered(thread_matter, pic, slot.mat_type)
+  if remote is not None:
+    for s in [slot] + upcoming: # already cached or asked for are passed over
+      remote.request(thread_matter, files[s.pic_num], s.mat_type)
+    if not cached:
+      cached = remote.wait(thread_matter, pic, slot.mat_type, seconds_until_visible(lane, slot.left))
+
+  src_size = PhotoUtils.image_size(pic)
+  mpix = src_size[0] * src_size[1] / 1000000
+  estimate = mem_budget.estimate_peak(src_size, lane_size)
+  load_start = time.time()
+  budget.admit(estimate)
+  try:
+    time_left = seconds_until_visible(lane, slot.left)
+    quality = governor.cached() if cached else governor.choose(mpix, time_left)
+    start_tm = time.time()
+    tex = PhotoUtils.tex_load(thread_matter, slot.pic_num, files, mat_type=slot.mat_type, quality=quality,
+                              render=None if render_pool is None else render_pool.render_image)
+    if not cached and tex is not None: # skipped, quarantined or failed says nothing about how long a render takes
+      governor.record(quality, mpix, time.time() - start_tm, time_left)
+  finally:
+    budget.release(estimate)
+  pipeline.record(lane, time.time() - load_start, seconds_until_visible(lane, slot.left) < 0, slot.width + IMAGE_GAP)
+
+  loads_done += 1
+  if config.MEM_DEBUG and loads_done % 20 == 0:
+    print(mem_budget.report())
+  if config.VERBOSE and loads_done % 20 == 0:
+    print('quality used: ' + governor.report())
+    if remote is not None:
+      print(remote.report())
+    if mirror.get() is not None:
+      print(mirror.get().report())
+    print(uploads.report())
+    if render_pool is not None:
+      print(render_pool.report())
+    if thermo is not None:
+      print(thermo.report())
+    if sampler is not None:
+      print(sampler.report())
+    if len(lanes) > 1:
+      print(pipeline.report(lane_speed))
+
+  if tex is None:
+    return
 
-def next_image():
-  global nextPhotoIndex
+  texture, img, _backdrop = tex # no size passed so never a backdrop
 
-  fileQ.put(nextPhotoIndex)
-  nextPhotoIndex += 1
+  if texture is None or img is None:
+    return
 
-  if nextPhotoIndex >= len(fileNames):
-    nextPhotoIndex = 0
+  width, height = fit_to_slot(img, slot)
+  render_path = PhotoUtils.rendered_path(thread_matter, files[slot.pic_num], slot.mat_type)
+  if config.SYNC_ROLE == 'coordinator': # rendered once here for every screen
+    sync.publish(slot.index, slot.left + (slot.width - width) / 2, width, height,
+                 PhotoUtils.image_bytes(img, render_path))
+  nbytes = texture_bytes(img)
+  tex = img = None # the texture has its own copy of the pixels
+  show_when_uploaded(lane, texture, slot.left + (slot.width - width) / 2,
+                     {'width': width, 'height': height, 'slot': slot, 'texture_bytes': nbytes, 'name': files[slot.pic_num].fname,
+                      'render_path': render_path, 'caption_lines': captions.caption_lines(files[slot.pic_num])})
+
+  if not first_load_marked:
+    first_load_marked = True
+    startup.mark('first photo loaded')
+    if config.VERBOSE:
+      print(startup.report())
+
+def make_lanes():
+  global LANES, lane_size, pipeline
+
+  if LANES > 1 and config.SYNC_ROLE != 'none':
+    print('wall_sync only shares a single lane so LANES is set back to 1')
+    LANES = 1
+  lane_height = DISPLAY.height / LANES
+  lane_size = (DISPLAY.width, int(lane_height))
+  for i in range(LANES):
+    camera = CAMERA if i == 0 else pi3d.Camera((0, 0, 0), (0, 0, -1), (1, 1000, 45.0, DISPLAY.width/DISPLAY.height), is_3d=False)
+    lanes.append(lane_pipeline.Lane(i, DISPLAY.height/2 - (i + 0.5) * lane_height, lane_height,
+                                    LANE_SPEEDS[i % len(LANE_SPEEDS)], camera))
+  pipeline = lane_pipeline.LoadPipeline(lanes, TEXTURE_BUDGET_MB, LOADER_THREADS)
+
+def screen_left(lane):
+  # world x of the left edge of this screen
+  return lane.scroll_x + view_offset - DISPLAY.width/2
+
+def wall_right(lane):
+  # right edge of the last screen, same as this one's unless part of a wall_sync wall
+  return lane.scroll_x - DISPLAY.width/2 + config.SYNC_NODES * DISPLAY.width
+
+def lane_speed(lane):
+  return TRANSITION_SPEED * lane.speed * FRAMES_PER_SECOND # pixels a second
+
+def seconds_until_visible(lane, left):
+  # the deadline for a load - when its left edge (strip x) reaches the right of the wall
+  distance = left - lane.strip_origin - wall_right(lane)
+  speed = lane_speed(lane)
+  if speed <= 0:
+    return 3600.0 # not moving so plenty of time
+  return distance / speed
+
+def runway(lane):
+  # how long the lane has before the next slot it wants loaded comes on
+  return seconds_until_visible(lane, lane.next_left())
+
+def next_image(lane):
+  # a loader thread takes the next slot off the lane's layout, this just asks for one
+  pipeline.request(lane)
+
+def set_preload_count(count):
+  global PRELOAD_IMAGE_COUNT
+
+  change = count - PRELOAD_IMAGE_COUNT
+  PRELOAD_IMAGE_COUNT = count
+  for lane in lanes:
+    if change < 0:
+      pipeline.drop(lane, -change) # let the strip run down as photos scroll off
+    for i in range(change):
+      next_image(lane)
+
+def set_image_gap(gap):
+  global IMAGE_GAP
+
+  IMAGE_GAP = gap
+  with layout_lock:
+    for lane in lanes:
+      lane.layout.gap = gap # only for slots not planned yet
+
+def save_play_order(files):
+  # so the next run can carry on through the same order, returns what it's saved as.
+  # Not when shuffling, the sampler doesn't play from an order
+  new_order_id = '{:.6f}'.format(time.time())
+  startup.save_play_order(config.CACHE_DIR, new_order_id, files.fnames())
+  return new_order_id
+
+def make_sampler(files, old=None):
+  # None when not shuffling so the layouts go through files in order
+  if not PhotoUtils.shuffle:
+    return None
+  dates = [None if d is None else time.mktime(d + (0, 0, 0, 0, 0, 0)) for d in (PhotoUtils.date_from, PhotoUtils.date_to)]
+  new_sampler = play_sampler.PlaySampler(files, config.RECENT_N, *dates)
+  if old is not None: # what's just been on doesn't come straight back
+    new_sampler.carry_over(old)
+  return new_sampler
+
+def next_pic_num():
+  # a lane layout's picker, from whichever sampler goes with fileNames now
+  return None if sampler is None else sampler.draw()
+
+def use_files(files, new_order_id, new_sampler):
+  global fileNames, numFiles, order_id, sampler
+
+  with layout_lock:
+    if new_sampler is not None: # drawn for the old list but thrown away, so not shown
+      new_sampler.give_back([fileNames[pos].fname for lane in lanes for pos in lane.layout.drawn()])
+    fileNames, numFiles, order_id, sampler = files, len(files), new_order_id, new_sampler
+    for lane in lanes: # throw away what was planned from the old list
+      lane.layout.picker = None if sampler is None else next_pic_num
+      lane.layout.restart(lane.index)
+
+def rescan():
+  # get_files walks the whole library so it runs on its own and the swap happens between frames
+  def scan():
+    with rescan_lock:
+      files, _num = PhotoUtils.get_files(PhotoUtils.date_from, PhotoUtils.date_to)
+      new_sampler = make_sampler(files, sampler)
+      new_order_id = save_play_order(files) if new_sampler is None else None
+      control.call_soon(lambda: use_files(files, new_order_id, new_sampler)).wait()
+  threading.Thread(target=scan, daemon=True).start()
+
+def rescan_soon():
+  # the setters from one control set all run before anything queued by them, so this sees them all
+  global rescan_pending
+  if not rescan_pending:
+    rescan_pending = True
+    control.call_soon(run_pending_rescan)
+
+def run_pending_rescan():
+  global rescan_pending
+  rescan_pending = False
+  rescan()
+
+def register_controls():
+  def global_setter(name):
+    def set_value(value):
+      globals()[name] = value
+    return set_value
+
+  def photo_utils_setter(name, then_rescan):
+    def set_value(value):
+      setattr(PhotoUtils, name, value)
+      if then_rescan:
+        rescan_soon()
+    return set_value
+
+  for name in ('TRANSITION_SPEED', 'IMAGE_MAX_HEIGHT', 'IMAGE_MAX_WIDTH', 'MIN_DURATION_WITHOUT_MOTION'):
+    control.register(name, lambda name=name: globals()[name], global_setter(name))
+  control.register('PRELOAD_IMAGE_COUNT', lambda: PRELOAD_IMAGE_COUNT, set_preload_count, int)
+  control.register('IMAGE_GAP', lambda: IMAGE_GAP, set_image_gap)
+  control.register('UPLOAD_MS', lambda: uploads.budget_ms, lambda value: setattr(uploads, 'budget_ms', value))
+  for (name, parse, then_rescan) in (('time_delay', float, False),
+                                     ('shuffle', control.parse_bool, True),
+                                     ('subdirectory', str, True),
+                                     ('date_from', control.parse_date, True),
+                                     ('date_to', control.parse_date, True)):
+    control.register(name, lambda name=name: getattr(PhotoUtils, name), photo_utils_setter(name, then_rescan), parse)
+  control.add_command('quality', lambda request: {'ok': True, 'report': governor.report()})
+  control.add_command('profile', sampling_profiler.control_command)
+  control.add_command('quarantine', lambda request: {'ok': True, 'report': quarantine.report()})
+  control.add_command('lanes', lambda request: {'ok': True, 'report': pipeline.report(lane_speed)})
+  control.add_command('mirror', lambda request: {'ok': True, 'report': mirror.get().report() if mirror.get() else 'mirror is off'})
+  control.add_command('uploads', lambda request: {'ok': True, 'report': uploads.report()})
+  control.add_command('play', lambda request: {'ok': True, 'report': sampler.report() if sampler else 'playing in order'})
+  control.add_command('thermal', lambda request: {'ok': True, 'report': thermo.report() if thermo else 'thermal governor is off'})
+  control.add_command('workers', lambda request: {'ok': True, 'report': render_pool.report() if render_pool else 'matting in the loader threads'})
+  control.start(config.CONTROL_SOCKET)
+
+def world_to_sprite_x(lane, x):
+  # in camera mode sprites live in world space, otherwise in screen space
+  return x if SCROLL_MODE == 'camera' else x - lane.scroll_x
+
+def add_photo(lane, photo):
+  global extent_seq
+
+  with extents_lock: # under the lock so scroll_x can't move while translating to sprite x
+    photo['sprite'].positionX(world_to_sprite_x(lane, (photo['left'] + photo['right']) / 2))
+    photo['sprite'].positionY(lane.y)
+    extent_seq += 1
+    bisect.insort(lane.extents, (photo['right'], photo['left'], extent_seq, photo))
+    lane.photos.append(photo)
+  pipeline.texture_added(lane, photo.get('texture_bytes', 0))
+  if lane.captions is not None and photo.get('caption_lines'):
+    lane.captions.add(photo, photo['caption_lines'])
+  DISPLAY.add_sprites(photo['sprite'])
+
+def show_when_uploaded(lane, texture, strip_left, photo):
+  # from any thread. The sprite is made and added on the render thread once
+  # uploads has the texture on the GPU, strip_left is where it goes along the strip
+  tiled = isinstance(texture, tiled_sprite.Tiles)
+  def then():
+    left = strip_left - lane.strip_origin # now, as a rebase may have come in between
+    if tiled: # its tiles go up as they come on screen, see display_images
+      sprite = tiled_sprite.TiledSprite(texture, photo['width'], photo['height'], lane.camera, SHADER, uploads)
+    else:
+      sprite = pi3d.ImageSprite(texture=texture, shader=SHADER, w=photo['width'], h=photo['height'], camera=lane.camera)
+    photo.update({'left': left, 'right': left + photo['width'], 'sprite': sprite, 'tiled': tiled})
+    if tiled:
+      lane.tiled.append(photo)
+    add_photo(lane, photo)
+  if tiled:
+    uploads.call_soon(then)
+  else:
+    uploads.submit(texture, then)
 
-def clear_image(photo):
+def clear_image(lane, photo):
   DISPLAY.remove_sprites(photo['sprite'])
-  photos.remove(photo)
-
-def animate_image(photo):
-  photo['sprite'].translateX(-TRANSITION_SPEED)
-  #CAMERA.offset((TRANSITION_SPEED, 0, 0))
-
-def animate_background(background):
-  background.translateX(-TRANSITION_SPEED)
+  with extents_lock:
+    lane.photos.remove(photo)
+  if photo.get('tiled'):
+    lane.tiled.remove(photo)
+  pipeline.texture_freed(lane, photo.get('texture_bytes', 0))
+  if lane.captions is not None:
+    lane.captions.remove(photo)
+
+def animate_image(photo, step):
+  photo['sprite'].translateX(-step)
+
+def animate_background(background, step):
+  background.translateX(-step)
+
+def first_invisible_photo(lane):
+  # extents is kept sorted on the right edge so if the first one is still on
+  # screen then all the others are too - O(1) whatever the number of sprites
+  with extents_lock:
+    if len(lane.extents) > 0 and lane.extents[0][0] < lane.scroll_x + view_offset - DISPLAY.width/2:
+      return lane.extents.pop(0)[3]
+  return None
 
-def is_image_invisible(photo):
-  is_invisible = photo['sprite'].x() + DISPLAY.width/2 + photo['width']/2 < 0  
-  return is_invisible
+def rebase(lane):
+  # rare, so fine to be O(n). Shift the lane's world back so its scroll_x is zero again
+  with extents_lock:
+    shift = lane.scroll_x
+    lane.strip_origin += shift
+    for i, (right, left, seq, photo) in enumerate(lane.extents):
+      photo['left'] -= shift
+      photo['right'] -= shift
+      lane.extents[i] = (photo['right'], photo['left'], seq, photo)
+      if SCROLL_MODE == 'camera':
+        photo['sprite'].translateX(-shift)
+    if SCROLL_MODE == 'camera' and BACKGROUND_MODE != 'uv' and lane.index == 0: # the background goes with the top lane
+      for background in backgrounds:
+        background.translateX(-shift)
+    lane.scroll_x = 0.0
+  if lane.captions is not None:
+    lane.captions.dirty = True
+
+def animate_background_uv():
+  global background_offset
+  # one texture width is one display width. Mirrored repeat has a period of two
+  # so wrap there to keep the float small. Worked out from the position rather
+  # than added to each frame so the screens of a wall_sync wall line up
+  lane = lanes[0]
+  period = 2.0 * DISPLAY.width
+  background_offset = ((lane.strip_origin % period + lane.scroll_x + view_offset) % period) / DISPLAY.width
+  backgrounds[0].set_offset((background_offset, 0.0))
+  if SCROLL_MODE == 'camera':
+    backgrounds[0].positionX(lane.scroll_x + view_offset) # stays in front of the camera, only the texture moves
 
 def is_background_invisible(background):
-  is_invisible = background.x() + DISPLAY.width < 0  
+  is_invisible = background.x() - (lanes[0].scroll_x + view_offset if SCROLL_MODE == 'camera' else 0.0) + DISPLAY.width < 0
   return is_invisible
 
-def boot():
-  thread = threading.Thread(target=tex_load)
-  thread.daemon = True
-  thread.start()
-
-  background_texture1 = PhotoUtils.background_texture(DISPLAY)
-  background_texture2 = PhotoUtils.background_texture(DISPLAY)
-  background_sprite1 = pi3d.ImageSprite(texture=background_texture1, shader=SHADER, w=DISPLAY.width, h=DISPLAY.height, z=2000, camera=CAMERA)
-  background_sprite2 = pi3d.ImageSprite(texture=background_texture2, shader=SHADER, w=DISPLAY.width, h=DISPLAY.height, z=2000, camera=CAMERA)
-  background_sprite2.translateX(DISPLAY.width)
+def show_startup_set(state):
+  # last run's photos straight from the render cache - no scan, matting or layout needed.
+  # Returns where each photo put back ends along the strip and where each lane's layout
+  # should carry on as (slot index, position in last run's play order, strip x, names), or
+  # None. names are the photos saved that weren't put back, to play first when shuffling
+  lefts = [screen_left(lane) + IMAGE_GAP for lane in lanes] # fill the screen from the left straight away
+  resume = [None] * len(lanes)
+  if len(state['lanes']) == len(lanes): # where the layouts had got to, for a lane with no photos to put back
+    for (lane, saved) in zip(lanes, state['lanes']):
+      if saved is not None:
+        resume[lane.index] = (saved['index'], saved['pic_num'], saved['left'] + screen_left(lane) + lane.strip_origin, [])
+  else:
+    state['lanes'] = [] # saved with more lanes or fewer so the layouts start afresh
+  counts = [0] * len(lanes)
+  stopped = set() # lanes whose next photo couldn't be put back
+  shown = 0
+  for entry in state['photos']:
+    lane_ix = entry.get('lane', 0)
+    if lane_ix in stopped and entry.get('name') and resume[lane_ix] is not None:
+      resume[lane_ix][3].append(entry['name'])
+    if (lane_ix >= len(lanes) or lane_ix in stopped or counts[lane_ix] >= STARTUP_COUNT
+        or entry['height'] > lanes[lane_ix].height): # saved with more lanes or fewer
+      continue
+    lane = lanes[lane_ix]
+    slot = entry.get('slot') # [index, pic_num, left, right] with x from the left of the screen
+    origin = screen_left(lane) + lane.strip_origin # strip x of the left of the screen
+    texture = None
+    if entry.get('render_path'):
+      try:
+        texture = tiled_sprite.texture_or_tiles(Image.open(entry['render_path']))
+      except Exception as e:
+        if config.VERBOSE:
+          print('''Couldn't load startup photo {} giving error: {}'''.format(entry['render_path'], e))
+    if texture is None:
+      if slot is not None and len(state['lanes']) > 0: # the layout carries on from this one so it isn't missed
+        resume[lane_ix] = (slot[0], slot[1], slot[2] + origin, [entry['name']] if entry.get('name') else [])
+        stopped.add(lane_ix)
+      continue
+    (width, height) = (entry['width'], entry['height'])
+    left = lefts[lane_ix] if slot is None else entry['left'] + origin - lane.strip_origin
+    photo = {'width': width, 'height': height, 'startup': True, 'render_path': entry['render_path'],
+             'caption_lines': entry.get('caption_lines'), 'name': entry.get('name')}
+    if slot is not None: # so it's saved with the next startup set too
+      photo['slot'] = strip_layout.Slot(slot[0], slot[1], slot[2] + origin, slot[3] - slot[2], height, None, None)
+      if len(state['lanes']) > 0:
+        resume[lane_ix] = (slot[0] + 1, slot[1] + len(lanes), slot[3] + IMAGE_GAP + origin, [])
+    show_when_uploaded(lane, texture, left + lane.strip_origin, photo)
+    if config.SYNC_ROLE == 'coordinator':
+      sync.publish(-1 - shown, left + lane.strip_origin, width, height, PhotoUtils.image_bytes(None, entry['render_path']))
+    shown += 1
+    counts[lane_ix] += 1
+    if shown == 1:
+      startup.mark('first startup photo')
+    lefts[lane_ix] = left + width + IMAGE_GAP
+  return (lefts, resume)
+
+def save_startup_set():
+  while True:
+    time.sleep(STARTUP_SAVE_EVERY)
+    entries = []
+    cursors = []
+    with layout_lock, extents_lock: # leftmost first, so what's on screen now
+      for lane in lanes:
+        origin = screen_left(lane) + lane.strip_origin
+        saved = []
+        rest = [] # on the wall after the ones saved, shown again first when shuffling
+        for (_right, left, _seq, photo) in lane.extents:
+          slot = photo.get('slot')
+          # stop at a gap too, the one in between is still loading and it's loaded again next time
+          if len(rest) > 0 or len(saved) >= STARTUP_COUNT or (slot is None and not photo.get('render_path')) or (
+              slot is not None and len(saved) > 0 and 'slot' in saved[-1] and slot.index != saved[-1]['slot'][0] + 1):
+            if slot is None or not photo.get('name'):
+              break
+            rest.append(photo['name'])
+            continue
+          entry = {'render_path': photo.get('render_path'), 'width': photo['width'], 'height': photo['height'],
+                   'lane': lane.index, 'caption_lines': photo.get('caption_lines'), 'left': left + lane.strip_origin - origin,
+                   'name': photo.get('name')}
+          if slot is not None:
+            entry['slot'] = [slot.index, slot.pic_num, slot.left - origin, slot.right - origin]
+          saved.append(entry)
+        entries += saved
+        # the next slot to hand out for a lane with nothing on the wall that came from the layout
+        layout = lane.layout
+        if layout is None:
+          cursors.append(None)
+          continue
+        (index, pic_num, left) = (layout.next_index, layout.next_pic_num, layout.next_left)
+        if len(layout.planned) > 0:
+          (index, pic_num, left) = (layout.planned[0].index, layout.planned[0].pic_num, layout.planned[0].left)
+        cursor = {'seed': layout.seed, 'index': index, 'pic_num': pic_num, 'left': left - origin}
+        if layout.picker is not None: # the sampler's draws, by name as there's no saved order
+          cursor['picks'] = rest + [fileNames[pos].fname for pos in layout.drawn()]
+        cursors.append(cursor)
+      (saved_order_id, saved_sampler) = (order_id, sampler)
+    cooling = None if saved_sampler is None else saved_sampler.cooling_names()
+    if len(entries) > 0:
+      startup.save_startup_set(config.CACHE_DIR, entries, cursors, saved_order_id, PhotoUtils.shuffle, cooling)
+
+def boot_background():
+  # everything the first frame doesn't need
+  global fileNames, numFiles, order_id, sampler, matter, pir, remote, atlas
+
+  if config.SHOW_TEXT:
+    atlas = captions.load_atlas() # the glyphs are only drawn the first time for a font and size
+  if atlas is not None:
+    atlas.make_texture()
+    for lane in lanes:
+      lane.captions = captions.CaptionBatch(atlas, lane.camera, SHADER)
+      DISPLAY.add_sprites(lane.captions.shape)
+    startup.mark('captions')
+
+  state = startup.load_startup_set(config.CACHE_DIR)
+  (first_lefts, resume) = show_startup_set(state)
+  startup.mark('startup set shown')
+
+  files, num = PhotoUtils.get_files(None, None)
+  startup.mark('library scanned ({} files)'.format(num))
+  names = None
+  carry_on = len(state['lanes']) > 0 and state['shuffle'] == PhotoUtils.shuffle
+  if carry_on and not PhotoUtils.shuffle:
+    names = startup.load_play_order(config.CACHE_DIR, state['order_id'])
+    carry_on = names is not None
+  if names is not None: # carry on through last run's order, new photos after it
+    moved = files.follow(names)
+    startup.mark('play order followed')
+  new_sampler = make_sampler(files)
+  new_order_id = save_play_order(files) if new_sampler is None else None
+  position = {}
+  if carry_on and new_sampler is not None: # what was just on stays cooling, what was coming up still comes
+    coming = [name for lane in lanes if resume[lane.index] is not None for name in resume[lane.index][3]]
+    coming += [name for saved in state['lanes'] if saved is not None for name in saved.get('picks', [])]
+    position = new_sampler.restore(state['cooling'], coming)
+    startup.mark('cooling photos restored')
+  matter = PhotoUtils.make_matter(lane_size)
+  with layout_lock:
+    fileNames, numFiles, order_id, sampler = files, num, new_order_id, new_sampler
+    picker = None if sampler is None else next_pic_num
+    for lane in lanes: # lane i shows photos i, i + LANES, ... of the play order
+      saved = state['lanes'][lane.index] if carry_on else None
+      if saved is not None and resume[lane.index] is not None: # the same layout from the slot after the last one put back
+        lane.layout = strip_layout.StripLayout(slot_size, lambda: len(fileNames), IMAGE_GAP, seed=saved['seed'], stride=len(lanes),
+                                               picker=picker)
+        (index, pic_num, left, unshown) = resume[lane.index]
+        if sampler is not None: # the photos that were coming up, then draws
+          lane.layout.seek(index, 0, left, [position[name] for name in unshown + saved.get('picks', []) if name in position])
+          continue
+        pic_num = int(moved[min(pic_num, len(names))]) # where it's got to with photos gone from the library
+        pic_num += (lane.index - pic_num) % len(lanes) # still this lane's share of the order
+        lane.layout.seek(index, pic_num, left)
+        continue
+      lane.layout = strip_layout.StripLayout(slot_size, lambda: len(fileNames), IMAGE_GAP, stride=len(lanes), picker=picker)
+      # first one starts after the startup set or just off the right of the screen
+      lane.layout.seek(0, lane.index, max(first_lefts[lane.index], wall_right(lane) + IMAGE_GAP) + lane.strip_origin)
+
+  if config.RENDER_SERVER:
+    remote = render_server.RenderClient(config.RENDER_SERVER)
+  for i in range(LOADER_THREADS):
+    thread = threading.Thread(target=tex_load, name='loader-{}'.format(i)) # named for the profiler
+    thread.daemon = True
+    thread.start()
+  startup.mark('loaders started')
+
+  if config.THERMAL_TARGET > 0:
+    start_thermal()
+
+  register_controls()
+  threading.Thread(target=save_startup_set, daemon=True).start()
+
+  from gpiozero import MotionSensor
+  pir = MotionSensor(4)
+  startup.mark('motion sensor')
+
+def start_thermal():
+  global thermo
+
+  def apply(fps, loaders, quality_floor): # on the thermal thread
+    DISPLAY.frames_per_second = fps # read afresh each frame by pi3d
+    if pipeline is not None:
+      pipeline.set_loaders(loaders)
+    governor.floor = quality_floor
+
+  thermo = thermal.ThermalGovernor(config.THERMAL_TARGET, FRAMES_PER_SECOND, LOADER_THREADS, apply)
+  thermo.start()
+
+def sync_position():
+  # for the wall_sync Coordinator, strip x of the middle of the leftmost screen
+  with extents_lock:
+    return (lanes[0].strip_origin + lanes[0].scroll_x, displayOn)
+
+def follower_photo(header, payload):
+  # a photo rendered by the wall_sync coordinator, called on the thread receiving it
+  try:
+    texture = PhotoUtils.bytes_texture(payload)
+  except Exception as e:
+    print('''Couldn't load photo {} from the coordinator giving error: {}'''.format(header['id'], e))
+    return
+  (width, height) = (header['width'], header['height'])
+  lane = lanes[0] # a wall_sync wall only ever has the one
+  show_when_uploaded(lane, texture, header['left'], {'width': width, 'height': height, 'remote': True})
 
-  # background_sprite.draw()
-  DISPLAY.add_sprites(background_sprite1)
-  DISPLAY.add_sprites(background_sprite2)
+def boot():
+  global sync, PRELOAD_IMAGE_COUNT, render_pool
+
+  make_lanes()
+  if config.RENDER_PROCESSES > 0 and config.SYNC_ROLE != 'follower': # forked so before any threads start
+    render_pool = shared_assets.RenderPool(config.RENDER_PROCESSES, lane_size)
+    startup.mark('render workers')
+  if BACKGROUND_MODE == 'uv':
+    background_texture = pi3d.Texture(PhotoUtils.background_tile(DISPLAY), m_repeat=True, free_after_load=True)
+    background_sprite = pi3d.ImageSprite(texture=background_texture, shader=SHADER, w=DISPLAY.width, h=DISPLAY.height, z=2000, camera=CAMERA)
+    DISPLAY.add_sprites(background_sprite)
+    backgrounds.append(background_sprite)
+  else:
+    background_texture = pi3d.Texture(PhotoUtils.background_texture(DISPLAY)) # one texture shared by both sprites
+    background_sprite1 = pi3d.ImageSprite(texture=background_texture, shader=SHADER, w=DISPLAY.width, h=DISPLAY.height, z=2000, camera=CAMERA)
+    background_sprite2 = pi3d.ImageSprite(texture=background_texture, shader=SHADER, w=DISPLAY.width, h=DISPLAY.height, z=2000, camera=CAMERA)
+    background_sprite2.translateX(DISPLAY.width)
+
+    # background_sprite.draw()
+    DISPLAY.add_sprites(background_sprite1)
+    DISPLAY.add_sprites(background_sprite2)
+
+    backgrounds.append(background_sprite1)
+    backgrounds.append(background_sprite2)
+  startup.mark('background')
+
+  if config.SYNC_ROLE == 'follower': # no library, layout or loaders - everything comes from the coordinator
+    sync = wall_sync.Follower(config.SYNC_HOST, config.SYNC_PORT, config.NODE_INDEX, DISPLAY.width, follower_photo)
+    sync.start()
+    return
+  if config.SYNC_ROLE == 'coordinator':
+    sync = wall_sync.Coordinator(config.SYNC_PORT, DISPLAY.width, sync_position)
+    sync.start()
+    PRELOAD_IMAGE_COUNT *= config.SYNC_NODES - config.NODE_INDEX # photos stay loaded until off the left of this screen
 
-  backgrounds.append(background_sprite1)
-  backgrounds.append(background_sprite2)
+  for lane in lanes:
+    for b in range(PRELOAD_IMAGE_COUNT):
+      next_image(lane) # waiting until the loaders start
 
-  for b in range(PRELOAD_IMAGE_COUNT):
-    next_image()
+  threading.Thread(target=boot_background, daemon=True).start()
 
 def handle_keyboard_events():  
   k = KEYBOARD.read()
@@ -193,36 +772,88 @@ def is_unwatched():
 
 def display_images():
   global lastMotionAt
-  
-  if pir.motion_detected:
-    lastMotionAt = datetime.datetime.now().timestamp()
-
-  if is_unwatched():
-    turn_display_off()
-    return time.sleep(10)
 
-  turn_display_on()
-
-  background_requeue = []
+  control.apply_pending() # anything changed over the control socket goes in between frames
 
-  for background in backgrounds:
-    animate_background(background)
+  if config.SYNC_ROLE == 'follower':
+    if not sync.display_on: # the coordinator has the motion sensor
+      turn_display_off()
+      return time.sleep(1)
+  else:
+    if pir is not None and pir.motion_detected:
+      lastMotionAt = datetime.datetime.now().timestamp()
 
-    if is_background_invisible(background):
-      backgrounds.remove(background)
-      background_requeue.append(background)
+    if is_unwatched():
+      turn_display_off()
+      return time.sleep(10)
 
-  for background in background_requeue:
-    background.positionX(backgrounds[-1].x() + DISPLAY.width)
-    backgrounds.append(background) 
+  turn_display_on()
+  if thermo is not None:
+    thermo.frame()
+
+  # same speed across the screen however many frames a second there are
+  frame_scale = FRAMES_PER_SECOND / (DISPLAY.frames_per_second or FRAMES_PER_SECOND)
+  with extents_lock:
+    for lane in lanes:
+      last_scroll_x = lane.scroll_x
+      if config.SYNC_ROLE == 'follower':
+        pos = sync.position()
+        if pos is not None: # stays put until the first clock update
+          lane.scroll_x = pos - lane.strip_origin
+      else:
+        lane.scroll_x += TRANSITION_SPEED * lane.speed * frame_scale
+      lane_step = lane.scroll_x - last_scroll_x
+      if lane.index == 0:
+        step = lane_step # the background goes with the top lane
+      if SCROLL_MODE != 'camera':
+        for photo in lane.photos:
+          animate_image(photo, lane_step)
+  if SCROLL_MODE == 'camera':
+    for lane in lanes:
+      if lane.scroll_x > REBASE_DISTANCE:
+        rebase(lane)
+      lane.camera.offset((lane.scroll_x + view_offset, 0, 0))
+
+  if BACKGROUND_MODE == 'uv':
+    animate_background_uv()
+  else:
+    background_requeue = []
+
+    for background in backgrounds:
+      if SCROLL_MODE != 'camera':
+        animate_background(background, step)
+
+      if is_background_invisible(background):
+        backgrounds.remove(background)
+        background_requeue.append(background)
+
+    for background in background_requeue:
+      background.positionX(backgrounds[-1].x() + DISPLAY.width)
+      backgrounds.append(background)
+
+  for lane in lanes:
+    photo = first_invisible_photo(lane)
+    while photo is not None:
+      clear_image(lane, photo)
+      if not (photo.get('startup') or photo.get('remote')): # the startup set comes on top of PRELOAD_IMAGE_COUNT
+        next_image(lane)
+      photo = first_invisible_photo(lane)
+
+    view_left = screen_left(lane)
+    for photo in lane.tiled: # only the tiles on screen or coming on are kept on the GPU
+      photo['sprite'].show_between(view_left - photo['left'],
+                                   view_left + DISPLAY.width + tiled_sprite.AHEAD_SECS * lane_speed(lane) - photo['left'])
+
+    if lane.captions is not None:
+      if lane.captions.dirty: # only when a photo has come or gone
+        with extents_lock:
+          lane_photos = list(lane.photos)
+        lane.captions.rebuild(lane_photos, lane.y)
+      if SCROLL_MODE != 'camera':
+        lane.captions.shape.positionX(-lane.scroll_x) # the quads are in world x
+
+  uploads.run() # last so the frame's own work is done first, what it adds is drawn from the next frame
 
-  for photo in photos:
-    animate_image(photo)
-          
-    if is_image_invisible(photo):
-      clear_image(photo)
-      next_image()
-    
 def display():
   while DISPLAY.loop_running():
     display_images()
@@ -233,6 +864,7 @@ def display():
       # break
 
 def main():
+    sampling_profiler.install() # kill -USR1 for a profile, signals have to be set up on the main thread
     boot()
     display()
 
@@ -0,0 +1,141 @@
+""" Rows of photos scrolling at their own speeds, all fed by the one set of
+loader threads.
+
+A Lane holds what index.py used to keep as globals for its single strip - its
+own layout, photos, scroll position and (in camera mode) camera. Lane i takes
+every LANES'th photo of the play order starting at i so the rows show
+different photos.
+
+The LoadPipeline hands the loaders work. Each lane asks for a load as a photo
+scrolls off, and a free loader takes the lane whose next slot will come on
+soonest (the shortest runway). Texture memory is shared out equally, and a
+lane over its share waits for a photo to scroll off before loading more.
+set_loaders() lets fewer of the loaders work at once, i.e. when it's hot.
+
+report() says how the pipeline is keeping up. Demand is each lane's scroll
+speed over its average slot pitch in photos a second. Capacity is what the
+loaders manage per second of being busy. Their ratio is how many lanes of this
+sort the machine could keep fed, which is the number to look at on a Pi 3
+after a run through uncached photos.
+"""
+import time
+import threading
+
+class Lane:
+  def __init__(self, index, y, height, speed, camera):
+    self.index = index
+    self.y = y # middle of the row in pi3d's 2D coordinates, up is +
+    self.height = height
+    self.speed = speed # times TRANSITION_SPEED
+    self.camera = camera
+    self.photos = [] # in the order they were added
+    self.tiled = [] # those of photos with a TiledSprite, which display_images tends each frame
+    self.extents = [] # (right, left, seq, photo) sorted by world x so only extents[0] needs checking each frame
+    self.scroll_x = 0.0 # world x of the middle of the screen in this lane
+    self.strip_origin = 0.0 # strip x of world x zero, moved on by a rebase
+    self.layout = None
+    self.captions = None # captions.CaptionBatch when they're shown
+    self.requests = 0 # loads asked for and not yet taken by a loader
+    self.requests_to_drop = 0 # set when PRELOAD_IMAGE_COUNT is lowered on the fly
+    self.texture_bytes = 0 # of this lane's photos that are loaded
+    self.loads = 0
+    self.late = 0 # loaded after the slot had come on screen
+    self.pitch = 0.0 # total of slot width + gap over the loads
+
+  def next_left(self):
+    # strip x of the next slot a loader will get
+    try:
+      return self.layout.planned[0].left
+    except IndexError: # nothing planned, or taken since looking
+      return self.layout.next_left
+
+class LoadPipeline:
+  def __init__(self, lanes, texture_budget_mb, loaders):
+    self.lanes = lanes
+    self.share = texture_budget_mb * 1048576 / len(lanes)
+    self.loaders = loaders
+    self.limit = loaders # how many may be loading at once
+    self.working = 0
+    self.cond = threading.Condition()
+    self.started = time.time()
+    self.busy = 0.0 # loader seconds spent loading
+
+  def request(self, lane):
+    with self.cond:
+      if lane.requests_to_drop > 0:
+        lane.requests_to_drop -= 1
+        return
+      lane.requests += 1
+      self.cond.notify()
+
+  def drop(self, lane, count):
+    # take back requests not started yet, the rest as photos scroll off
+    with self.cond:
+      taken = min(count, lane.requests)
+      lane.requests -= taken
+      lane.requests_to_drop += count - taken
+
+  def take(self, runway):
+    """ block until a lane wants a photo and has texture memory to spare,
+    and a loader is allowed to start, then return the one whose runway(lane)
+    is shortest. Call finished() when it's loaded """
+    with self.cond:
+      while True:
+        ready = [lane for lane in self.lanes if lane.requests > 0 and lane.texture_bytes < self.share]
+        if len(ready) > 0 and self.working < self.limit:
+          lane = min(ready, key=runway)
+          lane.requests -= 1
+          self.working += 1
+          return lane
+        self.cond.wait(0.5)
+
+  def finished(self):
+    with self.cond:
+      self.working -= 1
+      self.cond.notify_all()
+
+  def set_loaders(self, limit):
+    # the ones already loading finish what they're on
+    with self.cond:
+      self.limit = max(1, min(limit, self.loaders))
+      self.cond.notify_all()
+
+  def texture_added(self, lane, nbytes):
+    with self.cond:
+      lane.texture_bytes += nbytes
+
+  def texture_freed(self, lane, nbytes):
+    with self.cond:
+      lane.texture_bytes -= nbytes
+      self.cond.notify_all()
+
+  def record(self, lane, secs, late, pitch):
+    with self.cond:
+      self.busy += secs
+      lane.loads += 1
+      lane.pitch += pitch
+      if late:
+        lane.late += 1
+
+  def report(self, speed):
+    """ speed(lane) is pixels a second """
+    lines = []
+    demands = []
+    with self.cond:
+      for lane in self.lanes:
+        pitch = lane.pitch / lane.loads if lane.loads > 0 else 0.0
+        demand = speed(lane) / pitch if pitch > 0 else 0.0
+        demands.append(demand)
+        lines.append('lane {}: {:.0f}px/s needs {:.2f} photos/s, {} loaded, {} late, textures {:.0f}/{:.0f}MB, {} waiting'.format(
+                     lane.index, speed(lane), demand, lane.loads, lane.late, lane.texture_bytes / 1048576,
+                     self.share / 1048576, lane.requests))
+      loads = sum(lane.loads for lane in self.lanes)
+      elapsed = max(time.time() - self.started, 1e-3)
+      busy = self.busy
+    capacity = loads / busy * self.loaders if busy > 0 else 0.0
+    lines.append('loaders {:.0%} busy ({} of {} allowed), {:.2f} photos/s done, {:.2f} photos/s possible'.format(
+                 busy / (elapsed * self.loaders), self.limit, self.loaders, loads / elapsed, capacity))
+    mean_demand = sum(demands) / len(demands)
+    if mean_demand > 0:
+      lines.append('enough for about {:.1f} lanes like these'.format(capacity / mean_demand))
+    return '\n'.join(lines)
@@ -1,10 +1,30 @@
 from PIL import Image, ImageOps, ImageDraw
-from ninepatch import Ninepatch
 import numpy as np
 import random
 import logging
 import time
 
+NINEPATCHES = ('9_patch_bevel', '9_patch_drop_shadow', '9_patch_inner_shadow', '9_patch_highlight')
+
+def load_resource_images(resource_folder='.'):
+    """ the images a MatImage mats with, by name. shared_assets.py decodes these
+    once for every process and passes them in as MatImage(resources=...) """
+    images = {'mat_texture': Image.open('{0}/mat_texture.jpg'.format(resource_folder)).convert("L")}
+    for name in NINEPATCHES:
+        images[name] = Image.open('{0}/{1}.png'.format(resource_folder, name))
+    return images
+
+def image_ninepatch(name, image):
+    """ Ninepatch from an image already in memory, it only takes a file name """
+    from ninepatch import Ninepatch # slow import so left until a mat is first needed
+    patch = Ninepatch.__new__(Ninepatch)
+    patch.filename = name # only used as a cache key
+    patch.image = image
+    patch.image_size = image.size
+    patch.marks = patch.find_marks(image)
+    patch.slice_data = patch.slice()
+    return patch
+
 class MatImage:
 
     # region Constructor
@@ -12,7 +32,7 @@ class MatImage:
     def __init__(self, display_size, mat_type = None, outer_mat_color = None,
                 resource_folder='.', inner_mat_color = None, outer_mat_border = 75,
                 inner_mat_border = 40, outer_mat_use_texture = True,
-                inner_mat_use_texture = False, auto_inner_mat_color = True):
+                inner_mat_use_texture = False, auto_inner_mat_color = True, resources = None):
 
         self.__mat_types = ['float', 'float_polaroid', 'float_color_wrap', 'single_bevel', 'double_bevel', 'double_flat']
 
@@ -29,13 +49,13 @@ class MatImage:
         self.outer_mat_color = outer_mat_color
         self.outer_mat_use_texture = outer_mat_use_texture
         self.inner_mat_use_texture = inner_mat_use_texture
+        self.resample = Image.BICUBIC
+        self.reducing_gap = None
 
-        # --- Matting resources ---
-        self.__mat_texture = Image.open('{0}/mat_texture.jpg'.format(resource_folder)).convert("L")
-        self.__9patch_bevel = Ninepatch('{0}/9_patch_bevel.png'.format(resource_folder))
-        self.__9patch_drop_shadow = Ninepatch('{0}/9_patch_drop_shadow.png'.format(resource_folder))
-        self.__9patch_inner_shadow = Ninepatch('{0}/9_patch_inner_shadow.png'.format(resource_folder))
-        self.__9patch_highlight = Ninepatch('{0}/9_patch_highlight.png'.format(resource_folder))
+        # --- Matting resources --- loaded by the first mat_image() call so making one is cheap
+        self.__resource_folder = resource_folder
+        self.__resources = resources # images from load_resource_images(), read from resource_folder if None
+        self.__resources_loaded = False
 
     # endregion Constructor
 
@@ -118,14 +138,38 @@ class MatImage:
     def inner_mat_use_texture(self, val):
         self.__inner_mat_use_texture = val
 
+    @property
+    def resources(self):
+        return self.__resources
+
+    @property
+    def resample(self):
+        return self.__resample
+
+    @resample.setter
+    def resample(self, val):
+        self.__resample = val
+
+    @property
+    def reducing_gap(self):
+        return self.__reducing_gap
+
+    @reducing_gap.setter
+    def reducing_gap(self, val):
+        self.__reducing_gap = val
+
     # endregion Pubic Properties
 
     # region Public Methods
 
-    def mat_image(self, images):
+    def mat_image(self, images, mat_type=None):
 
-        # Randomly pick a mat type from those specified by the User
-        mat_type = random.choice(self.mat_type)
+        if not self.__resources_loaded:
+            self.__load_resources()
+
+        # Randomly pick a mat type from those specified by the User unless the caller already has
+        if mat_type is None:
+            mat_type = random.choice(self.mat_type)
 
         # If a mat color wasn't specified, get one
         if not self.outer_mat_color:
@@ -149,6 +193,29 @@ class MatImage:
 
         return image
 
+    def matted_size(self, image_size, mat_type, pic_count=1):
+        """Size mat_image() will return for an image of image_size, without
+        needing the pixels. Has to follow the arithmetic in the style methods."""
+        bevel_wid = 5
+        shadow_offset = 15
+        border_width = 18
+        if mat_type in ('single_bevel', 'float_polaroid', 'float_color_wrap'):
+            extra = bevel_wid * 2 if mat_type == 'single_bevel' else border_width * 2
+        elif mat_type == 'double_bevel':
+            extra = (self.inner_mat_border * 2) + (bevel_wid * 4)
+        elif mat_type == 'double_flat':
+            extra = self.inner_mat_border * 2
+        else: # float
+            extra = 0
+        pic_wid = (self.display_width / pic_count) - (((pic_count + 1) / pic_count) * self.outer_mat_border) - extra
+        pic_height = self.display_height - (self.outer_mat_border * 2) - extra
+
+        scale = min(pic_wid / image_size[0], pic_height / image_size[1])
+        (w, h) = (int(image_size[0] * scale) + extra, int(image_size[1] * scale) + extra)
+        if mat_type in ('float', 'float_polaroid', 'float_color_wrap'):
+            (w, h) = (w + shadow_offset, h + shadow_offset)
+        return (w, h)
+
     # endregion Public Methods
 
     # region Matting Styles
@@ -261,6 +328,15 @@ class MatImage:
 
     # region Helper Methods
 
+    def __load_resources(self):
+        images = self.__resources or load_resource_images(self.__resource_folder)
+        self.__mat_texture = images['mat_texture']
+        self.__9patch_bevel = image_ninepatch('9_patch_bevel', images['9_patch_bevel'])
+        self.__9patch_drop_shadow = image_ninepatch('9_patch_drop_shadow', images['9_patch_drop_shadow'])
+        self.__9patch_inner_shadow = image_ninepatch('9_patch_inner_shadow', images['9_patch_inner_shadow'])
+        self.__9patch_highlight = image_ninepatch('9_patch_highlight', images['9_patch_highlight'])
+        self.__resources_loaded = True
+
     def __get_mat_type_from_user_string(self, mat_type_string):
         if mat_type_string == None: mat_type_string = ''
 
@@ -285,7 +361,8 @@ class MatImage:
             width, height = size
 
         scale = min(width/image.width, height/image.height)
-        image = image.resize((int(image.width * scale), int(image.height * scale)), resample=Image.BICUBIC)
+        image = image.resize((int(image.width * scale), int(image.height * scale)), resample=self.resample,
+                             reducing_gap=self.reducing_gap)
         return image
 
 
@@ -312,8 +389,9 @@ class MatImage:
 
     def __get_colorized_mat(self, color, use_texture):
         if use_texture:
-            mat_img = self.__mat_texture.copy()
-            mat_img = mat_img.resize(self.display_size, resample=Image.BICUBIC)
+            mat_img = self.__mat_texture
+            if mat_img.size != self.display_size: # shared_assets.py keeps one already display size
+                mat_img = mat_img.resize(self.display_size, resample=Image.BICUBIC)
             mat_img = ImageOps.colorize(mat_img, black="black", white=color)
         else:
             mat_img = Image.new('RGB', self.display_size, color)
@@ -0,0 +1,118 @@
+""" Keeps the loaders under a resident memory ceiling and keeps count of what
+each stage of rendering a photo allocates.
+
+Before a load starts its peak is estimated from the header dimensions and it
+is only let in while current RSS plus what is already in flight stays under
+RSS_CEILING. One job is always let in when nothing else is running so a single
+huge photo can't stop the wall altogether.
+
+The per stage numbers are the size of the image each stage leaves behind plus
+the change in RSS, which are cheap enough to always collect. With --mem_debug
+tracemalloc is switched on as well and its peak for the stage is added - NB
+that only sees Python and numpy allocations, Pillow's pixel buffers come from
+its own allocator which is why the image sizes are kept too. tracemalloc's
+peak is for the whole process, so with --mem_debug only one stage runs at a
+time (the loaders take turns) or each would count the others' allocations.
+"""
+import os
+import threading
+import tracemalloc
+
+import Config as config
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+BYTES_PER_PIXEL = 4 # worst case RGBA
+
+stage_stats = {} # name -> [count, total image bytes, total rss change, max tracemalloc peak]
+stats_lock = threading.Lock()
+debug_lock = threading.Lock() # held through a stage under MEM_DEBUG
+
+def rss_bytes():
+  try:
+    with open('/proc/self/statm') as f:
+      return int(f.read().split()[1]) * PAGE_SIZE
+  except (OSError, IndexError, ValueError): # not linux, can't tell so don't hold anything up
+    return 0
+
+def estimate_peak(src_size, display_size, draft=True):
+  """ rough peak bytes for rendering one photo of src_size. The source is
+  decoded at no less than display size when draft can be used, then the scaled
+  copy, the mat and the bevelled copy of it are all about display size and can
+  be alive together while the texture array is made.
+  """
+  (w, h) = src_size
+  (dw, dh) = display_size
+  if draft: # jpeg draft decodes at 1/2, 1/4 or 1/8 as long as it's still big enough
+    scale = 1.0
+    while scale > 0.125 and w * scale / 2 >= dw and h * scale / 2 >= dh:
+      scale /= 2
+    (w, h) = (w * scale, h * scale)
+  return int((w * h + 4 * dw * dh) * BYTES_PER_PIXEL)
+
+class MemoryBudget:
+  def __init__(self, ceiling_mb=None):
+    self.ceiling = int((config.RSS_CEILING if ceiling_mb is None else ceiling_mb) * 1024 * 1024)
+    self.in_flight = 0
+    self.jobs = 0
+    self.cond = threading.Condition()
+
+  def admit(self, estimate):
+    with self.cond:
+      while self.jobs > 0 and rss_bytes() + self.in_flight + estimate > self.ceiling:
+        self.cond.wait(0.5) # RSS can drop without a release i.e. textures freed by the render loop
+      self.in_flight += estimate
+      self.jobs += 1
+
+  def release(self, estimate):
+    with self.cond:
+      self.in_flight -= estimate
+      self.jobs -= 1
+      self.cond.notify_all()
+
+class Stage:
+  """ with Stage('mat') as st: ... st.result(im) """
+  def __init__(self, name):
+    self.name = name
+    self.image_bytes = 0
+
+  def __enter__(self):
+    self.debug = config.MEM_DEBUG
+    if self.debug:
+      debug_lock.acquire()
+    self.rss = rss_bytes()
+    if self.debug:
+      if not tracemalloc.is_tracing():
+        tracemalloc.start()
+      tracemalloc.reset_peak()
+      self.traced = tracemalloc.get_traced_memory()[0]
+    return self
+
+  def result(self, im):
+    if im is not None:
+      self.image_bytes = im.width * im.height * len(im.getbands())
+    return im
+
+  def __exit__(self, *exc):
+    peak = 0
+    if self.debug and tracemalloc.is_tracing():
+      peak = tracemalloc.get_traced_memory()[1] - self.traced
+    rss = rss_bytes() - self.rss
+    if self.debug:
+      debug_lock.release()
+    with stats_lock:
+      st = stage_stats.setdefault(self.name, [0, 0, 0, 0])
+      st[0] += 1
+      st[1] += self.image_bytes
+      st[2] += rss
+      st[3] = max(st[3], peak)
+    return False
+
+def report():
+  lines = ['{:<10} {:>6} {:>12} {:>12} {:>12}'.format('stage', 'count', 'avg image MB',
+                                                       'avg rss MB', 'max traced MB')]
+  with stats_lock:
+    for (name, (count, image_bytes, rss, peak)) in stage_stats.items():
+      lines.append('{:<10} {:>6} {:>12.2f} {:>12.2f} {:>12.2f}'.format(name, count,
+                   image_bytes / count / 1048576, rss / count / 1048576, peak / 1048576))
+  lines.append('rss now {:.1f} MB'.format(rss_bytes() / 1048576))
+  return '\n'.join(lines)
@@ -0,0 +1,351 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+""" Local copies of the photos about to be shown for a PIC_DIR on a network
+share or USB disk (--mirror). The loader asks for the next READ_AHEAD files in
+play order to be copied and a background thread fetches each one whole in
+CHUNK_MB reads, so by the time the photo is decoded it comes off the SD card
+rather than as lots of small reads over Wi-Fi. The mirror lives in
+CACHE_DIR/mirror and is kept under --mirror_mb, least recently used first.
+
+If the share stops answering the wall carries on with what's mirrored (and
+whatever is in the render cache) - layouts skip photos that aren't available()
+and rescans list the mirror instead of walking the share. The share is tried
+again every RETRY_AFTER seconds.
+
+A copy is checked against the share's size and mtime when it's read ahead, so
+reads on the load path never touch the share for a mirrored photo. The index of
+copies is only saved every SAVE_EVERY, so on start any file in the mirror it
+doesn't know about (copied after the last save) is removed rather than left
+taking up space that evict() can't see.
+
+  python3 mirror.py report [Config options]   what's mirrored
+  python3 mirror.py clear [Config options]    empty the mirror
+"""
+import os
+import sys
+import json
+import time
+import queue
+import hashlib
+import threading
+
+import Config as config
+
+READ_AHEAD = 20 # files ahead of the one loading, more than index.PLAN_AHEAD so headers are read locally too
+CHUNK_MB = 4
+RETRY_AFTER = 30.0 # seconds before trying a share that stopped answering
+SAVE_EVERY = 20 # copies between writes of the index
+
+class Unavailable(OSError):
+  """ the share can't be reached and there's no copy in the mirror """
+
+class LocalMirror:
+  def __init__(self, pic_dir, mirror_dir, limit_mb, throttle_mbps=None):
+    self.pic_dir = pic_dir
+    self.mirror_dir = mirror_dir
+    self.limit = limit_mb * 1048576
+    self.throttle = throttle_mbps # only for the tests, a slow share on a fast disk
+    self.lock = threading.Lock()
+    self.entries = self.load_index() # source path -> {local, size, mtime, used}
+    self.total = sum(e['size'] for e in self.entries.values())
+    self.jobs = queue.Queue()
+    self.queued = set()
+    self.wanted = {} # lane -> its read ahead window, not evicted
+    self.up = True
+    self.down_since = 0.0
+    self.copies = 0
+    self.copied_bytes = 0
+    self.copy_secs = 0.0
+    self.hits = 0
+    self.misses = 0
+    threading.Thread(target=self.copier, name='mirror', daemon=True).start()
+
+  def index_path(self):
+    return os.path.join(self.mirror_dir, 'index.json')
+
+  def load_index(self):
+    try:
+      with open(self.index_path()) as f:
+        entries = json.load(f)
+    except (OSError, ValueError):
+      entries = {}
+    entries = {fname: e for (fname, e) in entries.items() if os.path.exists(e['local'])}
+    self.remove_unknown(set(e['local'] for e in entries.values()))
+    return entries
+
+  def remove_unknown(self, known):
+    # copies made since the index was last saved, and half made ones, can't be
+    # told apart from the hashed names so they go
+    removed = 0
+    for (dirpath, _dirnames, filenames) in os.walk(self.mirror_dir):
+      for filename in filenames:
+        local = os.path.join(dirpath, filename)
+        if local in known or (dirpath == self.mirror_dir and filename.startswith('index.json')):
+          continue
+        try:
+          os.remove(local)
+          removed += 1
+        except OSError:
+          pass
+    if removed and config.VERBOSE:
+      print('mirror: removed {} files missing from its index'.format(removed))
+
+  def save_index(self):
+    with self.lock:
+      entries = dict(self.entries)
+    tmp_path = self.index_path() + '.tmp'
+    try:
+      os.makedirs(self.mirror_dir, exist_ok=True)
+      with open(tmp_path, 'w') as f:
+        json.dump(entries, f)
+      os.replace(tmp_path, self.index_path())
+    except OSError as e:
+      print('''Couldn't save mirror index giving error: {}'''.format(e))
+
+  def local_name(self, fname):
+    key = hashlib.sha1(fname.encode('utf-8')).hexdigest()
+    return os.path.join(self.mirror_dir, key[:2], key + os.path.splitext(fname)[1].lower())
+
+  def share_up(self):
+    if not self.up and time.time() - self.down_since > RETRY_AFTER:
+      self.up = os.path.isdir(self.pic_dir) # the copier tries it properly next time it has work
+    return self.up
+
+  def gone_down(self, e):
+    if self.up:
+      print('''Can't read from {} giving error: {} - showing mirrored photos'''.format(self.pic_dir, e))
+    self.up = False
+    self.down_since = time.time()
+
+  def available(self, fname):
+    """ True if fname can be shown now without the share or the share is up """
+    return fname in self.entries or self.share_up()
+
+  def local(self, fname):
+    """ the mirror's copy of fname if there is one, otherwise fname - for header reads """
+    with self.lock:
+      entry = self.entries.get(fname)
+      if entry is not None:
+        entry['used'] = time.time()
+        return entry['local']
+    return fname
+
+  def path(self, fname):
+    """ where to read all of fname from, copying it now if it wasn't read ahead """
+    with self.lock:
+      entry = self.entries.get(fname)
+      if entry is not None:
+        entry['used'] = time.time()
+        self.hits += 1
+        return entry['local']
+      self.misses += 1
+    if not self.share_up():
+      raise Unavailable('{} is not mirrored and the share is down'.format(fname))
+    try:
+      return self.fetch(fname)
+    except OSError as e:
+      if os.path.isdir(self.pic_dir): # just this file
+        raise
+      self.gone_down(e)
+      raise Unavailable(str(e))
+
+  def stat(self, fname):
+    """ (size, mtime) of fname as it was on the share, without going to it if mirrored """
+    with self.lock:
+      entry = self.entries.get(fname)
+      if entry is not None:
+        return (entry['size'], entry['mtime'])
+    st = os.stat(fname)
+    return (st.st_size, st.st_mtime)
+
+  def walk(self, top):
+    """ like os.walk but over what's mirrored, for rescans while the share is down """
+    dirs = {}
+    with self.lock:
+      for fname in self.entries:
+        if fname.startswith(os.path.join(top, '')):
+          dirs.setdefault(os.path.dirname(fname), []).append(os.path.basename(fname))
+    for (root, filenames) in sorted(dirs.items()):
+      yield (root, [], filenames)
+
+  def read_ahead(self, fnames, lane=0):
+    """ copy fnames in the background, in the order given. They're kept until
+    that lane's next read_ahead, each lane having its own window """
+    with self.lock:
+      self.wanted[lane] = set(fnames)
+    if not self.share_up():
+      return
+    for fname in fnames:
+      with self.lock:
+        if fname in self.queued:
+          continue
+        self.queued.add(fname)
+      self.jobs.put(fname)
+
+  def copier(self):
+    while True:
+      fname = self.jobs.get()
+      try:
+        if self.share_up():
+          st = os.stat(fname)
+          with self.lock:
+            entry = self.entries.get(fname)
+          if entry is None or entry['size'] != st.st_size or entry['mtime'] != st.st_mtime:
+            self.fetch(fname, st)
+      except OSError as e:
+        if os.path.isdir(self.pic_dir): # just this file gone, not the share
+          if config.VERBOSE:
+            print('''Couldn't mirror {} giving error: {}'''.format(fname, e))
+        else:
+          self.gone_down(e)
+      finally:
+        with self.lock:
+          self.queued.discard(fname)
+
+  def fetch(self, fname, st=None):
+    """ copy fname whole into the mirror in big sequential reads, returns the copy's path """
+    st = os.stat(fname) if st is None else st
+    local = self.local_name(fname)
+    tmp_path = '{}.{}.{}.tmp'.format(local, os.getpid(), threading.get_ident())
+    os.makedirs(os.path.dirname(local), exist_ok=True)
+    tm = time.time()
+    try:
+      with open(fname, 'rb', buffering=0) as src, open(tmp_path, 'wb') as dst:
+        while True:
+          chunk = src.read(CHUNK_MB * 1048576)
+          if not chunk:
+            break
+          dst.write(chunk)
+          if self.throttle:
+            time.sleep(len(chunk) / (self.throttle * 1048576))
+      os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+      os.replace(tmp_path, local)
+    except OSError:
+      try:
+        os.remove(tmp_path)
+      except OSError:
+        pass
+      raise
+    with self.lock:
+      old = self.entries.get(fname)
+      self.total += st.st_size - (old['size'] if old is not None else 0)
+      self.entries[fname] = {'local': local, 'size': st.st_size, 'mtime': st.st_mtime, 'used': time.time()}
+      self.copies += 1
+      self.copied_bytes += st.st_size
+      self.copy_secs += time.time() - tm
+    self.evict()
+    if self.copies % SAVE_EVERY == 0:
+      self.save_index()
+    return local
+
+  def evict(self):
+    """ remove the least recently used copies until under the limit """
+    removed = []
+    with self.lock:
+      if self.total <= self.limit:
+        return
+      for (fname, entry) in sorted(self.entries.items(), key=lambda kv: kv[1]['used']):
+        if self.total <= self.limit:
+          break
+        if any(fname in window for window in self.wanted.values()):
+          continue
+        del self.entries[fname]
+        self.total -= entry['size']
+        removed.append(entry['local'])
+    for local in removed:
+      try:
+        os.remove(local)
+      except OSError:
+        pass
+
+  def clear(self):
+    with self.lock:
+      removed = [e['local'] for e in self.entries.values()]
+      self.entries = {}
+      self.total = 0
+    for local in removed:
+      try:
+        os.remove(local)
+      except OSError:
+        pass
+    self.save_index()
+
+  def report(self):
+    with self.lock:
+      (count, total) = (len(self.entries), self.total)
+    rate = self.copied_bytes / 1048576 / self.copy_secs if self.copy_secs > 0 else 0.0
+    return 'mirror: {} files {:.0f}/{:.0f}MB, share {}, {} copied at {:.1f}MB/s, {} hits {} misses, {} queued'.format(
+           count, total / 1048576, self.limit / 1048576, 'up' if self.up else 'down', self.copies, rate,
+           self.hits, self.misses, self.jobs.qsize())
+
+class HandedOver:
+  """ stands in for the LocalMirror in a worker process, see hand_over() """
+  def __init__(self, files):
+    self.files = files # fname -> (local, (size, mtime))
+
+  def available(self, fname):
+    return True
+
+  def local(self, fname):
+    return self.files[fname][0] if fname in self.files else fname
+
+  def path(self, fname):
+    return self.local(fname)
+
+  def stat(self, fname):
+    if fname in self.files:
+      return self.files[fname][1]
+    st = os.stat(fname)
+    return (st.st_size, st.st_mtime)
+
+mirror = None
+mirror_lock = threading.Lock()
+
+def get():
+  """ the LocalMirror for PIC_DIR if --mirror is set, otherwise None """
+  global mirror
+  if not config.MIRROR:
+    return None
+  with mirror_lock:
+    if mirror is None:
+      mirror = LocalMirror(config.PIC_DIR, os.path.join(config.CACHE_DIR, 'mirror'), config.MIRROR_MB)
+    return mirror
+
+def hand_over(files=None):
+  """ in a worker process, files is {fname: (local, (size, mtime))} that the
+  parent has already found with its mirror. The worker reads those and never
+  makes a LocalMirror of its own, which would copy over the share again and
+  write the same index as the parent's """
+  global mirror
+  with mirror_lock:
+    mirror = HandedOver(files or {})
+
+def available(fname):
+  m = get()
+  return m is None or m.available(fname)
+
+def local(fname):
+  m = get()
+  return fname if m is None else m.local(fname)
+
+def path(fname):
+  m = get()
+  return fname if m is None else m.path(fname)
+
+def stat(fname):
+  m = get()
+  if m is None:
+    st = os.stat(fname)
+    return (st.st_size, st.st_mtime)
+  return m.stat(fname)
+
+if __name__ == '__main__':
+  COMMAND = config.command('report')
+  config.MIRROR = True
+  if COMMAND == 'report':
+    print(get().report())
+  elif COMMAND == 'clear':
+    get().clear()
+  else:
+    print('usage: mirror.py report|clear [Config options]')
+    sys.exit(1)
@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+""" Place names for photos' GPS positions without going on line. The places
+come from --geo_places, either a GeoNames dump (i.e. cities1000.txt from
+download.geonames.org, tab separated) or a csv with name,lat,lon,country
+columns like geo_places_sample.csv.
+
+The first start after the places file changes sorts them into a grid of
+1 degree cells and saves that as .npy files under CACHE_DIR/geo, which later
+starts map rather than read. A lookup checks the photo's cell then rings of
+cells further out until nothing nearer than the best so far can be left, so
+it only ever measures the distance to a handful of places.
+
+  python3 offline_geo.py build [Config options]        make the grid now
+  python3 offline_geo.py lookup lat lon [Config options]
+  python3 offline_geo.py bench [Config options]        lookups a second
+"""
+import os
+import sys
+import csv
+import math
+import time
+import json
+import shutil
+import hashlib
+import threading
+
+import numpy as np
+
+import Config as config
+
+EXIF_GPSINFO = 34853
+EARTH_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_KM / 180
+MAX_KM = 100.0 # no name if the nearest place is further than this
+MAX_RING = 60 # cells out from the photo's before giving up, only reached near the poles
+ROWS = 180
+COLS = 360
+SAMPLE_PLACES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'geo_places_sample.csv')
+
+index_lock = threading.Lock()
+geo_index = None # GeoIndex, loaded on first use
+geo_failed = False # so a missing places file is only reported once
+
+def cell_of(lat, lon):
+  row = min(max(int(math.floor(lat + 90)), 0), ROWS - 1)
+  col = int(math.floor(lon + 180)) % COLS
+  return (row, col)
+
+def distance_km(lat, lon, lats, lons):
+  # haversine from one point to arrays of them
+  (lat, lon) = (math.radians(lat), math.radians(lon))
+  (lats, lons) = (np.radians(lats), np.radians(lons))
+  a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+  return 2 * EARTH_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def read_places(path):
+  """ yields (name, lat, lon, country) """
+  with open(path, encoding='utf-8', newline='') as f:
+    if path.endswith('.csv'):
+      for row in csv.DictReader(f):
+        yield (row['name'], float(row['lat']), float(row['lon']), row.get('country', ''))
+    else: # GeoNames: id, name, asciiname, alternatenames, lat, lon, class, code, country ...
+      for line in f:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) > 8:
+          yield (fields[1], float(fields[4]), float(fields[5]), fields[8])
+
+def label(name, country):
+  return ', '.join(txt for txt in (name, country) if txt)
+
+def index_dir(places_path):
+  # keyed on the places file so a new download just makes a new grid
+  st = os.stat(places_path)
+  txt = '|'.join(str(v) for v in (os.path.abspath(places_path), st.st_size, st.st_mtime))
+  return os.path.join(config.CACHE_DIR, 'geo', hashlib.sha1(txt.encode('utf-8')).hexdigest())
+
+def build(places_path, out_dir):
+  """ sort the places into cells and save the grid in out_dir """
+  (lats, lons, cells, labels) = ([], [], [], [])
+  for (name, lat, lon, country) in read_places(places_path):
+    (row, col) = cell_of(lat, lon)
+    lats.append(lat)
+    lons.append(lon)
+    cells.append(row * COLS + col)
+    labels.append(label(name, country).encode('utf-8'))
+  order = np.argsort(np.array(cells, dtype=np.int32), kind='stable')
+  sorted_cells = np.array(cells, dtype=np.int32)[order]
+  blob = b''.join(labels[i] for i in order)
+  label_ends = np.cumsum([len(labels[i]) for i in order], dtype=np.int64)
+  tmp_dir = '{}.{}.tmp'.format(out_dir, os.getpid())
+  os.makedirs(tmp_dir, exist_ok=True)
+  np.save(os.path.join(tmp_dir, 'lat.npy'), np.array(lats, dtype=np.float32)[order])
+  np.save(os.path.join(tmp_dir, 'lon.npy'), np.array(lons, dtype=np.float32)[order])
+  # places in cell c are starts[c] up to starts[c + 1]
+  np.save(os.path.join(tmp_dir, 'starts.npy'), np.searchsorted(sorted_cells, np.arange(ROWS * COLS + 1)).astype(np.int32))
+  np.save(os.path.join(tmp_dir, 'labels.npy'), np.frombuffer(blob, dtype=np.uint8))
+  np.save(os.path.join(tmp_dir, 'label_ends.npy'), label_ends)
+  with open(os.path.join(tmp_dir, 'source.json'), 'w') as f:
+    json.dump({'places': os.path.abspath(places_path), 'count': len(lats)}, f)
+  try:
+    os.rename(tmp_dir, out_dir) # another process may have got there first, theirs is as good
+  except OSError:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+  return len(lats)
+
+class GeoIndex:
+  def __init__(self, grid_dir):
+    def part(name):
+      return np.load(os.path.join(grid_dir, name), mmap_mode='r')
+    self.lats = part('lat.npy')
+    self.lons = part('lon.npy')
+    self.starts = part('starts.npy')
+    self.labels = part('labels.npy')
+    self.label_ends = part('label_ends.npy')
+    self.cache = {} # rounded to about 100m, photos come in bunches from the same spot
+
+  def __len__(self):
+    return len(self.lats)
+
+  def label(self, i):
+    start = self.label_ends[i - 1] if i > 0 else 0
+    return self.labels[start:self.label_ends[i]].tobytes().decode('utf-8')
+
+  def ring(self, row, col, r):
+    # cells r out from (row, col) as indexes into starts, wrapping round in longitude
+    cells = set()
+    for dr in range(-r, r + 1):
+      cr = row + dr
+      if cr < 0 or cr >= ROWS:
+        continue
+      for dc in (range(-r, r + 1) if abs(dr) == r else (-r, r)):
+        cells.add(cr * COLS + (col + dc) % COLS)
+    return cells
+
+  def nearest(self, lat, lon, max_km=MAX_KM):
+    """ (index, km) of the nearest place or None if there isn't one within max_km """
+    (row, col) = cell_of(lat, lon)
+    (best, best_km) = (None, float('inf'))
+    for r in range(MAX_RING + 1):
+      spans = [(self.starts[c], self.starts[c + 1]) for c in self.ring(row, col, r)]
+      ixs = [np.arange(start, end) for (start, end) in spans if end > start]
+      if len(ixs) > 0:
+        ix = np.concatenate(ixs)
+        km = distance_km(lat, lon, self.lats[ix], self.lons[ix])
+        i = int(np.argmin(km))
+        if km[i] < best_km:
+          (best, best_km) = (int(ix[i]), float(km[i]))
+      # anything further out is at least r whole cells away, narrowest at the end nearer the pole
+      beyond = r * KM_PER_DEGREE * math.cos(math.radians(min(abs(lat) + r + 1, 90)))
+      if best_km <= beyond or beyond > max_km:
+        break
+    if best is None or best_km > max_km:
+      return None
+    return (best, best_km)
+
+  def lookup(self, lat, lon, max_km=MAX_KM):
+    key = (round(lat, 3), round(lon, 3), max_km)
+    if key not in self.cache:
+      found = self.nearest(lat, lon, max_km)
+      self.cache[key] = self.label(found[0]) if found is not None else ''
+    return self.cache[key]
+
+  def lookup_many(self, coords, max_km=MAX_KM):
+    return [self.lookup(lat, lon, max_km) for (lat, lon) in coords]
+
+def load_index(places_path=None):
+  """ map the grid for places_path, building it first if need be """
+  places_path = config.GEO_PLACES if places_path is None else places_path
+  grid_dir = index_dir(places_path)
+  if not os.path.exists(os.path.join(grid_dir, 'starts.npy')):
+    tm = time.time()
+    count = build(places_path, grid_dir)
+    print('offline geocoder: {} places indexed in {:.1f}s'.format(count, time.time() - tm))
+  return GeoIndex(grid_dir)
+
+def index():
+  global geo_index, geo_failed
+  with index_lock:
+    if geo_index is None and not geo_failed:
+      try:
+        geo_index = load_index()
+      except (OSError, ValueError, KeyError) as e:
+        geo_failed = True
+        print('''Couldn't load places from {} giving error: {} - no locations shown'''.format(config.GEO_PLACES, e))
+    return geo_index
+
+def to_float(value):
+  # PIL gives IFDRational, older versions (numerator, denominator)
+  if isinstance(value, tuple):
+    return float(value[0]) / float(value[1]) if value[1] else 0.0
+  return float(value)
+
+def gps_coords(gps_info):
+  """ (lat, lon) in degrees from the exif GPSInfo dict or None """
+  try:
+    (d, m, s) = (to_float(v) for v in gps_info[2])
+    lat = d + m / 60 + s / 3600
+    (d, m, s) = (to_float(v) for v in gps_info[4])
+    lon = d + m / 60 + s / 3600
+  except (KeyError, TypeError, ValueError, ZeroDivisionError):
+    return None
+  if str(gps_info.get(1, 'N')).strip("b' ").upper() == 'S':
+    lat = -lat
+  if str(gps_info.get(3, 'E')).strip("b' ").upper() == 'W':
+    lon = -lon
+  if (lat == 0 and lon == 0) or abs(lat) > 90 or abs(lon) > 180: # not set, or nonsense
+    return None
+  return (lat, lon)
+
+def get_location(gps_info):
+  """ place name for the exif GPSInfo dict, empty if there isn't one """
+  coords = gps_coords(gps_info)
+  geo = index()
+  if coords is None or geo is None:
+    return ''
+  return geo.lookup(*coords)
+
+def bench(count=20000):
+  geo = load_index()
+  rng = np.random.default_rng(1)
+  coords = list(zip(rng.uniform(-60, 70, count), rng.uniform(-180, 180, count)))
+  tm = time.time()
+  found = sum(1 for txt in geo.lookup_many(coords) if txt)
+  secs = time.time() - tm
+  print('{} places, {} lookups in {:.2f}s ({:.0f}/s), {} within {:.0f}km'.format(
+        len(geo), count, secs, count / secs, found, MAX_KM))
+
+if __name__ == '__main__':
+  COMMAND = config.command('')
+  ARGS = config.command_args() # lat lon, either can be -ve
+  if COMMAND == 'build':
+    load_index()
+  elif COMMAND == 'lookup' and len(ARGS) == 2:
+    print(load_index().lookup(float(ARGS[0]), float(ARGS[1])) or 'nothing within {:.0f}km'.format(MAX_KM))
+  elif COMMAND == 'bench':
+    bench()
+  else:
+    print('usage: offline_geo.py build|lookup lat lon|bench [Config options]')
+    sys.exit(1)
@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+""" Picks what to play next by weighted draws instead of shuffling the library.
+
+get_files() used to shuffle the whole list each scan and the wall then went
+through it in order, so every rescan (a new subdirectory or date range, new
+photos) re-permuted every entry and what had just been on could come straight
+back. Now the catalog stays in the order it was scanned and each lane's
+strip_layout asks the PlaySampler for its next photo.
+
+Every photo has a weight: 1, plus up to NEW_BOOST more the more recently the
+file was changed (halving every NEW_HALF_LIFE days), and 0 outside date_from
+to date_to. The --recent_n newest share RECENT_SHARE of the total between
+them so they mostly come first, as they came before the rest when shuffled,
+and each drops back to its normal weight once it's drawn so that's only the
+once.
+The weights sit in a Fenwick tree - an array where entry k holds the sum of
+the run of weights ending at k as long as k's lowest set bit - so a draw and a
+change to one weight are both O(log n), and it's a few numpy arrays however
+big the library gets.
+
+Whatever is drawn has its weight set to 0 for COOLDOWN seconds, or until more
+than COOLING_FRACTION of the photos that can be shown are cooling when the
+one drawn longest ago comes back first, so a small library just goes round.
+A photo whose date is only read when it loads and turns out to be outside the
+range is excluded then. A rescan makes a new sampler and carries the cooling
+photos across by name so they don't come back early either, and the startup
+set saves them by name so a restart doesn't bring them back. Draws a layout
+planned but threw away on a seek are given back so they aren't skipped.
+
+A rescan builds the catalog afresh from a walk of the whole library, so the
+new sampler is built from it in one go too (a cumsum, O(n) the same as the
+walk) rather than added to and taken from. Only the names of what's cooling
+are looked up in the new catalog, not a dict of the whole library.
+"""
+import time
+import threading
+
+import numpy as np
+
+NEW_BOOST = 1.0 # a photo changed today is this much more likely, on top of 1
+NEW_HALF_LIFE = 30.0 # days
+RECENT_SHARE = 0.8 # of the draws go to the --recent_n newest till they've been shown
+COOLDOWN = 6 * 3600.0 # seconds before something drawn can be drawn again
+COOLING_FRACTION = 0.5 # at most this much of the library cooling at once
+REBUILD_EVERY = 1.0 # times n updates before the tree is summed again, so rounding can't build up
+
+class FenwickTree:
+  """ running sums of weights with add() and find() in O(log n) """
+  def __init__(self, weights):
+    self.rebuild(weights)
+
+  def rebuild(self, weights):
+    self.n = len(weights)
+    # entry k (from 1) covers the lowbit(k) weights ending at k, straight from the prefix sums
+    sums = np.concatenate(([0.0], np.cumsum(weights, dtype='f8')))
+    k = np.arange(1, self.n + 1)
+    self.tree = sums[k] - sums[k - (k & -k)]
+    self.total = float(sums[-1])
+    self.top = 1 << (self.n.bit_length() - 1) if self.n > 0 else 0 # highest power of 2 <= n
+
+  def add(self, i, delta):
+    self.total += delta
+    k = i + 1
+    while k <= self.n:
+      self.tree[k - 1] += delta
+      k += k & -k
+
+  def prefix(self, i):
+    """ sum of the weights before i """
+    total = 0.0
+    while i > 0:
+      total += self.tree[i - 1]
+      i -= i & -i
+    return total
+
+  def find(self, u):
+    """ the i with prefix(i) <= u < prefix(i + 1), for 0 <= u < total """
+    pos = 0
+    step = self.top
+    while step > 0:
+      nxt = pos + step
+      if nxt <= self.n and self.tree[nxt - 1] <= u:
+        u -= self.tree[nxt - 1]
+        pos = nxt
+      step >>= 1
+    return min(pos, self.n - 1)
+
+def base_weights(cat, now, dt_from=None, dt_to=None):
+  """ the weight of each position of cat's order, dt_from and dt_to are
+  seconds since the epoch or None """
+  rows = cat.rows[cat.order]
+  age_days = np.maximum(now - rows['mtime'], 0.0) / 86400.0
+  weights = 1.0 + NEW_BOOST * 0.5 ** (age_days / NEW_HALF_LIFE)
+  with np.errstate(invalid='ignore'): # dt is nan till it's read, those are checked when they load
+    if dt_from is not None:
+      weights[rows['dt'] < dt_from] = 0.0
+    if dt_to is not None:
+      weights[rows['dt'] > dt_to] = 0.0
+  return weights
+
+def recent_weights(cat, weights, recent_n):
+  """ weights with the recent_n newest given RECENT_SHARE of the total """
+  weights = weights.copy()
+  if 0 < recent_n < len(weights):
+    rows = cat.rows[cat.order]
+    newest = np.argpartition(rows['mtime'], -recent_n)[-recent_n:]
+    newest = newest[weights[newest] > 0.0]
+    if len(newest) > 0:
+      rest = weights.sum() - weights[newest].sum()
+      weights[newest] = max(rest, 1.0) * RECENT_SHARE / (1.0 - RECENT_SHARE) / len(newest)
+  return weights
+
+class PlaySampler:
+  """ draws positions of cat's order, what a strip_layout calls pic_num """
+  def __init__(self, cat, recent_n=0, dt_from=None, dt_to=None, now=None, seed=None):
+    self.cat = cat
+    self.normal = base_weights(cat, time.time() if now is None else now, dt_from, dt_to)
+    self.boosted = recent_weights(cat, self.normal, recent_n)
+    self.base = self.boosted.copy() # the boost goes once drawn, 0 once excluded
+    self.weights = self.base.copy() # as in the tree, 0 while cooling
+    self.tree = FenwickTree(self.weights)
+    self.rng = np.random.default_rng(seed)
+    self.eligible = int(np.count_nonzero(self.base))
+    n = len(self.base)
+    self.cool_pos = np.zeros(n, dtype='i4') # ring of what's cooling, oldest at cool_head
+    self.cool_until = np.zeros(n, dtype='f8')
+    self.cool_head = 0
+    self.cool_count = 0
+    self.updates = 0
+    self.draws = 0
+    self.carried = {} # name -> position for what carry_over() or restore() found, for give_back()
+    self.lock = threading.Lock()
+
+  def __len__(self):
+    return len(self.base)
+
+  def set_weight(self, pos, weight):
+    self.tree.add(pos, weight - self.weights[pos])
+    self.weights[pos] = weight
+    self.updates += 1
+    if self.updates > REBUILD_EVERY * len(self.base):
+      self.tree.rebuild(self.weights)
+      self.updates = 0
+
+  def cool(self, pos, until):
+    self.set_weight(pos, 0.0)
+    if self.base[pos] > 0.0: # it's been shown, so back to the weight it'd have if it weren't recent
+      self.base[pos] = self.normal[pos]
+    tail = (self.cool_head + self.cool_count) % len(self.base)
+    self.cool_pos[tail] = pos
+    self.cool_until[tail] = until
+    self.cool_count += 1
+
+  def release(self):
+    # the one drawn longest ago can be drawn again
+    pos = int(self.cool_pos[self.cool_head])
+    self.cool_head = (self.cool_head + 1) % len(self.base)
+    self.cool_count -= 1
+    self.set_weight(pos, self.base[pos])
+    return pos
+
+  def uncool(self, pos):
+    # take pos out of the ring wherever it is, the ones after it move up
+    ix = (self.cool_head + np.arange(self.cool_count)) % len(self.base)
+    found = np.nonzero(self.cool_pos[ix] == pos)[0]
+    if len(found) == 0:
+      return
+    k = int(found[0])
+    self.cool_pos[ix[k:-1]] = self.cool_pos[ix[k + 1:]]
+    self.cool_until[ix[k:-1]] = self.cool_until[ix[k + 1:]]
+    self.cool_count -= 1
+    if self.base[pos] > 0.0: # never shown after all so it keeps any boost
+      self.base[pos] = self.boosted[pos]
+    self.set_weight(pos, self.base[pos])
+
+  def cooling(self):
+    """ (pos, until) for everything cooling, oldest first """
+    ix = (self.cool_head + np.arange(self.cool_count)) % max(len(self.base), 1)
+    return zip(self.cool_pos[ix].tolist(), self.cool_until[ix].tolist())
+
+  def draw(self, now=None):
+    """ the next position to play, None if there's nothing that can be """
+    now = time.time() if now is None else now
+    with self.lock:
+      limit = max(1, int(self.eligible * COOLING_FRACTION))
+      while self.cool_count > 0 and (self.cool_until[self.cool_head] <= now or self.cool_count >= limit):
+        self.release()
+      if self.eligible == 0:
+        return None
+      if self.tree.total <= 0.0: # all cooling, so round in the order they were drawn
+        pos = self.release()
+        while self.base[pos] <= 0.0: # excluded while it was cooling
+          pos = self.release()
+      else:
+        pos = self.tree.find(self.rng.random() * self.tree.total)
+        if self.weights[pos] <= 0.0: # rounding has built up after all
+          self.tree.rebuild(self.weights)
+          pos = self.tree.find(self.rng.random() * self.tree.total)
+      self.draws += 1
+      self.cool(pos, now + COOLDOWN)
+      return pos
+
+  def exclude(self, pos):
+    """ never draw pos, i.e. its date turned out to be outside the range """
+    with self.lock:
+      if self.base[pos] > 0.0:
+        self.base[pos] = 0.0
+        self.eligible -= 1
+        if self.weights[pos] > 0.0:
+          self.set_weight(pos, 0.0)
+
+  def name(self, pos):
+    return self.cat.fname(int(self.cat.order[pos]))
+
+  def cooling_names(self):
+    """ [name, until] for everything cooling, oldest first, to restore() later """
+    with self.lock:
+      return [[self.name(pos), until] for (pos, until) in self.cooling()]
+
+  def positions(self, names):
+    """ {name: position} for those of names still in the catalog, in one pass over it """
+    wanted = set(names)
+    found = {}
+    if len(wanted) == 0:
+      return found
+    for (pos, row) in enumerate(self.cat.order.tolist()):
+      name = self.cat.fname(row)
+      if name in wanted:
+        found[name] = pos
+    return found
+
+  def restore(self, cooling, also=()):
+    """ cooling is from cooling_names(), i.e. of an earlier catalog or an
+    earlier run. Returns the positions of those and of the names in also """
+    position = self.positions([name for (name, _until) in cooling] + list(also))
+    with self.lock:
+      for (name, until) in cooling:
+        pos = position.get(name)
+        if pos is not None and self.weights[pos] > 0.0:
+          self.cool(pos, until)
+      self.carried = position
+    return position
+
+  def carry_over(self, old):
+    """ what's cooling in old, a sampler over an earlier catalog, is cooling here too """
+    self.restore(old.cooling_names())
+
+  def give_back(self, names):
+    """ names drawn from the sampler carried over or restored from that were
+    never shown, they can be drawn again straight away """
+    with self.lock:
+      for name in names:
+        pos = self.carried.get(name)
+        if pos is not None:
+          self.uncool(pos)
+      self.carried = {} # only wanted until the layouts have moved across
+
+  def report(self):
+    return 'play sampler: {} of {} photos can be drawn, {} cooling, {} drawn'.format(
+           self.eligible, len(self.base), self.cool_count, self.draws)
@@ -0,0 +1,83 @@
+""" Picks how much work to put into each photo from how long there is before
+its slot scrolls into view. Each tier is cheaper than the one before:
+
+  0 full      BICUBIC, blurred backdrop, the planned mat style
+  1 bilinear  BILINEAR resizes
+  2 reduced   reduce() by whole factors before a BILINEAR resize, no backdrop,
+              the plain single bevel mat
+  3 half      as reduced but matted at half display size, the GPU scales it up
+
+How long each tier takes is learned as it goes (seconds per megapixel of
+source, smoothed) and the best tier predicted to finish in time is used. It
+drops straight down when short of time but only comes back up one tier per
+photo so it doesn't flap. Anything already in the render cache is cheap
+whatever, so isn't timed. Degraded renders are not put in the cache.
+"""
+import threading
+
+from PIL import Image
+
+SAFETY = 0.7 # only count on this fraction of the time left
+SMOOTHING = 0.2 # weight of the latest timing in the running estimate
+
+class Quality:
+  def __init__(self, tier, name, resample, reducing_gap, blur, mat_type, scale):
+    self.tier = tier
+    self.name = name
+    self.resample = resample
+    self.reducing_gap = reducing_gap
+    self.blur = blur
+    self.mat_type = mat_type # None to keep the planned one
+    self.scale = scale
+
+TIERS = [Quality(0, 'full', Image.BICUBIC, None, True, None, 1.0),
+         Quality(1, 'bilinear', Image.BILINEAR, None, True, None, 1.0),
+         Quality(2, 'reduced', Image.BILINEAR, 2.0, False, 'single_bevel', 1.0),
+         Quality(3, 'half', Image.BILINEAR, 2.0, False, 'single_bevel', 0.5)]
+
+class QualityGovernor:
+  def __init__(self):
+    self.secs_per_mpix = [0.25, 0.2, 0.12, 0.05] # starting guesses for a Pi 3, soon replaced
+    self.overhead = 0.05 # seconds whatever the size i.e. texture creation
+    self.last_tier = 0
+    self.floor = 0 # lowest tier number allowed, raised by something else i.e. when hot
+    self.counts = [0] * len(TIERS)
+    self.late = 0 # finished after their deadline
+    self.lock = threading.Lock()
+
+  def predict(self, tier, mpix):
+    return self.overhead + self.secs_per_mpix[tier] * mpix
+
+  def choose(self, mpix, time_left):
+    """ Quality to use for a photo of mpix megapixels with time_left seconds to go """
+    with self.lock:
+      tier = len(TIERS) - 1
+      for t in range(self.floor, len(TIERS)):
+        if self.predict(t, mpix) < time_left * SAFETY:
+          tier = t
+          break
+      tier = max(tier, self.floor, self.last_tier - 1) # step back up gradually
+      self.last_tier = tier
+      self.counts[tier] += 1
+      return TIERS[tier]
+
+  def cached(self):
+    """ nothing to decide, but counted so the report adds up """
+    with self.lock:
+      self.counts[0] += 1
+    return TIERS[0]
+
+  def record(self, quality, mpix, secs, time_left):
+    with self.lock:
+      if mpix > 0:
+        rate = max(secs - self.overhead, 0.0) / mpix
+        old = self.secs_per_mpix[quality.tier]
+        self.secs_per_mpix[quality.tier] = old + SMOOTHING * (rate - old)
+      if secs > time_left:
+        self.late += 1
+
+  def report(self):
+    with self.lock:
+      total = max(sum(self.counts), 1)
+      return ', '.join('{} {} ({:.0%}, {:.2f}s/MP)'.format(q.name, n, n / total, r)
+                       for (q, n, r) in zip(TIERS, self.counts, self.secs_per_mpix)) + ', late {}'.format(self.late)
@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+""" Remembers photos that failed to load so they aren't opened again on every
+pass through the library. Kept in CACHE_DIR/quarantine.json, one entry per
+path with the file's size and mtime when it failed, how many times it has and
+when it's worth another go. Each failure waits RETRY_BASE * RETRY_FACTOR^n up
+to RETRY_MAX, and an entry is dropped as soon as the file is changed (its
+mtime in the library scan differs) or it loads.
+
+is_quarantined() is only a dict lookup so the layout can pass over a photo
+before touching the file at all. check() is a guard before decoding - a file
+bigger than MAX_FILE_MB or with more than MAX_MPIX in its header is refused
+rather than tying a loader up for seconds. A decode can't be stopped part way
+from python, so any that still take longer than SLOW_SECS are quarantined
+afterwards so the time is only lost once. That's the decode and matting on
+their own (PhotoUtils.timing), not copying from the share or waiting for a
+render worker, which aren't the photo's fault.
+
+  python3 quarantine.py [report] [Config options]   list what's quarantined
+  python3 quarantine.py clear [Config options]      forget the lot
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+import Config as config
+
+RETRY_BASE = 3600.0 # seconds before the first retry
+RETRY_FACTOR = 4.0
+RETRY_MAX = 30 * 24 * 3600.0
+MAX_FILE_MB = 80
+MAX_MPIX = 120
+SLOW_SECS = 20.0
+
+entries = None # path -> dict, read from disk on first use
+lock = threading.Lock()
+
+class Refused(Exception):
+  """ raised by check() for a file that isn't worth decoding """
+
+def quarantine_path():
+  return os.path.join(config.CACHE_DIR, 'quarantine.json')
+
+def load():
+  global entries
+  if entries is None:
+    try:
+      with open(quarantine_path()) as f:
+        entries = json.load(f)
+    except (OSError, ValueError):
+      entries = {}
+  return entries
+
+def save():
+  path = quarantine_path()
+  tmp_path = path + '.tmp'
+  try:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(tmp_path, 'w') as f:
+      json.dump(entries, f, indent=1)
+    os.replace(tmp_path, path)
+  except OSError as e:
+    print('''Couldn't save quarantine list giving error: {}'''.format(e))
+
+def is_quarantined(fname, mtime=None):
+  """ True to skip fname for now. No file access - mtime is what the library
+  scan found, and if it's moved on since the failure the file gets another go """
+  with lock:
+    entry = load().get(fname)
+    if entry is None:
+      return False
+    if mtime is not None and entry['mtime'] != mtime:
+      return False
+    return time.time() < entry['retry']
+
+def check(fname, size=None):
+  """ raise Refused if fname is too big to be worth decoding, size is the
+  (w, h) from the header if already known """
+  file_mb = os.path.getsize(fname) / 1048576
+  if file_mb > MAX_FILE_MB:
+    raise Refused('file is {:.0f}MB'.format(file_mb))
+  if size is not None and size[0] * size[1] > MAX_MPIX * 1000000:
+    raise Refused('{}x{} is over {} megapixels'.format(size[0], size[1], MAX_MPIX))
+
+def failed(fname, error):
+  try:
+    st = os.stat(fname)
+    (size, mtime) = (st.st_size, st.st_mtime)
+  except OSError: # gone altogether
+    (size, mtime) = (0, 0)
+  with lock:
+    entry = load().get(fname)
+    if entry is None or entry['size'] != size or entry['mtime'] != mtime:
+      entry = {'size': size, 'mtime': mtime, 'failures': 0}
+    entry['failures'] += 1
+    entry['error'] = str(error)[:200]
+    entry['last'] = time.time()
+    entry['retry'] = entry['last'] + min(RETRY_BASE * RETRY_FACTOR ** (entry['failures'] - 1), RETRY_MAX)
+    entries[fname] = entry
+    save()
+  if config.VERBOSE:
+    print('quarantined {} for {:.1f}h: {}'.format(fname, (entry['retry'] - entry['last']) / 3600, error))
+
+def loaded(fname):
+  """ it worked this time so forget any earlier failure """
+  with lock:
+    if fname in load(): # nearly always not, so nothing written
+      del entries[fname]
+      save()
+
+def report():
+  now = time.time()
+  with lock:
+    items = sorted(load().items(), key=lambda kv: -kv[1]['failures'])
+  lines = ['{} quarantined'.format(len(items))]
+  for (fname, entry) in items:
+    wait = entry['retry'] - now
+    lines.append('{:>3}x  {:<14}  {}\n        {}'.format(entry['failures'],
+                 'retry in {:.1f}h'.format(wait / 3600) if wait > 0 else 'retry next time', fname, entry['error']))
+  return '\n'.join(lines)
+
+def clear():
+  global entries
+  with lock:
+    entries = {}
+    save()
+
+if __name__ == '__main__':
+  COMMAND = config.command('report')
+  if COMMAND == 'report':
+    print(report())
+  elif COMMAND == 'clear':
+    clear()
+  else:
+    print('usage: quarantine.py report|clear [Config options]')
+    sys.exit(1)
@@ -0,0 +1,302 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+""" Finished pixels kept uncompressed so showing a photo again needs no JPEG
+decode and no copy through PIL. A file is a 16 byte header
+
+  'PWRT', version, channels (3 or 4), levels, pad, width, height (little endian)
+
+then the rows of each level one after another, level 0 full size and each
+further one half the size of the one before (for mipmaps). The loader maps the
+file and hands numpy views of it straight to the texture, so the only read of
+the pixels is the GL upload.
+
+Entries sit beside the render cache (same key) under CACHE_DIR/raw and are
+written by the loader the first time a render is shown. They are big - about
+6MB for a 1920x1080 RGB photo against 400kB as a JPEG - so the cache is kept
+under RAW_CACHE_MB by evict(), oldest use first.
+
+  python3 raw_cache.py check [Config options]    report bad or partial entries
+  python3 raw_cache.py compact [Config options]  remove them and leftover temp files
+  python3 raw_cache.py evict [Config options]    trim to --raw_cache_mb
+  python3 raw_cache.py bench [Config options]    time raw against the JPEG cache
+"""
+import os
+import sys
+import time
+import mmap
+import struct
+import threading
+
+import numpy as np
+from PIL import Image
+
+import Config as config
+import render_cache
+
+try:
+  import ctypes
+  import pi3d
+  from pi3d.constants import (opengles, GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_TEXTURE_MAG_FILTER,
+                              GL_TEXTURE_WRAP_S, GL_TEXTURE_WRAP_T, GL_UNSIGNED_BYTE, GL_TEXTURE0)
+  GL_UNPACK_ALIGNMENT = 0x0CF5
+except ImportError: # tools only
+  pi3d = None
+
+MAGIC = b'PWRT'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBxII')
+MIP_LEVELS = 1 # 1 leaves the GPU to make the mipmaps as it does for other textures
+EVICT_EVERY = 50 # saves between checks on the size of the cache
+
+saves = 0
+
+def raw_path(render_path):
+  """ the raw entry for a render cache file, same key """
+  key = os.path.splitext(os.path.basename(render_path))[0]
+  return render_cache.cache_path('raw', key, '.raw')
+
+def level_sizes(width, height, levels):
+  return [(max(width >> i, 1), max(height >> i, 1)) for i in range(levels)]
+
+def file_size(width, height, channels, levels):
+  return HEADER.size + sum(w * h * channels for (w, h) in level_sizes(width, height, levels))
+
+class RawImage:
+  """ the pixels of a raw cache file, mapped rather than read. levels[n] is an
+  (h, w, channels) uint8 view that keeps the map open for as long as it's used """
+  def __init__(self, path):
+    with open(path, 'rb') as f:
+      self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    (magic, version, channels, levels, width, height) = HEADER.unpack_from(self.map)
+    if magic != MAGIC or version != VERSION or channels not in (3, 4) or levels < 1:
+      raise ValueError('not a raw cache file')
+    if len(self.map) != file_size(width, height, channels, levels):
+      raise ValueError('truncated')
+    self.levels = []
+    offset = HEADER.size
+    for (w, h) in level_sizes(width, height, levels):
+      self.levels.append(np.frombuffer(self.map, np.uint8, w * h * channels, offset).reshape(h, w, channels))
+      offset += w * h * channels
+
+  @property
+  def width(self):
+    return self.levels[0].shape[1]
+
+  @property
+  def height(self):
+    return self.levels[0].shape[0]
+
+  @property
+  def mode(self):
+    return 'RGBA' if self.levels[0].shape[2] == 4 else 'RGB'
+
+  def prefetch(self):
+    # fault the pages in here rather than on the render thread during the upload
+    np.frombuffer(self.map, np.uint8)[::mmap.PAGESIZE].sum()
+
+  def texture(self):
+    if len(self.levels) > 1:
+      return RawTexture(self.levels, blend=True, m_repeat=True, free_after_load=True)
+    return pi3d.Texture(self.levels[0], blend=True, m_repeat=True, free_after_load=True)
+
+  def to_pil(self):
+    return Image.fromarray(self.levels[0], self.mode)
+
+if pi3d is not None:
+  class RawTexture(pi3d.Texture):
+    """ uploads the mip levels from the file rather than having the GPU make them """
+    def __init__(self, levels, **kwds):
+      pi3d.Texture.__init__(self, levels[0], mipmap=True, **kwds)
+      self.mip_levels = levels
+
+    def update_ndarray(self, new_array=None, texture_num=None):
+      if texture_num is not None:
+        opengles.glActiveTexture(GL_TEXTURE0 + texture_num)
+      opengles.glBindTexture(GL_TEXTURE_2D, self._tex)
+      for t in [GL_TEXTURE_MIN_FILTER, GL_TEXTURE_MAG_FILTER]:
+        opengles.glTexParameteri(GL_TEXTURE_2D, t, self._get_filter(t))
+      opengles.glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, self.m_repeat)
+      opengles.glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, self.m_repeat)
+      opengles.glPixelStorei(GL_UNPACK_ALIGNMENT, 1) # the smaller levels' rows aren't multiples of 4
+      for (i, level) in enumerate(self.mip_levels):
+        iformat = self._get_format_from_array(level, self.i_format)
+        opengles.glTexImage2D(GL_TEXTURE_2D, i, iformat, level.shape[1], level.shape[0], 0, iformat,
+                              GL_UNSIGNED_BYTE, level.ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)))
+      opengles.glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+      if self.free_after_load:
+        self.image = None
+        self.mip_levels = None
+        self.file_string = None
+        self._loaded = False
+
+def load(path):
+  """ RawImage or None if there isn't a good entry at path """
+  try:
+    raw = RawImage(path)
+  except (OSError, ValueError) as e:
+    if config.VERBOSE and os.path.exists(path):
+      print('bad raw cache entry {} giving error: {}'.format(path, e))
+    return None
+  raw.prefetch()
+  return raw
+
+def save(path, im, levels=MIP_LEVELS):
+  global saves
+  if im.mode not in ('RGB', 'RGBA'):
+    im = im.convert('RGB')
+  if im.width % 4 != 0: # same as pi3d does to an image so rows stay 4 byte aligned
+    new_w = im.width // 4 * 4
+    im = im.resize((new_w, int(im.height * new_w / im.width)), Image.BICUBIC)
+  tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+  try:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(tmp_path, 'wb') as f:
+      f.write(HEADER.pack(MAGIC, VERSION, len(im.mode), levels, 0, im.width, im.height))
+      level = im
+      for (w, h) in level_sizes(im.width, im.height, levels):
+        if level.size != (w, h):
+          level = level.reduce(2) if level.width >= 2 and level.height >= 2 else level.resize((w, h))
+        f.write(level.tobytes())
+    os.replace(tmp_path, path)
+  except OSError as e:
+    if config.VERBOSE:
+      print('''Couldn't write raw cache entry {} giving error: {}'''.format(path, e))
+    try:
+      os.remove(tmp_path)
+    except OSError:
+      pass
+  saves += 1
+  if saves % EVICT_EVERY == 0:
+    threading.Thread(target=evict, daemon=True).start()
+
+def entries():
+  root = os.path.join(config.CACHE_DIR, 'raw')
+  for (dirpath, _dirnames, filenames) in os.walk(root):
+    for filename in filenames:
+      yield os.path.join(dirpath, filename)
+
+def check_entry(path):
+  """ None if the entry is good, otherwise what's wrong with it """
+  if not path.endswith('.raw'):
+    return 'left over temp file'
+  try:
+    with open(path, 'rb') as f:
+      (magic, version, channels, levels, width, height) = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+      return 'bad header'
+    if os.path.getsize(path) != file_size(width, height, channels, levels):
+      return 'wrong size'
+  except (OSError, struct.error) as e:
+    return str(e)
+  return None
+
+def check(remove=False):
+  (good, bad) = (0, 0)
+  for path in entries():
+    problem = check_entry(path)
+    if problem is None:
+      good += 1
+      continue
+    bad += 1
+    print('{}: {}'.format(path, problem))
+    if remove:
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+  print('{} good, {} bad{}'.format(good, bad, ' (removed)' if remove and bad else ''))
+  return bad
+
+def compact():
+  check(remove=True)
+  root = os.path.join(config.CACHE_DIR, 'raw')
+  for (dirpath, dirnames, filenames) in os.walk(root, topdown=False):
+    if dirpath != root and len(dirnames) == 0 and len(filenames) == 0:
+      try:
+        os.rmdir(dirpath)
+      except OSError:
+        pass
+
+def evict(limit_mb=None):
+  """ remove the least recently used entries until the cache is under limit_mb """
+  limit = (config.RAW_CACHE_MB if limit_mb is None else limit_mb) * 1048576
+  files = []
+  for path in entries():
+    try:
+      st = os.stat(path)
+    except OSError:
+      continue
+    files.append((max(st.st_atime, st.st_mtime), st.st_size, path)) # atime is only as good as the mount allows
+  total = sum(f[1] for f in files)
+  removed = 0
+  for (_tm, size, path) in sorted(files):
+    if total <= limit:
+      break
+    try:
+      os.remove(path)
+      total -= size
+      removed += 1
+    except OSError:
+      pass
+  if config.VERBOSE or __name__ == '__main__':
+    print('raw cache {:.0f} MB after removing {}'.format(total / 1048576, removed))
+  return removed
+
+def drop_from_page_cache(path):
+  # so the timing includes reading the card, not just memory
+  try:
+    fd = os.open(path, os.O_RDONLY)
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    os.close(fd)
+  except (OSError, AttributeError):
+    pass
+
+def bench(count=20):
+  """ the time to get from a cache file to the array a texture is made from """
+  pairs = []
+  for path in entries():
+    if not path.endswith('.raw'):
+      continue
+    key = os.path.splitext(os.path.basename(path))[0]
+    for ext in ('.jpg', '.png'):
+      render_path = render_cache.cache_path('render', key, ext)
+      if os.path.exists(render_path):
+        pairs.append((render_path, path))
+    if len(pairs) >= count:
+      break
+  if len(pairs) == 0:
+    print('nothing in both the render and raw caches to compare, run the frame with --raw_cache first')
+    return
+  results = {'jpeg': [0.0, 0], 'raw': [0.0, 0]}
+  for (render_path, path) in pairs:
+    drop_from_page_cache(render_path)
+    tm = time.time()
+    im = Image.open(render_path)
+    arr = np.asarray(im.convert(im.mode)) # decode then copy, as pi3d.Texture does with a PIL image
+    results['jpeg'][0] += time.time() - tm
+    results['jpeg'][1] += os.path.getsize(render_path)
+    drop_from_page_cache(path)
+    tm = time.time()
+    raw = RawImage(path)
+    raw.prefetch()
+    arr = raw.levels[0]
+    results['raw'][0] += time.time() - tm
+    results['raw'][1] += os.path.getsize(path)
+    arr = raw = im = None
+  for (name, (secs, size)) in results.items():
+    print('{:<5} {:8.1f} ms/photo {:8.1f} MB/s read from the card'.format(
+          name, 1000 * secs / len(pairs), size / 1048576 / max(secs, 1e-6)))
+
+if __name__ == '__main__':
+  COMMAND = config.command('check')
+  if COMMAND == 'check':
+    sys.exit(1 if check() else 0)
+  elif COMMAND == 'compact':
+    compact()
+  elif COMMAND == 'evict':
+    evict()
+  elif COMMAND == 'bench':
+    bench()
+  else:
+    print('usage: raw_cache.py check|compact|evict|bench [Config options]')
+    sys.exit(1)
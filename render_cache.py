@@ -0,0 +1,127 @@
+""" Disk cache for things derived from photos, i.e. blurred backdrops. Entries
+are keyed on the source file's path, size and mtime plus whatever settings
+went into making them, so an edited photo or a changed setting just misses
+and gets rebuilt - nothing ever needs invalidating by hand. Photos are keyed
+on their path under PIC_DIR so a cache made by warm_cache.py on another
+machine, with the library mounted somewhere else, still hits.
+
+There is a render and a backdrop for every photo shown, so those two are kept
+under RENDER_CACHE_MB between them by evict(), oldest use first, the same as
+raw_cache.py does. The rest (mat backgrounds, glyphs) are a handful of files.
+"""
+import os
+import hashlib
+import threading
+
+from PIL import Image
+
+import Config as config
+import mirror
+
+PER_PHOTO = ('render', 'backdrop') # the kinds that grow with the library
+EVICT_EVERY = 50 # saves between checks on the size of the cache
+
+saves = 0
+evict_on_save = True # off in warm_cache.py's workers, which evict once at the end
+
+def key_name(fname):
+  # relative to PIC_DIR for photos, anything else i.e. the mat texture as it is
+  pic_dir = os.path.join(os.path.abspath(config.PIC_DIR), '')
+  full = os.path.abspath(fname)
+  return os.path.relpath(full, pic_dir) if full.startswith(pic_dir) else fname
+
+def cache_key(fname, *settings):
+  try:
+    stamp = mirror.stat(fname) # the share's size and mtime, without going to it if mirrored
+  except OSError: # file gone or share unreachable, key still usable
+    stamp = (0, 0)
+  txt = '|'.join(str(v) for v in (key_name(fname),) + stamp + settings)
+  return hashlib.sha1(txt.encode('utf-8')).hexdigest()
+
+def cache_path(kind, key, ext='.png'):
+  # fan out on first two hex chars so no single directory gets huge on the SD card
+  return os.path.join(config.CACHE_DIR, kind, key[:2], key + ext)
+
+def load(kind, key, ext='.png'):
+  path = cache_path(kind, key, ext)
+  try:
+    im = Image.open(path)
+    im.load() # read it now so the file handle is closed
+    return im
+  except Exception as e: # missing or half written - treat as a miss
+    if config.VERBOSE and os.path.exists(path):
+      print('bad cache entry {} giving error: {}'.format(path, e))
+    return None
+
+def save(kind, key, im, ext='.png', **kwds):
+  path = cache_path(kind, key, ext)
+  tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+  try:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    im.save(tmp_path, format=Image.registered_extensions()[ext], **kwds)
+    os.replace(tmp_path, path) # atomic so readers never see a partial file
+    if kind in PER_PHOTO:
+      saved()
+  except Exception as e:
+    if config.VERBOSE:
+      print('''Couldn't write cache entry {} giving error: {}'''.format(path, e))
+    try:
+      os.remove(tmp_path)
+    except OSError:
+      pass
+
+def save_file(path, data):
+  """ bytes already encoded elsewhere i.e. by a render server, to path from cache_path() """
+  tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+  try:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(tmp_path, 'wb') as f:
+      f.write(data)
+    os.replace(tmp_path, path)
+    saved()
+    return True
+  except OSError as e:
+    if config.VERBOSE:
+      print('''Couldn't write cache entry {} giving error: {}'''.format(path, e))
+    try:
+      os.remove(tmp_path)
+    except OSError:
+      pass
+    return False
+
+def saved():
+  global saves
+  saves += 1
+  if evict_on_save and saves % EVICT_EVERY == 0:
+    threading.Thread(target=evict, daemon=True).start()
+
+def entries():
+  for kind in PER_PHOTO:
+    for (dirpath, _dirnames, filenames) in os.walk(os.path.join(config.CACHE_DIR, kind)):
+      for filename in filenames:
+        yield os.path.join(dirpath, filename)
+
+def evict(limit_mb=None):
+  """ remove the least recently used renders and backdrops until they're under limit_mb """
+  limit = (config.RENDER_CACHE_MB if limit_mb is None else limit_mb) * 1048576
+  files = []
+  for path in entries():
+    try:
+      st = os.stat(path)
+    except OSError:
+      continue
+    files.append((max(st.st_atime, st.st_mtime), st.st_size, path)) # atime is only as good as the mount allows
+  total = sum(f[1] for f in files)
+  removed = 0
+  for (_tm, size, path) in sorted(files):
+    if total <= limit:
+      break
+    try:
+      os.remove(path)
+      total -= size
+      removed += 1
+    except OSError:
+      pass
+  if config.VERBOSE:
+    print('render cache {:.0f} MB after removing {}'.format(total / 1048576, removed))
+  return removed
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+""" Lets a faster machine do the decoding and matting for the frame. Run on
+the server with the same options as the frame (see Config.py) but its own
+pic_dir pointing at the same photos, e.g.
+
+  python3 render_server.py --pic_dir /srv/photos --cache_dir /srv/cache/photowall
+
+and start the frame with --render_server http://homeserver:5871
+
+The frame asks for photos a few slots ahead of the one it is loading, at most
+CONNECTIONS at a time, with GET /render?path=<path under pic_dir>&mat_type=..&w=..&h=..
+and puts what comes back straight in its own render cache, so the loader then
+finds it there like anything else. If the answer doesn't come in time for the
+slot, or the server can't be reached, the frame renders the photo itself and
+leaves the server alone for RETRY_AFTER seconds.
+
+The server's own render cache means each photo is only matted once there too.
+As a stand in for tests, run it on the same machine as the frame with
+--render_delay set to make it slow.
+"""
+import os
+import sys
+import time
+import queue
+import threading
+import urllib.parse
+import urllib.request
+import urllib.error
+import http.server
+
+import Config as config
+import PhotoUtils
+import render_cache
+
+CONNECTIONS = 2 # requests the frame has out at once
+AHEAD = 6 # planned slots the frame asks for ahead of the one being loaded
+RETRY_AFTER = 60.0 # seconds before trying a server that has failed
+SAFETY = 0.7 # only wait this fraction of the time left before the slot comes on
+
+###################################################################### server
+local = threading.local() # MatImage keeps per photo state so one per request thread
+
+def server_matter(display_size):
+  if not hasattr(local, 'matters'):
+    local.matters = {}
+  if display_size not in local.matters:
+    local.matters[display_size] = PhotoUtils.make_matter(display_size)
+  return local.matters[display_size]
+
+class RenderHandler(http.server.BaseHTTPRequestHandler):
+  def do_GET(self):
+    url = urllib.parse.urlsplit(self.path)
+    query = urllib.parse.parse_qs(url.query)
+    try:
+      if url.path != '/render':
+        raise ValueError('unknown path')
+      rel_path = query['path'][0]
+      mat_type = query['mat_type'][0]
+      display_size = (int(query['w'][0]), int(query['h'][0]))
+    except (KeyError, ValueError) as e:
+      return self.send_error(400, str(e))
+    pic_dir = os.path.normpath(config.PIC_DIR)
+    fname = os.path.normpath(os.path.join(pic_dir, rel_path))
+    if not fname.startswith(pic_dir + os.sep) or not os.path.isfile(fname): # nothing outside pic_dir
+      return self.send_error(404)
+    if config.RENDER_DELAY > 0:
+      time.sleep(config.RENDER_DELAY)
+    pic = PhotoUtils.Pic(fname)
+    try:
+      result = PhotoUtils.render_image(server_matter(display_size), 0, [pic], mat_type=mat_type)
+    except Exception as e:
+      return self.send_error(500, str(e))
+    if result is None: # i.e. outside the date range
+      return self.send_error(404)
+    data = PhotoUtils.image_bytes(result[0], PhotoUtils.rendered_path(server_matter(display_size), pic, mat_type))
+    self.send_response(200)
+    self.send_header('Content-Type', 'image/png' if PhotoUtils.render_ext(mat_type) == '.png' else 'image/jpeg')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def log_message(self, format, *args):
+    if config.VERBOSE:
+      http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+def serve(port):
+  server = http.server.ThreadingHTTPServer(('', port), RenderHandler)
+  print('render server on port {} for {}'.format(port, config.PIC_DIR))
+  server.serve_forever()
+
+###################################################################### client
+class RenderClient:
+  def __init__(self, url, timeout=None):
+    self.url = url.rstrip('/')
+    self.timeout = config.RENDER_TIMEOUT if timeout is None else timeout
+    self.jobs = queue.Queue()
+    self.pending = {} # cache path -> Event set when the request is finished with
+    self.lock = threading.Lock()
+    self.down_until = 0.0
+    self.fetched = 0
+    self.failed = 0
+    self.fallbacks = 0 # rendered here because the server was too slow or away
+    for i in range(CONNECTIONS):
+      threading.Thread(target=self.fetch, daemon=True).start()
+
+  def request(self, matter, pic, mat_type):
+    """ ask for pic to be rendered unless it's cached or asked for already """
+    if time.time() < self.down_until:
+      return
+    path = PhotoUtils.render_path(matter, pic, mat_type)
+    if os.path.exists(path):
+      return
+    with self.lock:
+      if path in self.pending:
+        return
+      self.pending[path] = threading.Event()
+    rel_path = os.path.relpath(pic.fname, config.PIC_DIR)
+    self.jobs.put((path, rel_path, mat_type, matter.display_size))
+
+  def wait(self, matter, pic, mat_type, time_left):
+    """ True once pic is in the render cache, False if it's to be rendered here """
+    path = PhotoUtils.render_path(matter, pic, mat_type)
+    with self.lock:
+      done = self.pending.get(path)
+    if done is not None:
+      done.wait(max(min(time_left * SAFETY, self.timeout), 0.0))
+    if os.path.exists(path):
+      return True
+    self.fallbacks += 1
+    return False
+
+  def fetch(self):
+    while True:
+      (path, rel_path, mat_type, display_size) = self.jobs.get()
+      try:
+        # not wanted if it was rendered here while queued or the server has gone
+        if not os.path.exists(path) and time.time() >= self.down_until:
+          query = urllib.parse.urlencode({'path': rel_path, 'mat_type': mat_type,
+                                          'w': display_size[0], 'h': display_size[1]})
+          with urllib.request.urlopen('{}/render?{}'.format(self.url, query), timeout=self.timeout) as f:
+            data = f.read()
+          if render_cache.save_file(path, data):
+            self.fetched += 1
+      except urllib.error.HTTPError as e: # the server is there, it just won't do this one
+        if config.VERBOSE:
+          print('render server said {} for {}'.format(e.code, rel_path))
+      except (urllib.error.URLError, OSError) as e: # includes timeouts
+        self.failed += 1
+        self.down_until = time.time() + RETRY_AFTER
+        print('''Couldn't get {} from render server giving error: {} - rendering here for {:.0f}s'''.format(
+              rel_path, e, RETRY_AFTER))
+      finally:
+        with self.lock:
+          done = self.pending.pop(path, None)
+        if done is not None:
+          done.set()
+
+  def report(self):
+    return 'render server: {} fetched, {} failed, {} rendered here instead'.format(
+           self.fetched, self.failed, self.fallbacks)
+
+if __name__ == '__main__':
+  sys.exit(serve(config.RENDER_PORT))
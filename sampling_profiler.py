@@ -0,0 +1,132 @@
+""" On demand sampling profiler for a running wall. Nothing runs until it's
+asked for with
+
+  kill -USR1 <pid of index.py>
+  python3 control.py profile seconds=30
+
+then a thread looks at every thread's stack INTERVAL apart for the time given
+and writes two files to CACHE_DIR/profiles:
+
+  <time>.folded   one line per distinct stack, 'thread;outer;...;inner count',
+                  which flamegraph.pl or speedscope read as they are
+  <time>.txt      the hot spots - samples each function was running in (total)
+                  and at the top of the stack (self), with WATCHED first
+
+Being a sampler it adds nothing to the code being looked at, the cost is the
+sampling thread walking the stacks which is well under 1% at 100 a second.
+"""
+import os
+import sys
+import time
+import signal
+import threading
+import collections
+
+import Config as config
+
+INTERVAL = 0.01 # seconds between samples
+DEFAULT_SECONDS = 30.0
+MAX_SECONDS = 300.0
+WATCHED = ('display_images', 'tex_load', 'render_image', 'mat_image', 'KmeansNp.run', 'resize')
+
+running = threading.Lock() # held while a profile is being taken so only one at once
+
+def frame_name(frame):
+  code = frame.f_code
+  name = getattr(code, 'co_qualname', None) # qualname from python 3.11 gives the class too
+  if name is None: # before that the class is taken from self, so KmeansNp.run is still found
+    name = code.co_name
+    if code.co_varnames[:1] == ('self',):
+      me = frame.f_locals.get('self')
+      if me is not None:
+        name = '{}.{}'.format(type(me).__name__, name)
+  return '{}:{}'.format(os.path.basename(code.co_filename), name)
+
+def thread_names():
+  names = {}
+  for thread in threading.enumerate():
+    names[thread.ident] = 'render' if thread is threading.main_thread() else thread.name
+  return names
+
+def sample(seconds, stacks):
+  me = threading.get_ident()
+  names = thread_names()
+  end = time.time() + seconds
+  rounds = 0
+  while time.time() < end:
+    rounds += 1
+    for (ident, frame) in sys._current_frames().items():
+      if ident == me:
+        continue
+      if ident not in names:
+        names = thread_names() # a thread started since
+      stack = []
+      while frame is not None:
+        stack.append(frame_name(frame))
+        frame = frame.f_back
+      stack.append(names.get(ident, str(ident)))
+      stacks[tuple(reversed(stack))] += 1
+    time.sleep(INTERVAL)
+  return rounds
+
+def summary(stacks, seconds, rounds):
+  total = collections.Counter() # samples a function was anywhere on the stack
+  own = collections.Counter() # samples it was the one running
+  threads = collections.Counter()
+  for (stack, count) in stacks.items():
+    threads[stack[0]] += count
+    for name in set(stack[1:]): # recursion only counted once
+      total[name] += count
+    own[stack[-1]] += count
+
+  def line(name):
+    return '{:>8} {:>8}  {}'.format(total[name], own[name], name)
+
+  lines = ['{} samples of each thread in {:.0f}s'.format(rounds, seconds), '',
+           'samples per thread']
+  lines += ['{:>8}  {}'.format(count, name) for (name, count) in threads.most_common()]
+  lines += ['', 'watched    total     self']
+  for watched in WATCHED:
+    for name in sorted(n for n in total if n.split(':')[-1] == watched or n.endswith('.' + watched)):
+      lines.append(line(name))
+  lines += ['', 'top 40        total     self']
+  lines += [line(name) for (name, _count) in total.most_common(40)]
+  return '\n'.join(lines) + '\n'
+
+def profile(seconds):
+  if not running.acquire(blocking=False):
+    return None
+  try:
+    stacks = collections.Counter()
+    rounds = sample(seconds, stacks)
+    out_dir = os.path.join(config.CACHE_DIR, 'profiles')
+    os.makedirs(out_dir, exist_ok=True)
+    base = os.path.join(out_dir, time.strftime('%Y%m%d-%H%M%S'))
+    with open(base + '.folded', 'w') as f:
+      for (stack, count) in stacks.items():
+        f.write('{} {}\n'.format(';'.join(stack), count))
+    with open(base + '.txt', 'w') as f:
+      f.write(summary(stacks, seconds, rounds))
+    print('profile written to {}.folded and .txt'.format(base))
+    return base
+  finally:
+    running.release()
+
+def start(seconds=DEFAULT_SECONDS):
+  """ profile in the background for seconds, False if one is already going """
+  if running.locked():
+    return False
+  seconds = min(max(float(seconds), INTERVAL), MAX_SECONDS)
+  threading.Thread(target=profile, args=(seconds,), name='profiler', daemon=True).start()
+  return True
+
+def control_command(request):
+  seconds = float(request.get('seconds', DEFAULT_SECONDS))
+  if not start(seconds):
+    return {'ok': False, 'error': 'already profiling'}
+  return {'ok': True, 'seconds': seconds, 'dir': os.path.join(config.CACHE_DIR, 'profiles')}
+
+def install(signum=getattr(signal, 'SIGUSR1', None)):
+  """ profile for DEFAULT_SECONDS whenever signum arrives - call from the main thread """
+  if signum is not None:
+    signal.signal(signum, lambda _signum, _frame: start())
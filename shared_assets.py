@@ -0,0 +1,339 @@
+#!/usr/bin/python3
+""" Lets worker processes do the matting without each loading the mat
+resources, and hands their results back without pickling them.
+
+SharedAssets decodes mat_texture.jpg (already resized to the display, which
+every textured mat did again) and the four nine-patch PNGs once, into one
+block of shared memory. Workers attach() it and get PIL images straight over
+that memory to pass to MatImage(resources=...) - read only, nothing copied.
+
+FrameRing is a fixed set of display sized slots in shared memory for the
+finished photos, with a table beside it saying who has each one:
+
+  FREE -> WRITING   claim() by a worker, which records its pid
+  WRITING -> READY  publish() once the pixels are in
+  READY -> READING  take() on the render side, a numpy view of the slot
+  READING -> FREE   release() once the texture has been uploaded from it
+
+Every change is made under one lock and checked against the state the slot
+should be in. A worker that dies part way through leaves its slot WRITING
+with its pid, so claim() gives those back when it can't find a free one.
+
+RenderPool puts the two together for the wall (--render_processes). Each
+loader thread still runs PhotoUtils.tex_load but passes it the pool's
+render_image, which sends the file to a worker and waits. The Frame that
+comes back stands in for the PIL image and the texture is made from the slot
+itself, the slot being released when upload_scheduler has it on the GPU.
+Pairs, raw_cache hits and anything a worker can't do stay in the thread.
+With --mirror the thread gets the file into the mirror and tells the worker
+where it is, the workers never have a mirror of their own.
+"""
+import os
+import time
+import random
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+import Config as config
+import PhotoUtils
+import mat_image
+import mirror
+import raw_cache
+
+FREE, WRITING, READY, READING = 0, 1, 2, 3
+STATE_NAMES = ('free', 'being written', 'ready', 'being shown')
+STATE, HEIGHT, WIDTH, CHANNELS, PID = range(5) # columns of the ring's table
+CLAIM_WAIT = 5.0 # seconds a worker waits for a free slot before giving up
+RENDER_TIMEOUT = 60.0 # seconds before a worker is taken to have hung on a photo
+
+class SharedAssets:
+  """ the MatImage resource images, made with create() and opened in the workers with attach() """
+  def __init__(self, shm, layout, owner):
+    self.shm = shm
+    self.layout = layout # [(name, mode, (w, h), offset)]
+    self.owner = owner
+
+  @classmethod
+  def create(cls, display_size, resource_folder='.'):
+    images = mat_image.load_resource_images(resource_folder)
+    # what __get_colorized_mat() did for every textured mat
+    images['mat_texture'] = images['mat_texture'].resize(display_size, resample=Image.BICUBIC)
+    (layout, arrays, offset) = ([], [], 0)
+    for (name, im) in sorted(images.items()):
+      arr = np.asarray(im)
+      layout.append((name, im.mode, im.size, offset))
+      arrays.append(arr)
+      offset += arr.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=offset)
+    for ((_name, _mode, _size, start), arr) in zip(layout, arrays):
+      np.frombuffer(shm.buf, np.uint8, arr.nbytes, start)[:] = arr.reshape(-1)
+    return cls(shm, layout, True)
+
+  def descriptor(self):
+    return (self.shm.name, self.layout)
+
+  @classmethod
+  def attach(cls, descriptor):
+    (name, layout) = descriptor
+    return cls(shared_memory.SharedMemory(name=name), layout, False)
+
+  def images(self):
+    """ name -> PIL image over the shared memory, for MatImage(resources=...) """
+    buf = self.shm.buf.toreadonly()
+    images = {}
+    for (name, mode, size, offset) in self.layout:
+      nbytes = size[0] * size[1] * len(mode)
+      images[name] = Image.frombuffer(mode, size, buf[offset:offset + nbytes], 'raw', mode, 0, 1)
+    return images
+
+  def close(self):
+    try:
+      self.shm.close()
+    except BufferError: # images over it are still about, it's unmapped with the process
+      pass
+    if self.owner: # gone once nothing has it mapped
+      self.shm.unlink()
+
+class FrameRing:
+  def __init__(self, data, table, lock, slot_bytes, owner):
+    self.data = data
+    self.table_shm = table
+    self.lock = lock
+    self.slot_bytes = slot_bytes
+    self.owner = owner
+    self.table = np.ndarray((table.size // (5 * 8), 5), np.int64, buffer=table.buf)
+    self.handed = 0 # frames taken by this side
+    self.copied = 0 # too big for a slot so pickled instead, counted by RenderPool
+
+  @classmethod
+  def create(cls, slots, slot_bytes):
+    data = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+    table = shared_memory.SharedMemory(create=True, size=slots * 5 * 8)
+    ring = cls(data, table, multiprocessing.Lock(), slot_bytes, True)
+    ring.table[:] = 0 # all FREE
+    return ring
+
+  def descriptor(self):
+    # the lock can only go to a process as it starts, i.e. in Pool's initargs
+    return (self.data.name, self.table_shm.name, self.lock, self.slot_bytes)
+
+  @classmethod
+  def attach(cls, descriptor):
+    (data, table, lock, slot_bytes) = descriptor
+    return cls(shared_memory.SharedMemory(name=data), shared_memory.SharedMemory(name=table), lock, slot_bytes, False)
+
+  def move(self, slot, was, to):
+    # with the lock held
+    if self.table[slot, STATE] != was:
+      raise ValueError('frame slot {} is {} not {}'.format(slot, STATE_NAMES[self.table[slot, STATE]], STATE_NAMES[was]))
+    self.table[slot, STATE] = to
+
+  def claim(self, wait=CLAIM_WAIT):
+    """ a FREE slot now owned by this process for writing, None if there isn't one in time """
+    give_up = time.time() + wait
+    while True:
+      with self.lock:
+        free = np.flatnonzero(self.table[:, STATE] == FREE)
+        if len(free) == 0:
+          free = [slot for slot in np.flatnonzero(self.table[:, STATE] == WRITING)
+                  if not pid_alive(int(self.table[slot, PID]))] # left by a worker that died
+        if len(free) > 0:
+          slot = int(free[0])
+          self.table[slot, STATE] = WRITING
+          self.table[slot, PID] = os.getpid()
+          return slot
+      if time.time() > give_up:
+        return None
+      time.sleep(0.02)
+
+  def pixels(self, slot, shape):
+    return np.ndarray(shape, np.uint8, buffer=self.data.buf, offset=slot * self.slot_bytes)
+
+  def publish(self, slot, shape):
+    with self.lock:
+      self.move(slot, WRITING, READY)
+      self.table[slot, HEIGHT:CHANNELS + 1] = shape
+
+  def abandon(self, slot):
+    with self.lock:
+      self.move(slot, WRITING, FREE)
+
+  def take(self, slot):
+    """ read only view of a READY slot, which is this side's until release() """
+    with self.lock:
+      self.move(slot, READY, READING)
+      shape = tuple(int(v) for v in self.table[slot, HEIGHT:CHANNELS + 1])
+    self.handed += 1
+    view = self.pixels(slot, shape)
+    view.flags.writeable = False
+    return view
+
+  def release(self, slot):
+    with self.lock:
+      self.move(slot, READING, FREE)
+
+  def report(self):
+    with self.lock:
+      counts = np.bincount(self.table[:, STATE], minlength=4)
+    text = ', '.join('{} {}'.format(n, name) for (n, name) in zip(counts, STATE_NAMES) if n > 0)
+    return 'frames: {} of {}, {} handed over, {} copied'.format(text, len(self.table), self.handed, self.copied)
+
+  def close(self):
+    self.table = None
+    for shm in (self.data, self.table_shm):
+      try:
+        shm.close()
+      except BufferError: # a view of it is still about, it's unmapped with the process
+        pass
+      if self.owner:
+        shm.unlink()
+
+def pid_alive(pid):
+  try:
+    os.kill(pid, 0)
+    return True
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    return True
+
+class Frame:
+  """ a slot taken from the ring, in place of the PIL image. release() it once it's been used """
+  def __init__(self, ring, slot):
+    self.ring = ring
+    self.slot = slot
+    self.pixels = ring.take(slot)
+    self.released = False
+
+  @property
+  def width(self):
+    return self.pixels.shape[1]
+
+  @property
+  def height(self):
+    return self.pixels.shape[0]
+
+  @property
+  def mode(self):
+    return 'RGBA' if self.pixels.shape[2] == 4 else 'RGB'
+
+  def to_pil(self):
+    return Image.fromarray(self.pixels, self.mode)
+
+  def release(self):
+    if not self.released:
+      self.released = True
+      self.pixels = None
+      self.ring.release(self.slot)
+
+  def __del__(self):
+    try:
+      self.release() # i.e. the texture was dropped without being uploaded
+    except Exception:
+      pass
+
+# in each worker process
+worker_assets = None # kept so the memory under the images stays mapped
+worker_matter = None
+worker_ring = None
+
+def init_worker(display_size, assets, ring=None):
+  """ Pool initializer, also used by warm_cache.py without a ring """
+  global worker_assets, worker_matter, worker_ring
+  mirror.hand_over() # the parent's mirror if there is one, see render_job
+  worker_assets = SharedAssets.attach(assets)
+  worker_matter = PhotoUtils.make_matter(display_size, worker_assets.images())
+  if ring is not None:
+    worker_ring = FrameRing.attach(ring)
+
+def render_job(job):
+  """ in a worker: ('ok', slot, info), ('skip', None, info) or ('copy', im, info)
+  with info what render_image found out about the file """
+  (fields, mat_type, quality, date_from, date_to, mirrored) = job
+  (PhotoUtils.date_from, PhotoUtils.date_to) = (date_from, date_to)
+  mirror.hand_over(mirrored)
+  pic = PhotoUtils.Pic(*fields)
+  # a list of one so there's nothing to pair with, pairs stay in the loader thread
+  rendered = PhotoUtils.render_image(worker_matter, 0, [pic], mat_type=mat_type, quality=quality)
+  info = (pic.orientation, pic.dt, pic.fdt, pic.location, pic.aspect, PhotoUtils.timing.secs)
+  if rendered is None:
+    return ('skip', None, info)
+  im = rendered[0]
+  if im.mode not in ('RGB', 'RGBA'):
+    im = im.convert('RGBA')
+  path = PhotoUtils.rendered_path(worker_matter, pic, mat_type)
+  if config.RAW_CACHE and path is not None and (quality is None or quality.tier == 0):
+    raw_cache.save(raw_cache.raw_path(path), im)
+  shape = (im.height, im.width, len(im.mode))
+  slot = None if im.height * im.width * len(im.mode) > worker_ring.slot_bytes else worker_ring.claim()
+  if slot is None: # too big or the render side is holding them all, the slow way then
+    return ('copy', im, info)
+  try:
+    worker_ring.pixels(slot, shape)[:] = np.asarray(im)
+  except Exception:
+    worker_ring.abandon(slot)
+    raise
+  worker_ring.publish(slot, shape)
+  return ('ok', slot, info)
+
+class RenderPool:
+  """ make it before any threads are started, the workers are forked """
+  def __init__(self, workers, display_size, slots=None):
+    self.assets = SharedAssets.create(display_size)
+    self.ring = FrameRing.create(slots or 2 * workers + 2, display_size[0] * display_size[1] * 4)
+    self.pool = multiprocessing.get_context('fork').Pool(workers, init_worker,
+                                                         (display_size, self.assets.descriptor(), self.ring.descriptor()))
+    self.lock = threading.Lock()
+
+  def render_image(self, matter, pic_num, iFiles, size=None, mat_type=None, quality=None):
+    """ as PhotoUtils.render_image but matted in a worker, with a Frame in place of the PIL image """
+    if type(pic_num) is not int or size is not None or (config.PORTRAIT_PAIRS and iFiles[pic_num].aspect < 1.0):
+      return PhotoUtils.render_image(matter, pic_num, iFiles, size, mat_type, quality)
+    pic = iFiles[pic_num]
+    if pic.shown_with is not None:
+      return None # already shown as the other half of a pair
+    if mat_type is None:
+      mat_type = random.choice(matter.mat_type)
+    local_mirror = mirror.get() # the worker reads what this one copied rather than going to the share
+    mirrored = None if local_mirror is None else {pic.fname: (local_mirror.path(pic.fname), local_mirror.stat(pic.fname))}
+    job = ((pic.fname, pic.orientation, pic.mtime, pic.dt, pic.fdt, pic.location, pic.aspect),
+           mat_type, quality, PhotoUtils.date_from, PhotoUtils.date_to, mirrored)
+    result = self.wait(self.pool.apply_async(render_job, (job,)))
+    (kind, what, info) = result
+    # the worker's own time so waiting for a free one isn't held against the photo
+    (pic.orientation, pic.dt, pic.fdt, pic.location, pic.aspect, PhotoUtils.timing.secs) = info
+    if kind == 'skip':
+      return None
+    if kind == 'copy':
+      self.ring.copied += 1
+      return (what, None)
+    return (Frame(self.ring, what), None)
+
+  def wait(self, pending):
+    try:
+      return pending.get(RENDER_TIMEOUT)
+    except multiprocessing.TimeoutError:
+      # the result may still turn up, if so its slot is given back
+      threading.Thread(target=self.give_back, args=(pending,), daemon=True).start()
+      raise TimeoutError('no answer from the render worker in {:.0f}s'.format(RENDER_TIMEOUT))
+
+  def give_back(self, pending):
+    try:
+      (kind, what, _info) = pending.get()
+      if kind == 'ok':
+        Frame(self.ring, what).release()
+    except Exception:
+      pass
+
+  def report(self):
+    return self.ring.report()
+
+  def close(self):
+    self.pool.terminate()
+    self.pool.join()
+    self.ring.close()
+    self.assets.close()
@@ -0,0 +1,104 @@
+""" Startup timeline and the set of photos the wall starts with next time.
+
+mark() notes how long after this module was first imported each step of
+getting going finished, report() lays them out.
+
+save_startup_set() is called every so often by the wall with the rendered
+cache files of what is on screen, so after a restart (or a power cut) those
+can be scrolling within a second or so of the display coming up while the
+library scan, MatImage and the loaders get going behind them.
+
+Along with them goes where each lane's layout had got to - its seed and the
+slot index and place in the play order of every photo saved - and the play
+order itself is saved by save_play_order() each time it's made. Then once the
+library has been scanned the new order can follow the old one and each lane's
+layout carry on from the slot after the last photo put back, so the wall
+picks up where it left off rather than starting over with a fresh shuffle.
+The set is small so is written every few seconds, the order (a line per
+photo) only when it changes.
+"""
+import os
+import json
+import time
+
+T0 = time.time()
+marks = [] # (name, seconds since T0) in the order they happened
+
+def mark(name):
+  marks.append((name, time.time() - T0))
+
+def report():
+  lines = ['startup timeline (s since start)']
+  last = 0.0
+  for (name, tm) in marks:
+    lines.append('{:8.3f} {:+8.3f}  {}'.format(tm, tm - last, name))
+    last = tm
+  return '\n'.join(lines)
+
+def startup_path(cache_dir):
+  return os.path.join(cache_dir, 'startup.json')
+
+def play_order_path(cache_dir):
+  return os.path.join(cache_dir, 'play_order.txt')
+
+def write_atomic(path, write):
+  # write(f) to a new file then swap it in, so a power cut mid write leaves the old one
+  tmp_path = path + '.tmp'
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with open(tmp_path, 'w', encoding='utf-8', errors='surrogateescape') as f:
+    write(f)
+  os.replace(tmp_path, path)
+
+def save_startup_set(cache_dir, entries, lanes=None, order_id=None, shuffle=None, cooling=None):
+  """ entries is a list of dicts with at least render_path, width and height.
+  lanes is a dict for each lane with where its layout had got to, in the play
+  order saved as order_id. cooling is play_sampler.PlaySampler.cooling_names()
+  when shuffling """
+  state = {'photos': entries, 'lanes': lanes or [], 'order_id': order_id, 'shuffle': shuffle,
+           'cooling': cooling or []}
+  try:
+    write_atomic(startup_path(cache_dir), lambda f: json.dump(state, f))
+  except OSError as e:
+    print('''Couldn't save startup set giving error: {}'''.format(e))
+
+def load_startup_set(cache_dir):
+  """ what save_startup_set() saved as a dict, photos whose render has gone
+  are left in with render_path None so the layout can pick up from them """
+  try:
+    with open(startup_path(cache_dir)) as f:
+      state = json.load(f)
+  except (OSError, ValueError):
+    state = {}
+  if isinstance(state, list): # saved before there were lanes to carry on
+    state = {'photos': state}
+  state.setdefault('photos', [])
+  state.setdefault('lanes', [])
+  state.setdefault('order_id', None)
+  state.setdefault('shuffle', None)
+  state.setdefault('cooling', [])
+  for e in state['photos']:
+    if e.get('render_path') and not os.path.exists(e['render_path']):
+      e['render_path'] = None
+  return state
+
+def save_play_order(cache_dir, order_id, names):
+  """ names are the file names in play order, order_id is what the startup set
+  will refer to them by """
+  def write(f):
+    f.write(order_id + '\n')
+    for name in names:
+      f.write(name + '\n')
+  try:
+    write_atomic(play_order_path(cache_dir), write)
+  except OSError as e:
+    print('''Couldn't save play order giving error: {}'''.format(e))
+
+def load_play_order(cache_dir, order_id):
+  """ the names saved as order_id, None if it's not that one """
+  try:
+    with open(play_order_path(cache_dir), encoding='utf-8', errors='surrogateescape') as f:
+      if order_id is None or f.readline().rstrip('\n') != order_id:
+        return None
+      return [line.rstrip('\n') for line in f]
+  except OSError:
+    return None
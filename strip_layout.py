@@ -0,0 +1,111 @@
+""" Plans where each photo goes on the strip before it is loaded. A slot's size
+only depends on the photo's header dimensions and a random factor seeded from
+the slot index, and its x only on the slot before it, so loads can finish in
+any order and the plan can run as far ahead as wanted. Restarting at any slot
+is just seek(), nothing before it needs replaying.
+
+x values are in strip coordinates which only ever increase - the wall maps them
+to its own world coordinates.
+"""
+import random
+import collections
+
+class Slot:
+  __slots__ = ('index', 'pic_num', 'left', 'width', 'height', 'factor', 'mat_type')
+
+  def __init__(self, index, pic_num, left, width, height, factor, mat_type):
+    self.index = index
+    self.pic_num = pic_num
+    self.left = left
+    self.width = width
+    self.height = height
+    self.factor = factor
+    self.mat_type = mat_type
+
+  @property
+  def x(self):
+    return self.left + self.width / 2
+
+  @property
+  def right(self):
+    return self.left + self.width
+
+  def __repr__(self):
+    return 'Slot({}, pic {}, x={:.1f}, {:.0f}x{:.0f})'.format(self.index, self.pic_num, self.x,
+                                                           self.width, self.height)
+
+class StripLayout:
+  """
+  sizer(pic_num, rng) returns (w, h, factor, mat_type) for a photo or None if
+  it's to be left out, using rng for anything random so the result can be
+  repeated. num_files() gives the current length of the play order. stride
+  steps through it in bigger jumps so several strips can share one order.
+  If picker is set it's called for each pic_num instead, i.e. a
+  play_sampler draw, returning None when there's nothing to show. Then seek()
+  can be given picks to use first, i.e. what was coming up before a restart.
+  """
+  def __init__(self, sizer, num_files, gap, seed=None, stride=1, picker=None):
+    self.sizer = sizer
+    self.num_files = num_files
+    self.gap = gap
+    self.stride = stride
+    self.picker = picker
+    self.seed = random.randrange(1 << 30) if seed is None else seed
+    self.planned = collections.deque() # slots worked out but not handed out yet
+    self.picks = collections.deque() # pic_nums to plan before asking picker again
+    self.seek(0, 0, 0.0)
+
+  def seek(self, index, pic_num, left, picks=()):
+    """ start again with slot index for pic_num at left, or with picks if there's a picker """
+    self.planned.clear()
+    self.picks = collections.deque(picks)
+    self.next_index = index
+    self.next_pic_num = pic_num
+    self.next_left = left
+
+  def restart(self, pic_num, picks=()):
+    """ seek() from the first slot not handed out yet, so a new play order
+    takes over the strip space that was planned rather than leaving it blank """
+    if len(self.planned) > 0:
+      self.seek(self.planned[0].index, pic_num, self.planned[0].left, picks)
+    else:
+      self.seek(self.next_index, pic_num, self.next_left, picks)
+
+  def drawn(self):
+    """ pic_nums the picker gave that haven't been handed out, which a seek() throws away """
+    if self.picker is None:
+      return []
+    return [slot.pic_num for slot in self.planned] + list(self.picks)
+
+  def rng(self, index):
+    return random.Random(self.seed * 1000003 + index)
+
+  def plan(self, count):
+    """ make sure at least count slots are planned ahead, returns the planned slots """
+    n = self.num_files()
+    tries = 0
+    while len(self.planned) < count and n > 0 and tries < n:
+      if self.picker is None:
+        pic_num = self.next_pic_num % n
+      else:
+        pic_num = self.picks.popleft() if len(self.picks) > 0 else self.picker()
+      if pic_num is None:
+        break
+      self.next_pic_num = pic_num + self.stride
+      sized = self.sizer(pic_num, self.rng(self.next_index))
+      if sized is None: # skipped photos don't use up a slot or any space
+        tries += 1
+        continue
+      tries = 0
+      (w, h, factor, mat_type) = sized
+      slot = Slot(self.next_index, pic_num, self.next_left, w, h, factor, mat_type)
+      self.planned.append(slot)
+      self.next_index += 1
+      self.next_left = slot.right + self.gap
+    return self.planned
+
+  def next_slot(self):
+    """ hand out the next slot or None if nothing can be shown """
+    if len(self.plan(1)) == 0:
+      return None
+    return self.planned.popleft()
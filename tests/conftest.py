@@ -0,0 +1,18 @@
+import os
+import sys
+
+# Config parses sys.argv when it's first imported, which here would be pytest's
+sys.argv = sys.argv[:1]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import Config as config
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+  """ a scratch CACHE_DIR """
+  path = str(tmp_path / 'cache')
+  os.makedirs(path)
+  monkeypatch.setattr(config, 'CACHE_DIR', path)
+  return path
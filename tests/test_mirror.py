@@ -0,0 +1,99 @@
+import os
+import time
+
+import pytest
+
+import mirror
+
+@pytest.fixture
+def share(tmp_path):
+  """ a local directory of eight 1MB photos standing in for the share """
+  folder = tmp_path / 'share' / 'holiday'
+  folder.mkdir(parents=True)
+  fnames = []
+  for i in range(8):
+    fnames.append(str(folder / 'IMG_{:04d}.jpg'.format(i)))
+    with open(fnames[-1], 'wb') as f:
+      f.write(os.urandom(1048576))
+  return fnames
+
+def make_mirror(tmp_path, limit_mb=5, throttle_mbps=4):
+  # read at 4MB/s so copies take long enough to see
+  return mirror.LocalMirror(str(tmp_path / 'share'), str(tmp_path / 'mirror'), limit_mb, throttle_mbps=throttle_mbps)
+
+def wait_for(m, fnames, secs=5.0):
+  stop = time.time() + secs
+  while time.time() < stop and not all(f in m.entries for f in fnames):
+    time.sleep(0.05)
+
+def test_copied_on_demand(tmp_path, share):
+  m = make_mirror(tmp_path)
+  tm = time.time()
+  local = m.path(share[0])
+  assert time.time() - tm > 0.2
+  assert local != share[0] and m.misses == 1
+
+def test_read_ahead(tmp_path, share):
+  m = make_mirror(tmp_path)
+  m.read_ahead(share[1:4])
+  wait_for(m, share[1:4])
+  tm = time.time()
+  local = m.path(share[3])
+  assert time.time() - tm < 0.05 and local != share[3]
+  with open(local, 'rb') as a, open(share[3], 'rb') as b:
+    assert a.read() == b.read()
+  assert m.stat(share[3]) == (os.path.getsize(share[3]), os.path.getmtime(share[3]))
+
+def test_evicts_least_recently_used(tmp_path, share):
+  m = make_mirror(tmp_path)
+  m.path(share[0])
+  m.read_ahead(share[1:4])
+  wait_for(m, share[1:4])
+  m.read_ahead(share[4:8])
+  wait_for(m, share[4:8])
+  assert m.total <= m.limit
+  assert share[0] not in m.entries
+
+def test_each_lane_keeps_its_window(tmp_path, share):
+  m = make_mirror(tmp_path, limit_mb=4, throttle_mbps=None)
+  m.read_ahead(share[0:2], 0)
+  wait_for(m, share[0:2])
+  m.read_ahead(share[2:4], 1)
+  wait_for(m, share[2:4])
+  m.read_ahead(share[4:6], 1) # over the limit, lane 0's are older but still wanted
+  wait_for(m, share[4:6])
+  assert all(f in m.entries for f in share[0:2] + share[4:6])
+  assert share[2] not in m.entries and share[3] not in m.entries
+  assert m.total <= m.limit
+
+def test_share_down(tmp_path, share):
+  m = make_mirror(tmp_path)
+  m.read_ahead(share[7:8])
+  wait_for(m, share[7:8])
+  os.rename(str(tmp_path / 'share'), str(tmp_path / 'gone')) # unplugged
+  m.gone_down(OSError('test'))
+  assert m.path(share[7]) == m.local_name(share[7])
+  with pytest.raises(mirror.Unavailable):
+    m.path(share[0])
+  assert not m.available(share[0]) and m.available(share[7])
+  walked = [f for (_root, _dirs, files) in m.walk(str(tmp_path / 'share')) for f in files]
+  assert walked == [os.path.basename(share[7])] # a rescan lists the mirror
+
+def test_index_kept_for_next_time(tmp_path, share):
+  m = make_mirror(tmp_path, throttle_mbps=None)
+  m.read_ahead(share[0:3])
+  wait_for(m, share[0:3])
+  m.save_index()
+  assert sorted(make_mirror(tmp_path).entries) == sorted(share[0:3])
+
+def test_unindexed_copies_removed(tmp_path, share):
+  m = make_mirror(tmp_path, throttle_mbps=None)
+  m.read_ahead(share[0:2])
+  wait_for(m, share[0:2])
+  m.save_index()
+  m.read_ahead(share[2:4]) # copied after the last save, as if the wall stopped then
+  wait_for(m, share[2:4])
+  m2 = make_mirror(tmp_path)
+  assert sorted(m2.entries) == sorted(share[0:2])
+  assert not os.path.exists(m.local_name(share[2])) and not os.path.exists(m.local_name(share[3]))
+  assert m2.total == sum(os.path.getsize(f) for f in share[0:2])
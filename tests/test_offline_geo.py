@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+import offline_geo
+
+# known answers from the bundled geo_places_sample.csv
+@pytest.mark.parametrize('lat, lon, want', [
+    (51.5, -0.1, 'London, GB'),
+    (7.3, 80.64, 'Kandy, LK'),
+    (6.05, 80.2, 'Galle, LK'),
+    (-16.0, 179.9, 'Suva, FJ'), # nearer across the date line than Apia
+    (-14.0, -179.5, 'Suva, FJ'),
+    (69.6, 18.9, 'Tromso, NO')])
+def test_lookup(cache_dir, lat, lon, want):
+  geo = offline_geo.load_index(offline_geo.SAMPLE_PLACES)
+  assert geo.lookup(lat, lon, max_km=20000) == want
+
+def test_nothing_near(cache_dir):
+  geo = offline_geo.load_index(offline_geo.SAMPLE_PLACES)
+  assert geo.lookup(0.0, -140.0) == '' # the middle of the Pacific
+
+def test_exif_coords():
+  exif = {1: 'S', 2: ((33, 1), (55, 1), (3300, 100)), 3: 'E', 4: (18.0, 25.0, 24.0)}
+  (lat, lon) = offline_geo.gps_coords(exif)
+  assert lat == pytest.approx(-33.9258, abs=1e-3)
+  assert lon == pytest.approx(18.4233, abs=1e-3)
+  assert offline_geo.gps_coords({2: (0, 0, 0), 4: (0, 0, 0)}) is None # not set
+
+def test_second_load_is_mapped(cache_dir):
+  offline_geo.load_index(offline_geo.SAMPLE_PLACES)
+  geo = offline_geo.load_index(offline_geo.SAMPLE_PLACES)
+  assert isinstance(geo.lats, np.memmap)
@@ -0,0 +1,123 @@
+import time
+
+import numpy as np
+import pytest
+
+import catalog
+from play_sampler import FenwickTree, PlaySampler, base_weights, NEW_BOOST, COOLDOWN, COOLING_FRACTION
+
+NOW = 1.7e9
+
+def make_catalog(n, now=NOW):
+  builder = catalog.CatalogBuilder()
+  builder.add_dir('/photos')
+  for i in range(n): # photo i is i days old with its date i days ago too
+    builder.add('{:05d}.jpg'.format(i), now - i * 86400.0, dt=now - i * 86400.0)
+  return builder.build()
+
+@pytest.fixture(scope='module')
+def cat():
+  return make_catalog(2000)
+
+def test_tree_against_plain_sums():
+  rng = np.random.default_rng(1)
+  weights = rng.random(1000)
+  weights[::7] = 0.0
+  tree = FenwickTree(weights)
+  for _ in range(200):
+    i = int(rng.integers(1000))
+    new = float(rng.random())
+    tree.add(i, new - weights[i])
+    weights[i] = new
+  sums = np.concatenate(([0.0], np.cumsum(weights)))
+  assert tree.total == pytest.approx(sums[-1], abs=1e-9)
+  for i in (0, 1, 7, 500, 999, 1000):
+    assert tree.prefix(i) == pytest.approx(sums[i], abs=1e-9)
+  for u in rng.random(500) * sums[-1]:
+    assert tree.find(u) == np.searchsorted(sums, u, side='right') - 1
+  assert FenwickTree(np.zeros(0)).total == 0.0
+
+def test_recent_come_up_more(cat):
+  sampler = PlaySampler(cat, recent_n=10, now=NOW, seed=2)
+  first = [sampler.draw(NOW) for _ in range(20)]
+  assert sum(pos < 10 for pos in first) >= 7 # the --recent_n newest most of all
+  weights = base_weights(cat, NOW)
+  assert weights[0] == 1.0 + NEW_BOOST and np.all(np.diff(weights) <= 0.0) and weights[-1] >= 1.0
+
+def test_recent_boost_only_once(cat):
+  sampler = PlaySampler(cat, recent_n=10, now=NOW, seed=5)
+  for _ in range(len(cat)): # a full cycle, everything's been through the cooldown
+    sampler.draw(NOW)
+  assert sampler.base[:10].sum() / sampler.base.sum() < 0.05 # about their share of the library now, not RECENT_SHARE
+  assert np.all(sampler.base[:10] == sampler.normal[:10])
+
+def test_no_repeat_while_cooling(cat):
+  sampler = PlaySampler(cat, now=NOW, seed=3)
+  drawn = [sampler.draw(NOW) for _ in range(5000)]
+  last = {}
+  for (i, pos) in enumerate(drawn): # so never within half the library
+    assert pos not in last or i - last[pos] >= len(cat) * COOLING_FRACTION
+    last[pos] = i
+  assert sampler.cool_count <= len(cat) * COOLING_FRACTION
+
+def test_back_after_cooldown(cat):
+  sampler = PlaySampler(cat, now=NOW, seed=4)
+  pos = sampler.draw(NOW)
+  assert sampler.weights[pos] == 0.0
+  again = sampler.draw(NOW + COOLDOWN + 1)
+  assert sampler.weights[pos] > 0.0 or again == pos
+
+def test_small_library_goes_round():
+  sampler = PlaySampler(make_catalog(5), now=NOW, seed=5)
+  drawn = [sampler.draw(NOW) for _ in range(50)]
+  assert sorted(set(drawn)) == [0, 1, 2, 3, 4]
+
+def test_date_range(cat):
+  sampler = PlaySampler(cat, dt_from=NOW - 99.5 * 86400.0, dt_to=NOW - 49.5 * 86400.0, now=NOW, seed=6)
+  assert sampler.eligible == 50
+  sampler.exclude(60) # found outside it as it loads
+  drawn = {sampler.draw(NOW) for _ in range(200)}
+  assert drawn == set(range(50, 100)) - {60}
+  assert PlaySampler(cat, dt_from=NOW + 1, now=NOW).draw(NOW) is None
+
+def test_rescan_keeps_cooling_by_name(cat):
+  sampler = PlaySampler(cat, now=NOW, seed=7)
+  drawn = [sampler.draw(NOW) for _ in range(100)]
+  rescanned = make_catalog(2100)
+  rescanned.order = rescanned.order[::-1].copy()
+  again = PlaySampler(rescanned, now=NOW, seed=8)
+  again.carry_over(sampler)
+  assert again.cool_count == 100
+  for pos in drawn:
+    assert again.weights[len(rescanned) - 1 - pos] == 0.0
+
+def test_restart_restores_cooling(cat):
+  sampler = PlaySampler(cat, now=NOW, seed=9)
+  drawn = [sampler.draw(NOW) for _ in range(30)]
+  saved = sampler.cooling_names() # as save_startup_set keeps them, by name
+  assert [name for (name, _until) in saved] == [cat.fname(pos) for pos in drawn]
+  restarted = PlaySampler(make_catalog(2000), now=NOW, seed=10)
+  position = restarted.restore(saved, ['/photos/01999.jpg', '/photos/gone.jpg'])
+  assert position['/photos/01999.jpg'] == 1999 and '/photos/gone.jpg' not in position
+  assert [pos for (pos, _until) in restarted.cooling()] == drawn # oldest first still
+  assert all(restarted.weights[pos] == 0.0 for pos in drawn)
+  assert not set(drawn) & {restarted.draw(NOW) for _ in range(200)}
+
+def test_give_back_unshown(cat):
+  sampler = PlaySampler(cat, now=NOW, seed=11)
+  drawn = [sampler.draw(NOW) for _ in range(10)]
+  again = PlaySampler(cat, now=NOW, seed=12)
+  again.carry_over(sampler)
+  again.give_back([cat.fname(pos) for pos in drawn[3:6]]) # planned then thrown away by a seek
+  assert again.cool_count == 7
+  assert [pos for (pos, _until) in again.cooling()] == drawn[:3] + drawn[6:]
+  assert all(again.weights[pos] > 0.0 for pos in drawn[3:6])
+  assert all(again.weights[pos] == 0.0 for pos in drawn[:3] + drawn[6:])
+  assert again.tree.total == pytest.approx(again.weights.sum())
+
+def test_big_library_draws_quickly():
+  big = PlaySampler(make_catalog(200000), now=NOW)
+  tm = time.time()
+  for _ in range(2000):
+    big.draw(NOW)
+  assert (time.time() - tm) / 2000 < 1e-3 # O(log n), well under a ms
@@ -0,0 +1,58 @@
+import os
+import time
+
+import pytest
+
+import quarantine
+import PhotoUtils
+
+@pytest.fixture
+def photo(tmp_path, cache_dir, monkeypatch):
+  monkeypatch.setattr(quarantine, 'entries', None) # read afresh from the scratch CACHE_DIR
+  path = str(tmp_path / 'bad.jpg')
+  with open(path, 'wb') as f:
+    f.write(b'not really a jpeg')
+  return path
+
+def test_backoff(photo):
+  waits = []
+  for _ in range(8):
+    quarantine.failed(photo, 'broken')
+    entry = quarantine.load()[photo]
+    waits.append(entry['retry'] - entry['last'])
+  assert waits[0] == pytest.approx(quarantine.RETRY_BASE)
+  assert waits[1] == pytest.approx(quarantine.RETRY_BASE * quarantine.RETRY_FACTOR)
+  assert waits[-1] == pytest.approx(quarantine.RETRY_MAX)
+  assert quarantine.load()[photo]['failures'] == 8
+  assert quarantine.is_quarantined(photo, os.stat(photo).st_mtime)
+  quarantine.entries = None # as after a restart
+  assert quarantine.is_quarantined(photo)
+
+def test_release(photo, monkeypatch):
+  quarantine.failed(photo, 'broken')
+  mtime = os.stat(photo).st_mtime
+  assert quarantine.is_quarantined(photo, mtime)
+  assert not quarantine.is_quarantined(photo, mtime + 1) # changed since, so another go
+  now = time.time()
+  monkeypatch.setattr(time, 'time', lambda: now + quarantine.RETRY_BASE + 1)
+  assert not quarantine.is_quarantined(photo, mtime) # waited long enough
+  quarantine.loaded(photo)
+  assert photo not in quarantine.load()
+  quarantine.failed(photo, 'broken again')
+  assert quarantine.load()[photo]['failures'] == 1 # starts over once it's loaded
+
+def render_taking(secs, wall_secs=0.0):
+  def render(matter, pic_num, iFiles, size, mat_type, quality):
+    time.sleep(wall_secs)
+    PhotoUtils.timing.secs = secs
+    return None
+  return render
+
+def test_only_the_work_counts_as_slow(photo, monkeypatch):
+  monkeypatch.setattr(quarantine, 'SLOW_SECS', 0.1)
+  # waiting on a worker or the share isn't the photo's fault
+  assert PhotoUtils.tex_load(None, photo, [], render=render_taking(0.01, wall_secs=0.3)) is None
+  assert not quarantine.is_quarantined(photo)
+  assert PhotoUtils.tex_load(None, photo, [], render=render_taking(0.5)) is None
+  assert quarantine.is_quarantined(photo)
+  assert 'took' in quarantine.load()[photo]['error']
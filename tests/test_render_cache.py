@@ -0,0 +1,46 @@
+import os
+import shutil
+import time
+
+from PIL import Image
+
+import Config as config
+import render_cache
+
+def test_key_on_path_under_pic_dir(tmp_path, monkeypatch):
+  for name in ('here', 'there'):
+    (tmp_path / name / 'holiday').mkdir(parents=True)
+  Image.new('RGB', (8, 8)).save(str(tmp_path / 'here' / 'holiday' / 'a.jpg'))
+  shutil.copy2(str(tmp_path / 'here' / 'holiday' / 'a.jpg'), str(tmp_path / 'there' / 'holiday' / 'a.jpg'))
+  monkeypatch.setattr(config, 'PIC_DIR', str(tmp_path / 'here'))
+  key = render_cache.cache_key(str(tmp_path / 'here' / 'holiday' / 'a.jpg'), 'render')
+  monkeypatch.setattr(config, 'PIC_DIR', str(tmp_path / 'there')) # i.e. warmed on another machine
+  assert render_cache.cache_key(str(tmp_path / 'there' / 'holiday' / 'a.jpg'), 'render') == key
+  assert render_cache.key_name('./mat_texture.jpg') == './mat_texture.jpg' # not a photo
+
+def test_evict_oldest_first(cache_dir):
+  im = Image.frombytes('RGB', (256, 256), os.urandom(256 * 256 * 3))
+  for i in range(4):
+    render_cache.save('render', '{:02d}'.format(i) * 20, im, '.png')
+    path = render_cache.cache_path('render', '{:02d}'.format(i) * 20, '.png')
+    os.utime(path, (1000 + i, 1000 + i))
+  size = os.path.getsize(path)
+  assert render_cache.evict(2.5 * size / 1048576) == 2
+  left = sorted(os.path.basename(p) for p in render_cache.entries())
+  assert left == ['02' * 20 + '.png', '03' * 20 + '.png']
+
+def test_no_evict_when_off(cache_dir, monkeypatch):
+  monkeypatch.setattr(render_cache, 'evict_on_save', False)
+  evicted = []
+  monkeypatch.setattr(render_cache, 'evict', lambda *args: evicted.append(args))
+  im = Image.new('RGB', (4, 4))
+  for i in range(render_cache.EVICT_EVERY + 1):
+    render_cache.save('render', '{:040d}'.format(i), im, '.png')
+  assert evicted == []
+  monkeypatch.setattr(render_cache, 'evict_on_save', True)
+  for i in range(render_cache.EVICT_EVERY):
+    render_cache.save('render', '{:040d}'.format(i), im, '.png')
+  stop = time.time() + 2.0
+  while len(evicted) == 0 and time.time() < stop: # it's started on its own thread
+    time.sleep(0.01)
+  assert len(evicted) == 1
@@ -0,0 +1,73 @@
+import os
+import threading
+import http.server
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import Config as config
+import PhotoUtils
+import render_cache
+import render_server
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DISPLAY_SIZE = (640, 360)
+
+@pytest.fixture
+def photo(tmp_path, cache_dir, monkeypatch):
+  """ a Pic under a scratch PIC_DIR, run from the repo for the mat resources """
+  monkeypatch.chdir(REPO)
+  monkeypatch.setattr(config, 'PIC_DIR', str(tmp_path / 'pics'))
+  os.makedirs(config.PIC_DIR)
+  path = os.path.join(config.PIC_DIR, 'test.jpg')
+  rng = np.random.default_rng(1)
+  Image.fromarray(rng.integers(0, 255, (600, 900, 3), dtype=np.uint8)).save(path)
+  return PhotoUtils.Pic(path)
+
+@pytest.fixture
+def server():
+  """ a stand in render server on localhost, its URL """
+  httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), render_server.RenderHandler)
+  threading.Thread(target=httpd.serve_forever, daemon=True).start()
+  yield 'http://127.0.0.1:{}'.format(httpd.server_address[1])
+  httpd.shutdown()
+  httpd.server_close()
+
+def closed_port():
+  with http.server.HTTPServer(('127.0.0.1', 0), http.server.BaseHTTPRequestHandler) as httpd:
+    return httpd.server_address[1]
+
+def test_fetched_render_saved(photo, server, monkeypatch):
+  saved = []
+  save_file = render_cache.save_file
+  monkeypatch.setattr(render_cache, 'save_file', lambda path, data: saved.append((path, data)) or save_file(path, data))
+  client = render_server.RenderClient(server, timeout=30)
+  matter = PhotoUtils.make_matter(DISPLAY_SIZE)
+  mat_type = matter.mat_type[0]
+  client.request(matter, photo, mat_type)
+  assert client.wait(matter, photo, mat_type, 100.0)
+  path = PhotoUtils.render_path(matter, photo, mat_type)
+  assert [p for (p, _data) in saved] == [path]
+  with open(path, 'rb') as f:
+    assert f.read() == saved[0][1]
+  assert client.fetched == 1 and client.fallbacks == 0
+
+def check_falls_back(client, photo):
+  matter = PhotoUtils.make_matter(DISPLAY_SIZE)
+  mat_type = matter.mat_type[0]
+  client.request(matter, photo, mat_type)
+  assert not client.wait(matter, photo, mat_type, 100.0)
+  assert client.fallbacks == 1
+  assert PhotoUtils.render_image(matter, 0, [photo], mat_type=mat_type) is not None # rendered here instead
+  assert PhotoUtils.is_rendered(matter, photo, mat_type)
+
+def test_refused_falls_back(photo):
+  client = render_server.RenderClient('http://127.0.0.1:{}'.format(closed_port()), timeout=5)
+  check_falls_back(client, photo)
+  assert client.failed == 1 and client.down_until > 0
+
+def test_timed_out_falls_back(photo, server, monkeypatch):
+  monkeypatch.setattr(config, 'RENDER_DELAY', 2.0)
+  client = render_server.RenderClient(server, timeout=0.3)
+  check_falls_back(client, photo)
@@ -0,0 +1,22 @@
+import collections
+from types import SimpleNamespace
+
+import sampling_profiler
+
+class KmeansNp:
+  pass
+
+def old_frame(name, varnames, f_locals):
+  # a frame as python before 3.11 has it, without co_qualname
+  code = SimpleNamespace(co_filename='/home/pi/pi3d-photowall/mat_image.py', co_name=name, co_varnames=varnames)
+  return SimpleNamespace(f_code=code, f_locals=f_locals)
+
+def test_class_from_self_without_qualname():
+  assert sampling_profiler.frame_name(old_frame('run', ('self', 'k'), {'self': KmeansNp(), 'k': 3})) == 'mat_image.py:KmeansNp.run'
+  assert sampling_profiler.frame_name(old_frame('mat_image', ('image',), {'image': None})) == 'mat_image.py:mat_image'
+
+def test_watched_in_summary():
+  stacks = collections.Counter({('loader', 'index.py:tex_load', 'mat_image.py:KmeansNp.run'): 5})
+  text = sampling_profiler.summary(stacks, 1.0, 5)
+  watched = text.split('watched')[1].split('top 40')[0]
+  assert 'mat_image.py:KmeansNp.run' in watched and 'index.py:tex_load' in watched
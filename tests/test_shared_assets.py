@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import Config as config
+import PhotoUtils
+import mat_image
+import mirror
+from shared_assets import SharedAssets, FrameRing, Frame, RenderPool, PID
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DISPLAY_SIZE = (640, 360)
+
+@pytest.fixture
+def in_repo(monkeypatch):
+  monkeypatch.chdir(REPO) # where the mat resources are
+
+def make_photo(path):
+  rng = np.random.default_rng(1)
+  Image.fromarray(rng.integers(0, 255, (600, 900, 3), dtype=np.uint8)).save(path)
+  return path
+
+def test_shared_images_match_own(in_repo):
+  # the shared images are the ones MatImage would have loaded itself
+  assets = SharedAssets.create(DISPLAY_SIZE)
+  attached = SharedAssets.attach(assets.descriptor())
+  own = mat_image.load_resource_images()
+  images = attached.images()
+  for (name, im) in images.items():
+    expected = own[name].resize(DISPLAY_SIZE, resample=Image.BICUBIC) if name == 'mat_texture' else own[name]
+    assert im.size == expected.size and im.tobytes() == expected.tobytes(), name
+  images = im = None # let go of the memory so it can be closed
+  attached.close()
+  assets.close()
+
+def test_slot_ownership():
+  ring = FrameRing.create(2, 64)
+  a = ring.claim()
+  b = ring.claim()
+  assert ring.claim(wait=0.1) is None # both taken
+  ring.pixels(a, (2, 4, 3))[:] = 7
+  ring.publish(a, (2, 4, 3))
+  with pytest.raises(ValueError):
+    ring.release(a) # still READY, not the render side's yet
+  frame = Frame(ring, a)
+  assert frame.mode == 'RGB' and frame.pixels.sum() == 7 * 24 and not frame.pixels.flags.writeable
+  frame.release()
+  ring.table[b, PID] = 2 ** 22 + 12345 # a pid that isn't running, as if the worker had died
+  assert sorted([ring.claim(), ring.claim()]) == [0, 1] # the freed one and the dead worker's
+  ring.close()
+
+def test_photo_through_pool(in_repo, cache_dir):
+  files = [PhotoUtils.Pic(make_photo(os.path.join(cache_dir, 'test.jpg')))]
+  pool = RenderPool(2, DISPLAY_SIZE)
+  try:
+    matter = PhotoUtils.make_matter(DISPLAY_SIZE)
+    (frame, _im_b) = pool.render_image(matter, 0, files, mat_type=matter.mat_type[0])
+    assert isinstance(frame, Frame) and frame.pixels.max() > 0
+    assert files[0].dt is not None # what the worker found out came back
+    assert PhotoUtils.timing.secs > 0.0 # the worker's own time for it, for quarantine
+    assert 'being shown' in pool.report()
+    frame.release()
+    assert 'being shown' not in pool.report()
+  finally:
+    pool.close()
+
+def test_workers_use_the_parents_mirror(in_repo, cache_dir, tmp_path, monkeypatch):
+  share = tmp_path / 'share'
+  share.mkdir()
+  fname = make_photo(str(share / 'test.jpg'))
+  monkeypatch.setattr(config, 'MIRROR', True)
+  monkeypatch.setattr(config, 'PIC_DIR', str(share))
+  monkeypatch.setattr(mirror, 'mirror', None)
+  pool = RenderPool(1, DISPLAY_SIZE)
+  try:
+    assert isinstance(pool.pool.apply(mirror.get), mirror.HandedOver) # not a LocalMirror of its own
+    local_mirror = mirror.get()
+    local_mirror.path(fname) # as if read ahead
+    os.rename(str(share), str(tmp_path / 'gone')) # the share stops answering
+    local_mirror.gone_down(OSError('test'))
+    matter = PhotoUtils.make_matter(DISPLAY_SIZE)
+    (frame, _im_b) = pool.render_image(matter, 0, [PhotoUtils.Pic(fname)], mat_type=matter.mat_type[0])
+    assert frame.pixels.max() > 0 # read from the copy the parent made
+    frame.release()
+  finally:
+    pool.close()
@@ -0,0 +1,33 @@
+from strip_layout import StripLayout
+
+def sizer(pic_num, rng):
+  return (100, 80, 1.0, 'plain')
+
+def test_in_order_with_stride():
+  layout = StripLayout(sizer, lambda: 10, 5, seed=1, stride=2)
+  layout.seek(0, 1, 0.0)
+  slots = [layout.next_slot() for _ in range(6)]
+  assert [s.pic_num for s in slots] == [1, 3, 5, 7, 9, 1]
+  assert [s.left for s in slots[:3]] == [0.0, 105.0, 210.0]
+
+def test_picks_before_picker():
+  draws = iter([7, 8, 9])
+  layout = StripLayout(sizer, lambda: 10, 5, seed=1, picker=lambda: next(draws))
+  layout.seek(4, 0, 50.0, [2, 3])
+  layout.plan(3)
+  assert layout.drawn() == [2, 3, 7] # planned, not handed out
+  assert [layout.next_slot().pic_num for _ in range(4)] == [2, 3, 7, 8]
+  assert layout.drawn() == []
+  layout.seek(10, 0, 0.0, [5])
+  assert layout.drawn() == [5]
+
+def test_restart_reuses_planned_space():
+  # as index.use_files() does on a rescan, with slots planned ahead but not loaded
+  layout = StripLayout(sizer, lambda: 10, 5, seed=1)
+  layout.plan(12)
+  shown = [layout.next_slot() for _ in range(3)]
+  layout.restart(0)
+  assert len(layout.planned) == 0
+  after = layout.next_slot()
+  assert after.index == shown[-1].index + 1
+  assert after.left == shown[-1].right + 5 # no gap on the wall
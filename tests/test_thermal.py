@@ -0,0 +1,79 @@
+import os
+import time
+
+import pytest
+
+import Config as config
+import thermal
+from thermal import ThermalGovernor, LEVELS, SETTLE, COOL_SECS
+
+@pytest.fixture
+def sensor(tmp_path, monkeypatch):
+  """ sensor(millidegrees, throttled) fakes the sysfs file and vcgencmd """
+  monkeypatch.setattr(config, 'THERMAL_TEMP_PATH', str(tmp_path / 'temp'))
+  monkeypatch.setattr(config, 'VCGENCMD', str(tmp_path / 'vcgencmd'))
+  monkeypatch.setattr(config, 'VERBOSE', False)
+  def fake(millidegrees, throttled):
+    with open(config.THERMAL_TEMP_PATH, 'w') as f:
+      f.write('{}\n'.format(millidegrees))
+    with open(config.VCGENCMD, 'w') as f:
+      f.write('#!/bin/sh\n[ "$1" = get_throttled ] && echo throttled={}\n'.format(throttled))
+      f.write('''[ "$1" = measure_temp ] && echo "temp=61.2'C"\nexit 0\n''')
+    os.chmod(config.VCGENCMD, 0o755)
+  return fake
+
+def test_readings(sensor, tmp_path, monkeypatch):
+  sensor(48300, '0x50000') # has throttled since boot but isn't now
+  assert thermal.read_temp() == 48.3 and thermal.read_throttled() == 0x50000
+  assert thermal.describe_throttled(thermal.read_throttled()) == 'not throttled'
+  os.remove(config.THERMAL_TEMP_PATH)
+  assert thermal.read_temp() == 61.2 # from vcgencmd when there's no sysfs
+  monkeypatch.setattr(config, 'VCGENCMD', str(tmp_path / 'missing'))
+  assert thermal.read_temp() is None and thermal.read_throttled() is None
+
+def test_stepping(sensor):
+  applied = []
+  thermo = ThermalGovernor(75.0, 60, 2, lambda *settings: applied.append(settings))
+  t = 1000.0
+  sensor(70000, '0x0')
+  thermo.check(t)
+  assert thermo.level == 0 and applied == []
+  sensor(80000, '0x0')
+  thermo.check(t + 5)
+  assert thermo.level == 1 and applied[-1] == (45, 2, 0) # straight away
+  thermo.check(t + 10)
+  assert thermo.level == 1 # settling
+  thermo.check(t + 5 + SETTLE)
+  assert thermo.level == 2 and applied[-1] == (30, 2, 1)
+  sensor(72000, '0x4') # under target but the firmware is throttling anyway
+  thermo.check(t + 5 + 2 * SETTLE)
+  assert thermo.level == 3 and applied[-1] == (30, 1, 2)
+  for _ in range(10):
+    t += SETTLE
+    sensor(85000, '0x6')
+    thermo.check(t + 5 + 2 * SETTLE)
+  assert thermo.level == len(LEVELS) - 1 and applied[-1] == (20, 1, 3) # no further than the last
+  # inside the hysteresis stays put however long
+  t += 5 + 2 * SETTLE
+  sensor(72000, '0x0')
+  for step in range(60):
+    thermo.check(t + step * 5)
+  assert thermo.level == len(LEVELS) - 1
+  # properly cool comes down a level per COOL_SECS
+  t += 300
+  sensor(60000, '0x0')
+  levels = []
+  for step in range(int(3 * COOL_SECS / 5) + 2):
+    thermo.check(t + step * 5)
+    levels.append(thermo.level)
+  assert levels[0] == 4 and levels[-1] == 1 and sorted(levels, reverse=True) == levels
+  assert applied[-1] == (45, 2, 0)
+  assert 'level 1 of 4' in thermo.report()
+
+def test_frame_metrics():
+  thermo = ThermalGovernor(75.0, 60, 2, lambda *settings: None)
+  thermo.frame()
+  time.sleep(0.02)
+  thermo.frame()
+  (fps, worst_ms) = thermo.frame_metrics(time.time())
+  assert worst_ms >= 20 and fps > 0
@@ -0,0 +1,27 @@
+import math
+
+import pytest
+
+from tiled_sprite import tile_edges, wanted_columns
+
+def test_tile_edges():
+  assert tile_edges(2500, 1024) == [0, 1024, 2048, 2500]
+  assert tile_edges(2048, 1024) == [0, 1024, 2048]
+
+@pytest.mark.parametrize('left, right, want', [
+    (0, 1920, [0, 1, 2, 3]),
+    (-500, 100, [0]), # only the left edge is on
+    (600, 900, [1]), # 1200 to 1800 pixels
+    (512, 1024, [1]), # exactly the second column
+    (1900, 3000, [3]),
+    (2000, 3000, []), # gone off the left
+    (-900, -10, [])]) # not on yet
+def test_wanted_columns(left, right, want):
+  edges = tile_edges(3840, 1024) # shown at 1920 wide so 2 pixels a world unit
+  assert list(wanted_columns(edges, 2.0, left, right)) == want
+
+def test_about_a_screen_resident():
+  # however wide the photo
+  edges = tile_edges(16000, 1024)
+  most = max(len(wanted_columns(edges, 1.0, x, x + 1920 + 300)) for x in range(-2500, 16000, 37))
+  assert most <= math.ceil((1920 + 300) / 1024) + 1
@@ -0,0 +1,50 @@
+import time
+
+from upload_scheduler import UploadScheduler, CHUNK_BYTES
+
+def fake_steps(nbytes):
+  # fake uploads going at 500MB/s so one chunk is ~2ms, no GL needed
+  for top in range(0, nbytes, CHUNK_BYTES):
+    sent = min(CHUNK_BYTES, nbytes - top)
+    time.sleep(sent / 500e6)
+    yield sent
+  yield 0
+  time.sleep(0.003) # the mipmaps
+
+def test_budget_kept_to():
+  added = []
+  scheduler = UploadScheduler(budget_ms=5)
+  for n in (6, 1, 3):
+    scheduler.submit_steps(fake_steps(n * CHUNK_BYTES), lambda n=n: added.append(n), n * CHUNK_BYTES)
+  frames = 0
+  while scheduler.backlog()[0] > 0:
+    tm = time.time()
+    scheduler.run()
+    frames += 1
+    ms = (time.time() - tm) * 1000.0
+    assert frames < 50, 'stuck'
+    assert ms < 5 + 4, 'frame {} took {:.1f}ms'.format(frames, ms) # a chunk over at most
+  assert added == [6, 1, 3]
+  assert frames >= (6 + 1 + 3) * 2 // 5 # the budget was actually held to
+  assert 'MB/s' in scheduler.report()
+
+def test_tiny_budget_still_gets_there():
+  added = []
+  scheduler = UploadScheduler(budget_ms=0.1)
+  scheduler.submit_steps(fake_steps(2 * CHUNK_BYTES), lambda: added.append('small'), 2 * CHUNK_BYTES)
+  for _ in range(4): # one step a frame
+    scheduler.run()
+  assert added == ['small']
+
+def test_failed_upload_dropped():
+  added = []
+  def broken_steps():
+    yield CHUNK_BYTES
+    raise ValueError('bad texture')
+  scheduler = UploadScheduler(budget_ms=5)
+  scheduler.submit_steps(broken_steps(), lambda: added.append('broken'), CHUNK_BYTES)
+  scheduler.submit_steps(fake_steps(CHUNK_BYTES), lambda: added.append('after'), CHUNK_BYTES)
+  for _ in range(6):
+    scheduler.run()
+  assert added == ['after']
+  assert scheduler.backlog() == (0, 0)
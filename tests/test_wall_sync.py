@@ -0,0 +1,18 @@
+import wall_sync
+
+def test_publish_prunes_with_no_followers():
+  pos = [0.0]
+  coordinator = wall_sync.Coordinator(0, 1920, lambda: (pos[0], True))
+  for i in range(10):
+    coordinator.publish(i, i * 500.0, 400, 300, b'x' * 1000)
+  assert len(coordinator.photos) == 10
+  pos[0] = 3000.0 # left of the wall is now 2040 so 0 to 3 have gone off
+  coordinator.publish(10, 5000.0, 400, 300, b'x')
+  assert list(coordinator.photos) == list(range(4, 11))
+
+def test_publish_capped(monkeypatch):
+  monkeypatch.setattr(wall_sync, 'MAX_PHOTOS', 5)
+  coordinator = wall_sync.Coordinator(0, 1920, lambda: (0.0, True)) # not moving
+  for i in range(20):
+    coordinator.publish(i, i * 500.0, 400, 300, b'x')
+  assert list(coordinator.photos) == list(range(15, 20))
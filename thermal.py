@@ -0,0 +1,204 @@
+#!/usr/bin/python3
+""" Slows the wall down before the firmware does it for us.
+
+A Pi 3 in a closed frame gets to 80C and the firmware throttles the CPU, after
+which the 60fps render loop and the loaders decoding back to back fight over
+what's left and the scrolling stutters far worse than if it had just gone
+slower. The ThermalGovernor reads the SoC temperature (--thermal_temp_path,
+millidegrees as sysfs has it, or vcgencmd measure_temp if that can't be read)
+and the throttle state (vcgencmd get_throttled) every CHECK_EVERY seconds and
+steps through LEVELS to stay under --thermal_target: first a lower frame rate
+(the scroll speed stays the same, it just moves further a frame), then a floor
+on the quality_governor tier, then fewer loaders at once.
+
+It steps up as soon as it's over the target or the firmware says it's
+throttling, then gives that SETTLE seconds to take effect before going up
+again. It only steps back down after COOL_SECS spent HYSTERESIS under the
+target, one level at a time, so it doesn't flap. Every change is printed with
+the temperature, throttle state and the frame rate and worst frame since the
+last check, and with --verbose every check is.
+
+--vcgencmd and --thermal_temp_path can point at a script and a file so this
+can be tried, or tested, off a Pi.
+
+  python3 thermal.py status   what the sensors say now
+"""
+import time
+import threading
+import subprocess
+import collections
+
+import Config as config
+
+# (fraction of the frame rate, fraction of the loaders, lowest quality_governor tier)
+LEVELS = [(1.0, 1.0, 0),
+          (0.75, 1.0, 0),
+          (0.5, 1.0, 1),
+          (0.5, 0.5, 2),
+          (0.33, 0.5, 3)]
+CHECK_EVERY = 5.0 # seconds between reading the sensors
+SETTLE = 30.0 # seconds a change gets to work before another step up
+COOL_SECS = 120.0 # seconds under target - HYSTERESIS before a step back down
+HYSTERESIS = 5.0 # degrees C
+LONG_FRAME = 1.0 # seconds, a gap this long is the display being off not a slow frame
+
+# get_throttled bits that are happening now, the ones 16 up say if they have since boot
+UNDER_VOLTAGE = 0x1
+FREQ_CAPPED = 0x2
+THROTTLED = 0x4
+SOFT_LIMIT = 0x8
+HOT_BITS = FREQ_CAPPED | THROTTLED | SOFT_LIMIT # under voltage is a power supply problem, slowing down won't help
+
+def vcgencmd(arg):
+  try:
+    out = subprocess.run(config.VCGENCMD.split() + [arg], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                         timeout=2, check=True).stdout.decode()
+  except (OSError, subprocess.SubprocessError):
+    return None
+  return out.strip().partition('=')[2] # i.e. temp=48.3'C or throttled=0x50005
+
+def read_temp():
+  """ degrees C, None if neither sensor can be read """
+  try:
+    with open(config.THERMAL_TEMP_PATH) as f:
+      return int(f.read().strip()) / 1000.0
+  except (OSError, ValueError):
+    pass
+  value = vcgencmd('measure_temp')
+  try:
+    return float(value.rstrip("'C"))
+  except (AttributeError, ValueError):
+    return None
+
+def read_throttled():
+  """ the get_throttled bits, None if vcgencmd isn't there """
+  try:
+    return int(vcgencmd('get_throttled'), 16)
+  except (TypeError, ValueError):
+    return None
+
+def describe_throttled(bits):
+  if bits is None:
+    return 'throttle state unknown'
+  names = [name for (bit, name) in ((UNDER_VOLTAGE, 'under voltage'), (FREQ_CAPPED, 'frequency capped'),
+                                    (THROTTLED, 'throttled'), (SOFT_LIMIT, 'soft temperature limit'))
+           if bits & bit]
+  return ', '.join(names) if names else 'not throttled'
+
+class ThermalGovernor:
+  def __init__(self, target, base_fps, base_loaders, apply):
+    """ apply(fps, loaders, quality_floor) is called from the governor's thread on a change """
+    self.target = target
+    self.base_fps = base_fps
+    self.base_loaders = base_loaders
+    self.apply = apply
+    self.level = 0
+    self.changed_at = None # time.time() of the last change
+    self.cool_since = None # when it went HYSTERESIS under the target
+    self.temp = None
+    self.throttled = None
+    self.max_temp = None
+    self.frames = 0 # since the last check
+    self.worst_frame = 0.0
+    self.last_frame = None
+    self.frames_since = time.time()
+    self.decisions = collections.deque(maxlen=20) # the latest changes for report()
+    self.lock = threading.Lock()
+
+  def settings(self, level):
+    (fps, loaders, floor) = LEVELS[level]
+    return (max(1, round(self.base_fps * fps)), max(1, round(self.base_loaders * loaders)), floor)
+
+  def decide(self, temp, throttled, now):
+    """ the level to be at now given the readings, with why if it's a change """
+    hot = ((temp is not None and temp >= self.target) or
+           (throttled is not None and throttled & HOT_BITS != 0))
+    settled = self.changed_at is None or now - self.changed_at >= SETTLE
+    if hot:
+      self.cool_since = None
+      if self.level < len(LEVELS) - 1 and settled:
+        return (self.level + 1, 'throttled' if temp is None or temp < self.target else 'over {:.0f}C'.format(self.target))
+      return (self.level, None)
+    if temp is None or temp >= self.target - HYSTERESIS:
+      self.cool_since = None
+      return (self.level, None)
+    if self.cool_since is None:
+      self.cool_since = now
+    if self.level > 0 and settled and now - self.cool_since >= COOL_SECS:
+      self.cool_since = now # another COOL_SECS before the next step down
+      return (self.level - 1, 'cool for {:.0f}s'.format(COOL_SECS))
+    return (self.level, None)
+
+  def frame(self):
+    """ call once a frame on the render thread """
+    now = time.time()
+    if self.last_frame is not None and now - self.last_frame < LONG_FRAME:
+      self.worst_frame = max(self.worst_frame, now - self.last_frame)
+    self.last_frame = now
+    self.frames += 1
+
+  def frame_metrics(self, now):
+    # frames a second and worst frame in ms since the last call
+    (frames, worst) = (self.frames, self.worst_frame)
+    (self.frames, self.worst_frame) = (0, 0.0)
+    secs = max(now - self.frames_since, 1e-3)
+    self.frames_since = now
+    return (frames / secs, worst * 1000.0)
+
+  def check(self, now=None):
+    now = time.time() if now is None else now
+    (temp, throttled) = (read_temp(), read_throttled())
+    (fps, worst_ms) = self.frame_metrics(now)
+    with self.lock:
+      if throttled is not None and throttled & UNDER_VOLTAGE and not (self.throttled or 0) & UNDER_VOLTAGE:
+        print('thermal: under voltage, check the power supply')
+      (self.temp, self.throttled) = (temp, throttled)
+      if temp is not None:
+        self.max_temp = temp if self.max_temp is None else max(self.max_temp, temp)
+      (level, why) = self.decide(temp, throttled, now)
+      changed = level != self.level
+      text = '{}, {}, {:.1f}fps worst frame {:.0f}ms'.format(
+          'no temperature' if temp is None else '{:.1f}C'.format(temp), describe_throttled(throttled), fps, worst_ms)
+      if changed:
+        (self.level, self.changed_at) = (level, now)
+        settings = self.settings(level)
+        text = 'level {} ({}) {}fps, {} loaders, quality tier {} at best: {}'.format(level, why, *settings, text)
+        self.decisions.append(time.strftime('%H:%M:%S ', time.localtime(now)) + text)
+    if changed:
+      self.apply(*settings)
+    if changed or config.VERBOSE:
+      print('thermal: ' + text)
+
+  def run(self):
+    while True:
+      time.sleep(CHECK_EVERY)
+      try:
+        self.check()
+      except Exception as e: # keep watching, whatever went wrong with one reading
+        print('''Couldn't check the temperature giving error: {}'''.format(e))
+
+  def start(self):
+    threading.Thread(target=self.run, name='thermal', daemon=True).start()
+
+  def report(self):
+    with self.lock:
+      (fps, loaders, floor) = self.settings(self.level)
+      lines = ['thermal: {} ({}), target {:.0f}C, hottest {}'.format(
+               'no temperature' if self.temp is None else '{:.1f}C'.format(self.temp), describe_throttled(self.throttled),
+               self.target, 'unknown' if self.max_temp is None else '{:.1f}C'.format(self.max_temp)),
+               'level {} of {}: {}fps, {} loaders, quality tier {} at best'.format(
+               self.level, len(LEVELS) - 1, fps, loaders, floor)]
+      lines += list(self.decisions)
+    return '\n'.join(lines)
+
+def status():
+  temp = read_temp()
+  print('{}, {}, target {:.0f}C'.format('no temperature' if temp is None else '{:.1f}C'.format(temp),
+                                        describe_throttled(read_throttled()), config.THERMAL_TARGET))
+
+if __name__ == '__main__':
+  COMMAND = config.command('status')
+  if COMMAND == 'status':
+    status()
+  else:
+    print(__doc__)
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+""" Photos bigger than one texture should be, for 4K walls.
+
+pi3d shrinks anything over MAX_SIZE (2048) to fit, and going bigger is what
+the TODOs in PhotoUtils.max_dimension() warn about on Pis before the 4. With
+--tile_size set the render is kept at full size and a photo bigger than
+MAX_SIZE is shown by a TiledSprite instead: one Shape, at the photo's
+position so it moves like any other sprite, with a quad per tile of a grid
+cut from the pixels, each quad drawing its own small texture.
+
+Only the columns of tiles that are on screen, or about to come on, have
+their textures made. show_between() is called each frame with the part of
+the photo that can be seen and uploads what's coming on through the
+upload_scheduler, and drops what has gone off, so however big the photos the
+GPU holds about a screen's worth of them. The lanes are always on screen top
+to bottom so it's only columns that come and go. The pixels stay in memory
+as the loader left them - mapped straight from the file for a raw_cache hit,
+so tiles that aren't wanted any more don't even have to stay in RAM.
+"""
+import numpy as np
+
+import Config as config
+
+try:
+  import pi3d
+  from pi3d.Texture import MAX_SIZE
+except ImportError: # only for the tests
+  pi3d = None
+  MAX_SIZE = 2048
+
+AHEAD_SECS = 3.0 # tiles are uploaded this long before they scroll on
+MAX_DIMENSION = 7680 # renders are still clamped to this, an 8K panel's width
+Z = 20.0 # same as an ImageSprite
+
+class Tiles:
+  """ pixels too big for one texture, in place of a pi3d.Texture from the loader """
+  def __init__(self, pixels):
+    self.pixels = pixels # (h, w, channels) uint8, may be a view of a raw_cache map
+
+  @property
+  def width(self):
+    return self.pixels.shape[1]
+
+  @property
+  def height(self):
+    return self.pixels.shape[0]
+
+def needs_tiles(width, height):
+  return config.TILE_SIZE > 0 and max(width, height) > MAX_SIZE
+
+def texture_or_tiles(im):
+  """ a pi3d.Texture for the PIL image im, or Tiles when it's too big for one.
+  im can be a shared_assets.Frame too """
+  if hasattr(im, 'pixels'):
+    if max(im.width, im.height) <= MAX_SIZE: # straight from the frame's slot, given back once uploaded
+      texture = pi3d.Texture(im.pixels, blend=True, m_repeat=True, free_after_load=True)
+      texture.on_uploaded = im.release
+      return texture
+    # tiles are cut for as long as the photo is up so they can't come from the slot
+    copy = Tiles(im.pixels.copy()) if needs_tiles(im.width, im.height) else im.to_pil()
+    im.release()
+    if isinstance(copy, Tiles):
+      return copy
+    im = copy
+  if needs_tiles(im.width, im.height):
+    if im.mode not in ('RGB', 'RGBA'):
+      im = im.convert('RGBA') # as pi3d does
+    return Tiles(np.asarray(im))
+  return pi3d.Texture(im, blend=True, m_repeat=True, automatic_resize=config.AUTO_RESIZE, free_after_load=True)
+
+def tile_edges(size, tile):
+  """ where the tiles start along one side, with the end of the last one """
+  return list(range(0, size, tile)) + [size]
+
+def wanted_columns(col_edges, scale, left, right):
+  """ range of columns showing any of left to right, which are in world units
+  from the photo's left edge. scale is pixels per world unit """
+  (first, last) = (left * scale, right * scale)
+  cols = len(col_edges) - 1
+  start = max(0, min(cols, int(np.searchsorted(col_edges, first, side='right')) - 1))
+  end = max(0, min(cols, int(np.searchsorted(col_edges, last, side='left'))))
+  return range(start, max(start, end))
+
+if pi3d is not None:
+  class TiledSprite(pi3d.Shape):
+    """ w by h in world units, like an ImageSprite, showing tiles.pixels.
+    Call show_between() on the render thread each frame """
+    def __init__(self, tiles, w, h, camera, shader, uploads, tile=None):
+      pi3d.Shape.__init__(self, camera, None, 'tiled', 0.0, 0.0, Z, 0.0, 0.0, 0.0, 1.0, 1.0, 1.0, 0.0, 0.0, 0.0)
+      self.tiles = tiles
+      self.shader = shader
+      self.uploads = uploads
+      tile = tile or config.TILE_SIZE
+      self.col_edges = tile_edges(tiles.width, tile)
+      self.row_edges = tile_edges(tiles.height, tile)
+      self.scale = tiles.width / w # pixels per world unit
+      (self.w, self.h) = (w, h)
+      self.pieces = {} # (row, col) -> Buffer for tiles that are up
+      self.wanted = range(0) # columns that should be up or on the way
+      self.pending = set() # columns being uploaded
+      self.buf = []
+
+    def quad(self, row, col):
+      # world corners of one tile with (0, 0) the middle of the photo, the first row at the top
+      (x0, x1) = (self.col_edges[col] / self.scale - self.w / 2, self.col_edges[col + 1] / self.scale - self.w / 2)
+      sy = self.tiles.height / self.h
+      (y0, y1) = (self.h / 2 - self.row_edges[row] / sy, self.h / 2 - self.row_edges[row + 1] / sy)
+      verts = ((x0, y0, 0.0), (x1, y0, 0.0), (x1, y1, 0.0), (x0, y1, 0.0))
+      uvs = ((0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0))
+      return pi3d.Buffer(self, verts, uvs, ((3, 0, 1), (1, 2, 3)), ((0.0, 0.0, -1.0),) * 4)
+
+    def show_between(self, left, right):
+      """ left and right in world units from the photo's left edge """
+      wanted = wanted_columns(self.col_edges, self.scale, left, right)
+      if wanted == self.wanted:
+        return
+      self.wanted = wanted
+      for col in range(len(self.col_edges) - 1):
+        if col in wanted and col not in self.pending and (0, col) not in self.pieces:
+          self.pending.add(col)
+          for row in range(len(self.row_edges) - 1):
+            self.upload(row, col)
+        elif col not in wanted and (0, col) in self.pieces:
+          for row in range(len(self.row_edges) - 1):
+            self.pieces.pop((row, col), None)
+      self.buf = list(self.pieces.values())
+
+    def upload(self, row, col):
+      # a view, the upload copies it a chunk at a time
+      pixels = self.tiles.pixels[self.row_edges[row]:self.row_edges[row + 1], self.col_edges[col]:self.col_edges[col + 1]]
+      texture = pi3d.Texture(pixels, blend=True, m_repeat=True, free_after_load=True) # mirrored edges don't show seams
+      def then():
+        if row == len(self.row_edges) - 2:
+          self.pending.discard(col)
+        if col not in self.wanted:
+          return # gone off again while it was uploading
+        piece = self.quad(row, col)
+        piece.set_draw_details(self.shader, [texture])
+        self.pieces[(row, col)] = piece
+        self.buf = list(self.pieces.values())
+      self.uploads.submit(texture, then)
+
+    def resident_bytes(self):
+      return sum(piece.textures[0].ix * piece.textures[0].iy * self.tiles.pixels.shape[2]
+                 for piece in self.pieces.values())
+
+    def repaint(self, t):
+      self.draw()
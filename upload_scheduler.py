@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+""" Gets loaded photos onto the GPU from the render loop without hitches.
+
+The loaders still do everything to the pixels - decode, matting and the
+pi3d.Texture's own resize and conversion to a numpy array, none of which
+touches GL - then submit() the texture with what to do once it's up. The GL
+texture is only made on the render thread, by run() between frames: each call
+spends at most budget_ms on uploads, a chunk of rows at a time with
+glTexSubImage2D so one big photo is spread over several frames rather than
+landing in the middle of one. Making the mipmaps can't be split so it's a
+step of its own. When a texture is all there its then() makes the sprite
+and adds it to the wall, on the render thread too.
+
+How long a chunk takes is learnt as the uploads go so the last one of a frame
+isn't started if it won't fit. At least one is always done a frame, so a
+budget that's too small only slows the uploads, it can't stop them.
+"""
+import time
+import threading
+import collections
+
+import numpy as np
+
+try:
+  import ctypes
+  import pi3d
+  from pi3d.constants import (opengles, GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_TEXTURE_MAG_FILTER,
+                              GL_TEXTURE_WRAP_S, GL_TEXTURE_WRAP_T, GL_UNSIGNED_BYTE, GL_OUT_OF_MEMORY)
+  GL_UNPACK_ALIGNMENT = 0x0CF5
+except ImportError: # only for the tests
+  pi3d = None
+
+CHUNK_BYTES = 1 << 20 # about 2ms on a Pi 3, rows of a 1920 wide RGB photo are ~5.6kB so ~180 rows
+RATE_SMOOTHING = 0.2 # weight of the latest chunk in the bytes/s estimate
+
+def texture_levels(texture):
+  # a raw_cache.RawTexture brings its own mip levels, others have the one image
+  levels = getattr(texture, 'mip_levels', None)
+  return levels if levels else [texture.image]
+
+def texture_nbytes(texture):
+  return sum(level.nbytes for level in texture_levels(texture))
+
+def upload_steps(texture):
+  """ the GL half of texture.load_opengl() done a chunk of rows at a time,
+  yields the bytes sent by each step (0 for ones that aren't uploads) """
+  levels = texture_levels(texture)
+  opengles.glGenTextures(1, ctypes.byref(texture._tex))
+  display = pi3d.Display.Display.INSTANCE
+  if display is not None: # so the texture is deleted when it's freed
+    display.textures_dict[str(texture._tex)] = [texture._tex, 0]
+  opengles.glBindTexture(GL_TEXTURE_2D, texture._tex)
+  for t in [GL_TEXTURE_MIN_FILTER, GL_TEXTURE_MAG_FILTER]:
+    opengles.glTexParameteri(GL_TEXTURE_2D, t, texture._get_filter(t))
+  opengles.glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, texture.m_repeat)
+  opengles.glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, texture.m_repeat)
+  for (i, level) in enumerate(levels):
+    (h, w) = level.shape[:2]
+    iformat = texture._get_format_from_array(level, texture.i_format)
+    opengles.glTexImage2D(GL_TEXTURE_2D, i, iformat, w, h, 0, iformat, GL_UNSIGNED_BYTE, None) # room only
+    row_bytes = level.nbytes // h
+    rows = max(1, CHUNK_BYTES // row_bytes)
+    for top in range(0, h, rows):
+      chunk = np.ascontiguousarray(level[top:top + rows]) # a copy only for views like TiledSprite's tiles
+      # other textures are bound for drawing between steps so bind again each time
+      opengles.glBindTexture(GL_TEXTURE_2D, texture._tex)
+      opengles.glPixelStorei(GL_UNPACK_ALIGNMENT, 1) # rows of the smaller levels aren't multiples of 4
+      opengles.glTexSubImage2D(GL_TEXTURE_2D, i, 0, top, w, len(chunk), iformat, GL_UNSIGNED_BYTE,
+                               chunk.ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)))
+      opengles.glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+      yield chunk.nbytes
+  if opengles.glGetError() == GL_OUT_OF_MEMORY:
+    print('Out of GPU memory uploading a {}x{} texture'.format(texture.ix, texture.iy))
+  if texture.mipmap and len(levels) == 1:
+    yield 0 # a step of its own so the budget is checked first, it's about as slow as the upload
+    opengles.glBindTexture(GL_TEXTURE_2D, texture._tex)
+    opengles.glGenerateMipmap(GL_TEXTURE_2D)
+  texture.opengl_loaded = True # so pi3d doesn't upload it again when the sprite is first drawn
+  if texture.free_after_load: # as pi3d does
+    texture.image = None
+    texture.file_string = None
+    texture._loaded = False
+    if hasattr(texture, 'mip_levels'):
+      texture.mip_levels = None
+  if hasattr(texture, 'on_uploaded'): # i.e. to give a shared_assets frame back
+    texture.on_uploaded()
+
+class UploadScheduler:
+  def __init__(self, budget_ms):
+    self.budget_ms = budget_ms
+    self.queue = collections.deque() # [steps, then, nbytes, time submitted] oldest first
+    self.lock = threading.Lock()
+    self.queued_bytes = 0
+    self.rate = None # bytes/s the chunks have been going up at
+    self.done = 0
+    self.waited = 0.0 # total seconds from submit() to then()
+    self.busy_frames = 0 # frames with any upload work
+    self.busy_ms = 0.0
+    self.max_ms = 0.0
+    self.over_frames = 0 # busy frames that went over budget_ms
+
+  def submit(self, texture, then):
+    """ from any thread. then() is called on the render thread once texture is on the GPU """
+    self.submit_steps(upload_steps(texture), then, texture_nbytes(texture))
+
+  def submit_steps(self, steps, then, nbytes):
+    with self.lock:
+      self.queue.append([steps, then, nbytes, time.time()])
+      self.queued_bytes += nbytes
+
+  def call_soon(self, then):
+    """ then() on the render thread, in turn with the uploads """
+    self.submit_steps(iter(()), then, 0)
+
+  def backlog(self):
+    """ (textures, bytes) still waiting """
+    with self.lock:
+      return (len(self.queue), self.queued_bytes)
+
+  def finish(self, job, error=None):
+    (_steps, then, nbytes, submitted) = job
+    with self.lock:
+      self.queue.popleft()
+      self.queued_bytes -= nbytes
+    if error is not None:
+      print('''Couldn't upload a texture giving error: {}'''.format(error))
+      return
+    self.done += 1
+    self.waited += time.time() - submitted
+    try:
+      then()
+    except Exception as e:
+      print('''Couldn't add an uploaded photo giving error: {}'''.format(e))
+
+  def run(self):
+    """ call once a frame on the render thread """
+    start = time.time()
+    deadline = start + self.budget_ms / 1000.0
+    steps_done = 0
+    while True:
+      with self.lock:
+        if len(self.queue) == 0:
+          break
+        job = self.queue[0]
+      now = time.time()
+      if steps_done > 0 and (now >= deadline or
+                             (self.rate is not None and now + CHUNK_BYTES / self.rate > deadline)):
+        break # the next chunk probably wouldn't fit
+      try:
+        sent = next(job[0])
+      except StopIteration:
+        self.finish(job)
+        continue
+      except Exception as e:
+        self.finish(job, e)
+        continue
+      steps_done += 1
+      secs = time.time() - now
+      if sent > 0 and secs > 0:
+        rate = sent / secs
+        self.rate = rate if self.rate is None else (1.0 - RATE_SMOOTHING) * self.rate + RATE_SMOOTHING * rate
+    if steps_done > 0:
+      ms = (time.time() - start) * 1000.0
+      self.busy_frames += 1
+      self.busy_ms += ms
+      self.max_ms = max(self.max_ms, ms)
+      if ms > self.budget_ms:
+        self.over_frames += 1
+
+  def report(self):
+    (waiting, nbytes) = self.backlog()
+    text = 'uploads: {} waiting ({:.1f}MB), {} done'.format(waiting, nbytes / 1e6, self.done)
+    if self.done > 0:
+      text += ', {:.2f}s from loaded to on the wall'.format(self.waited / self.done)
+    if self.busy_frames > 0:
+      text += ', {:.1f}ms a busy frame (max {:.1f}) against {}ms, {} of {} over'.format(
+          self.busy_ms / self.busy_frames, self.max_ms, self.budget_ms, self.over_frames, self.busy_frames)
+    if self.rate is not None:
+      text += ', {:.0f}MB/s'.format(self.rate / 1e6)
+    return text
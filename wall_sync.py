@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+""" One wall across several Pis side by side. The coordinator is a normal
+index.py that also owns the play order, layout and rendering for the whole
+wall. Followers have no library, layout or loaders - they just show what they
+are sent over the LAN.
+
+Node k's screen is centred k display widths to the right of node 0's, so the
+photos come on at the right of the last node and go off the left of node 0.
+All the nodes are assumed to have the same size display.
+
+Every message is '!II' (header bytes, payload bytes) then a JSON header then
+the payload. The coordinator sends each follower:
+
+  {"type": "clock", "pos": P, "speed": v, "on": true}
+      P is the strip x (see strip_layout) of the middle of node 0 and v how
+      fast it's moving in pixels a second, SEND_EVERY seconds apart
+  {"type": "photo", "id": n, "left": x, "width": w, "height": h} + image file
+      the rendered photo at strip x - sent once, and only once it's within
+      LEAD display widths of the right of that follower's screen, so a node
+      that joins late isn't sent what has already gone past it
+
+and a follower starts by sending {"type": "hello", "node_index": k}.
+
+Followers run their own clock from the last P and v so they move smoothly
+between updates, easing out any difference when the next one arrives.
+
+For testing on one machine without a display or photos:
+
+  python3 wall_sync.py coordinator 5870
+  python3 wall_sync.py follower localhost 5870 1
+"""
+import sys
+import json
+import math
+import time
+import socket
+import struct
+import threading
+import collections
+
+DEFAULT_PORT = 5870
+SEND_EVERY = 0.1 # seconds between clock updates
+LEAD = 1.5 # display widths ahead of a follower's screen a photo is sent
+EASE_TIME = 0.5 # seconds for a follower to ease out most of a clock difference
+SNAP_DISTANCE = 200 # pixels out by more than this and a follower just jumps
+RECONNECT_EVERY = 2.0 # seconds
+MAX_PHOTOS = 100 # kept for followers at most, oldest dropped first, in case the wall stops moving
+
+HEADER = struct.Struct('!II')
+
+def send_msg(conn, header, payload=b''):
+  data = json.dumps(header).encode('utf-8')
+  conn.sendall(HEADER.pack(len(data), len(payload)) + data + payload)
+
+def recv_msg(f):
+  """ (header, payload) or None when the other end has gone """
+  fixed = f.read(HEADER.size)
+  if len(fixed) < HEADER.size:
+    return None
+  (header_len, payload_len) = HEADER.unpack(fixed)
+  header = json.loads(f.read(header_len).decode('utf-8'))
+  payload = f.read(payload_len) if payload_len > 0 else b''
+  if len(payload) < payload_len:
+    return None
+  return (header, payload)
+
+class Coordinator:
+  """ position() returns (P, display_on) as described above """
+  def __init__(self, port, display_width, position):
+    self.port = port
+    self.display_width = display_width
+    self.position = position
+    self.photos = collections.OrderedDict() # id -> (header, payload) in the order they'll come on
+    self.lock = threading.Lock()
+    self.followers = 0
+    self.sent_bytes = 0
+
+  def start(self):
+    threading.Thread(target=self.serve, daemon=True).start()
+
+  def publish(self, photo_id, left, width, height, payload):
+    header = {'type': 'photo', 'id': photo_id, 'left': left, 'width': width, 'height': height}
+    with self.lock:
+      self.photos[photo_id] = (header, payload)
+      while len(self.photos) > MAX_PHOTOS:
+        self.photos.popitem(last=False)
+    self.prune(self.position()[0]) # followers prune as well but there may be none
+
+  def serve(self):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('', self.port))
+    server.listen(8)
+    while True:
+      (conn, addr) = server.accept()
+      threading.Thread(target=self.serve_follower, args=(conn, addr), daemon=True).start()
+
+  def prune(self, pos):
+    # once a photo is off the left of node 0 nobody will want it
+    wall_left = pos - self.display_width / 2
+    with self.lock:
+      for photo_id in [i for (i, (h, _p)) in self.photos.items() if h['left'] + h['width'] < wall_left]:
+        del self.photos[photo_id]
+
+  def serve_follower(self, conn, addr):
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # clock updates shouldn't wait
+    sent = set()
+    with self.lock:
+      self.followers += 1
+    try:
+      reply = recv_msg(conn.makefile('rb'))
+      if reply is None or reply[0].get('type') != 'hello':
+        return
+      node_index = int(reply[0]['node_index'])
+      print('follower {} at {} joined'.format(node_index, addr[0]))
+      (last_pos, last_tm) = (None, None)
+      while True:
+        (pos, display_on) = self.position()
+        now = time.monotonic()
+        speed = 0.0 if last_pos is None else (pos - last_pos) / max(now - last_tm, 1e-3)
+        (last_pos, last_tm) = (pos, now)
+        send_msg(conn, {'type': 'clock', 'pos': pos, 'speed': speed, 'on': display_on})
+
+        centre = pos + node_index * self.display_width
+        (view_left, view_right) = (centre - self.display_width / 2, centre + self.display_width / 2)
+        with self.lock:
+          due = [(h, p) for (i, (h, p)) in self.photos.items() if i not in sent
+                 and h['left'] < view_right + LEAD * self.display_width
+                 and h['left'] + h['width'] > view_left]
+        for (header, payload) in due:
+          send_msg(conn, header, payload)
+          sent.add(header['id'])
+          self.sent_bytes += len(payload)
+        self.prune(pos)
+        with self.lock:
+          sent.intersection_update(self.photos) # forget ids of pruned photos
+        time.sleep(SEND_EVERY)
+    except (OSError, ValueError) as e:
+      print('follower at {} gone: {}'.format(addr[0], e))
+    finally:
+      conn.close()
+      with self.lock:
+        self.followers -= 1
+
+class Follower:
+  """ on_photo(header, payload) is called on the receiving thread for each new photo """
+  def __init__(self, host, port, node_index, display_width, on_photo):
+    self.host = host
+    self.port = port
+    self.node_index = node_index
+    self.display_width = display_width
+    self.on_photo = on_photo
+    self.display_on = True
+    self.clock = None # (P, speed, time received, correction)
+    self.lock = threading.Lock()
+    self.have = {} # id -> right edge, so photos sent again after a reconnect are ignored
+
+  def start(self):
+    threading.Thread(target=self.run, daemon=True).start()
+
+  def position(self, now=None):
+    """ P now, or None before the first clock update """
+    with self.lock:
+      if self.clock is None:
+        return None
+      (pos, speed, tm, correction) = self.clock
+    now = time.monotonic() if now is None else now
+    return pos + speed * (now - tm) + correction * math.exp(-(now - tm) / EASE_TIME)
+
+  def set_clock(self, pos, speed):
+    now = time.monotonic()
+    was = self.position(now)
+    correction = 0.0 if was is None or abs(was - pos) > SNAP_DISTANCE else was - pos
+    with self.lock:
+      self.clock = (pos, speed, now, correction)
+
+  def run(self):
+    while True:
+      try:
+        with socket.create_connection((self.host, self.port)) as conn:
+          conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+          send_msg(conn, {'type': 'hello', 'node_index': self.node_index})
+          f = conn.makefile('rb')
+          while True:
+            msg = recv_msg(f)
+            if msg is None:
+              break
+            self.handle(*msg)
+      except OSError as e:
+        print('''Couldn't reach coordinator at {}:{} giving error: {}'''.format(self.host, self.port, e))
+      time.sleep(RECONNECT_EVERY)
+
+  def handle(self, header, payload):
+    if header['type'] == 'clock':
+      self.set_clock(header['pos'], header['speed'])
+      self.display_on = header['on']
+    elif header['type'] == 'photo':
+      if header['id'] in self.have:
+        return
+      wall_left = (self.position() or 0.0) - self.display_width / 2
+      for photo_id in [i for (i, right) in self.have.items() if right < wall_left]:
+        del self.have[photo_id] # off the left of node 0 so won't be sent again
+      self.have[header['id']] = header['left'] + header['width']
+      self.on_photo(header, payload)
+
+def test_coordinator(port):
+  # a wall 1000 pixels wide scrolling at 60 pixels a second with a photo every 300
+  width = 1000
+  t0 = time.monotonic()
+  coordinator = Coordinator(port, width, lambda: (60.0 * (time.monotonic() - t0), True))
+  coordinator.start()
+  photo_id = 0
+  while True:
+    pos = 60.0 * (time.monotonic() - t0)
+    while photo_id * 300 < pos + 3 * width:
+      coordinator.publish(photo_id, photo_id * 300, 250, 200, bytes(50000))
+      photo_id += 1
+    print('P {:8.1f}, {} followers, {} queued, {:.1f} MB sent'.format(pos, coordinator.followers,
+          len(coordinator.photos), coordinator.sent_bytes / 1048576))
+    time.sleep(1.0)
+
+def test_follower(host, port, node_index):
+  follower = Follower(host, port, node_index, 1000,
+                      lambda header, payload: print('photo {id} at {left:.0f}'.format(**header), len(payload), 'bytes'))
+  follower.start()
+  while True:
+    time.sleep(1.0)
+    pos = follower.position()
+    if pos is not None:
+      print('P {:8.1f}'.format(pos))
+
+if __name__ == '__main__':
+  if len(sys.argv) >= 2 and sys.argv[1] == 'coordinator':
+    test_coordinator(int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_PORT)
+  elif len(sys.argv) >= 4 and sys.argv[1] == 'follower':
+    test_follower(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]) if len(sys.argv) > 4 else 1)
+  else:
+    print('usage: wall_sync.py coordinator [PORT] | follower HOST PORT [NODE_INDEX]')
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+""" Renders every photo in PIC_DIR into the render cache using all the cores,
+so the frame never has to decode and mat a photo itself the first time round.
+Takes the same options as start.py (see Config.py) and needs the frame's
+display size as pi3d isn't used to find it, e.g.
+
+  python3 warm_cache.py --pic_dir /mnt/photos --cache_dir /mnt/photos/.photowall \
+          --display_w 1920 --display_h 1080
+
+It can run on a faster machine against the same directory as long as the frame
+then uses that cache_dir. Anything already rendered and unchanged is skipped,
+so it's fine to stop it with ctrl-c and start it again later. The workers don't
+trim the cache as they go, that's done once at the end to --render_cache_mb so
+it doesn't throw away what it has just made.
+"""
+import sys
+import time
+import multiprocessing
+
+import Config as config
+import PhotoUtils
+import render_cache
+import shared_assets
+
+def init_worker(display_size, assets):
+  render_cache.evict_on_save = False
+  shared_assets.init_worker(display_size, assets)
+
+def render_one(job):
+  (fname, mat_type) = job
+  try:
+    # a list of one so exif is read as in the frame but there's nothing to pair with
+    PhotoUtils.render_image(shared_assets.worker_matter, 0, [PhotoUtils.Pic(fname)], mat_type=mat_type)
+    return (fname, None)
+  except Exception as e:
+    return (fname, str(e))
+
+def format_tm(secs):
+  secs = int(secs)
+  return '{:d}:{:02d}:{:02d}'.format(secs // 3600, (secs // 60) % 60, secs % 60)
+
+def main():
+  if config.DISPLAY_W is None or config.DISPLAY_H is None:
+    print('warm_cache.py needs --display_w and --display_h set to the size of the frame')
+    return 1
+  display_size = (config.DISPLAY_W, config.DISPLAY_H)
+  workers = config.RENDER_WORKERS or multiprocessing.cpu_count()
+
+  PhotoUtils.shuffle = False # order doesn't matter here and sorted is easier to follow
+  file_list, num_files = PhotoUtils.get_files()
+  check_matter = PhotoUtils.make_matter(display_size) # the workers each make their own
+  jobs = []
+  skipped = 0
+  for pic in file_list:
+    for mat_type in check_matter.mat_type: # the frame picks one of these per photo
+      if PhotoUtils.is_rendered(check_matter, pic, mat_type):
+        skipped += 1
+      else:
+        jobs.append((pic.fname, mat_type))
+  print('{} photos, {} already rendered, {} to do with {} workers'.format(
+        num_files, skipped, len(jobs), workers))
+  if len(jobs) == 0:
+    return 0
+
+  done = 0
+  failed = 0
+  start_tm = time.time()
+  last_report = 0.0
+  assets = shared_assets.SharedAssets.create(display_size) # the mat resources decoded once for all the workers
+  pool = multiprocessing.Pool(workers, init_worker, (display_size, assets.descriptor()))
+  try:
+    for (fname, error) in pool.imap_unordered(render_one, jobs):
+      done += 1
+      if error is not None:
+        failed += 1
+        if config.VERBOSE:
+          print('''Couldn't render {} giving error: {}'''.format(fname, error))
+      tm = time.time()
+      if tm - last_report > 2.0 or done == len(jobs):
+        last_report = tm
+        rate = done / max(tm - start_tm, 0.001)
+        print('{}/{} done ({} failed) {:.2f} photos/s ETA {}'.format(
+              done, len(jobs), failed, rate, format_tm((len(jobs) - done) / rate)))
+    pool.close()
+    if render_cache.evict(config.RENDER_CACHE_MB) > 0:
+      print('the render cache was trimmed to --render_cache_mb {}, too small for the whole library'.format(config.RENDER_CACHE_MB))
+  except KeyboardInterrupt: # cache writes are atomic so just stop, next run carries on
+    print('stopped after {} - run again to carry on'.format(done))
+    pool.terminate()
+    return 1
+  finally:
+    pool.join()
+    assets.close()
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())